@@ -0,0 +1,168 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+"""Drives a running monitor's API from many concurrent clients.
+
+Every client holds one persistent connection and keeps up to --pipeline requests
+in flight on it. Reports throughput and latency percentiles as JSON.
+
+    python Benchmarks/api_load.py --port 1123 --clients 50 --requests 200
+    python Benchmarks/api_load.py --cmd server_control --args '{"server": "main", "control": "restart"}'
+"""
+
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+
+    return {
+        "count": len(ordered),
+        "min": round(ordered[0] * 1000, 3) if ordered else None,
+        "p50": round(percentile(ordered, 0.50) * 1000, 3) if ordered else None,
+        "p90": round(percentile(ordered, 0.90) * 1000, 3) if ordered else None,
+        "p99": round(percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+        "max": round(ordered[-1] * 1000, 3) if ordered else None
+    }
+
+class Client(threading.Thread):
+    def __init__(self, _options, _start):
+        threading.Thread.__init__(self)
+
+        self.daemon = True
+        self.options = _options
+        self.start_gate = _start
+
+        self.latencies = []
+        self.errors = 0
+        self.failures = []
+
+    def run(self):
+        try:
+            self.drive()
+        except Exception as e:
+            self.failures.append(str(e))
+
+    def drive(self):
+        options = self.options
+        connection = socket.create_connection((options.host, options.port), timeout = options.timeout)
+        stream = connection.makefile("rb")
+
+        request = {"cmd": options.cmd, "args": options.args, "auths": options.auths}
+        sent_at = {}
+        sent = 0
+        received = 0
+
+        self.start_gate.wait()
+
+        try:
+            while received < options.requests:
+                # Top the pipeline up, then wait for the oldest reply.
+                frames = []
+                while sent < options.requests and sent - received < options.pipeline:
+                    request["id"] = sent
+                    frames.append(json.dumps(request).encode("utf-8") + b"\n")
+                    sent_at[sent] = time.perf_counter()
+                    sent += 1
+
+                if frames:
+                    connection.sendall(b"".join(frames))
+
+                line = stream.readline()
+                if not line:
+                    raise ConnectionError("Connection closed by the monitor.")
+
+                now = time.perf_counter()
+                reply = json.loads(line)
+                received += 1
+
+                self.latencies.append(now - sent_at.pop(reply.get("id"), now))
+                if reply.get("error"):
+                    self.errors += 1
+        finally:
+            stream.close()
+            connection.close()
+
+def run(options):
+    start = threading.Event()
+    clients = [Client(options, start) for _ in range(options.clients)]
+
+    for client in clients:
+        client.start()
+
+    # Let every client connect before any of them starts sending.
+    time.sleep(0.2)
+
+    started = time.perf_counter()
+    start.set()
+
+    for client in clients:
+        client.join()
+
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    for client in clients:
+        latencies.extend(client.latencies)
+
+    return {
+        "benchmark": "api_load",
+        "cmd": options.cmd,
+        "clients": options.clients,
+        "requests_per_client": options.requests,
+        "pipeline": options.pipeline,
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "error_replies": sum(client.errors for client in clients),
+        "failed_clients": [failure for client in clients for failure in client.failures],
+        "latency_ms": summarize(latencies)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 1123)
+    parser.add_argument("--clients", type = int, default = 20)
+    parser.add_argument("--requests", type = int, default = 100, help = "requests per client")
+    parser.add_argument("--pipeline", type = int, default = 1, help = "requests in flight per connection")
+    parser.add_argument("--cmd", default = "get_servers")
+    parser.add_argument("--args", type = json.loads, default = {}, help = "command arguments, as JSON")
+    parser.add_argument("--auths", nargs = "*", default = ["R_ADMIN"])
+    parser.add_argument("--timeout", type = float, default = 60)
+    parser.add_argument("--output", help = "write the results here instead of stdout")
+    options = parser.parse_args()
+
+    result = run(options)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(result, f, indent = 2)
+    else:
+        json.dump(result, sys.stdout, indent = 2)
+        print()
+
+if __name__ == '__main__':
+    main()
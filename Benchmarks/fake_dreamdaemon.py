@@ -0,0 +1,114 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+"""A stand-in for DreamDaemon, for benchmarks.
+
+Takes the same arguments the monitor hands DreamDaemon, and behaves according to
+FAKE_DD_MODE:
+
+    run     listen on the port and answer Topic status queries until terminated
+    crash   exit with code 1 after FAKE_DD_UPTIME seconds
+    exit    exit cleanly after FAKE_DD_UPTIME seconds, like a finished round
+    hang    accept connections but never answer, and ignore SIGTERM
+    chatty  like run, printing FAKE_DD_LINES lines per second to stdout
+
+FAKE_DD_BOOT delays the listener to mimic world startup. If FAKE_DD_STAMP names a
+directory, crash and exit modes write the wall clock time they exit at to a file
+named after the port there, so exit detection latency can be measured.
+"""
+
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+
+def get_port(argv):
+    for arg in argv:
+        if arg.startswith("-port"):
+            return int(arg.split()[-1])
+
+    return 0
+
+def answer_topics(listener, players):
+    body = b"\x06" + "version=fake&mode=extended&players={0}&tick_usage=12.5".format(players).encode("utf-8") + b"\x00"
+    reply = b"\x00\x83" + struct.pack(">H", len(body)) + body
+
+    while True:
+        connection, _address = listener.accept()
+
+        try:
+            connection.settimeout(2)
+            if connection.recv(1024)[:2] == b"\x00\x83":
+                connection.sendall(reply)
+        except OSError:
+            pass
+        finally:
+            connection.close()
+
+def main():
+    mode = os.environ.get("FAKE_DD_MODE", "run")
+    uptime = float(os.environ.get("FAKE_DD_UPTIME", "1"))
+    port = get_port(sys.argv)
+
+    print("Fake DreamDaemon starting in {0} mode on port {1}.".format(mode, port), flush=True)
+
+    if mode in ("crash", "exit"):
+        time.sleep(uptime)
+
+        if os.environ.get("FAKE_DD_STAMP"):
+            with open(os.path.join(os.environ["FAKE_DD_STAMP"], str(port)), "w") as f:
+                f.write(repr(time.time()))
+
+        sys.exit(1 if mode == "crash" else 0)
+
+    if mode == "hang":
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    time.sleep(float(os.environ.get("FAKE_DD_BOOT", "0")))
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", port))
+    listener.listen(64)
+
+    if mode == "hang":
+        while True:
+            time.sleep(3600)
+
+    threading.Thread(target=answer_topics, args=(listener, 0), daemon=True).start()
+
+    if mode == "chatty":
+        rate = int(os.environ.get("FAKE_DD_LINES", "1000"))
+        line = 0
+
+        while True:
+            started = time.monotonic()
+
+            for _ in range(rate):
+                print("[{0}] runtime error: fake runtime number {1}".format(time.strftime("%H:%M:%S"), line))
+                line += 1
+
+            sys.stdout.flush()
+            time.sleep(max(0, 1 - (time.monotonic() - started)))
+
+    while True:
+        time.sleep(3600)
+
+if __name__ == '__main__':
+    main()
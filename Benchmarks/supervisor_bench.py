@@ -0,0 +1,206 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+"""Measures the supervisor's lifecycle costs across 1 to 100 servers.
+
+Every server runs the fake DreamDaemon in exit mode, so it closes after --uptime
+seconds and the restart policy brings it straight back. For each server count the
+benchmark records how long the supervisor took to notice an exit, how long a
+restart took after that, and the thread and memory cost of supervising the lot.
+
+    python Benchmarks/supervisor_bench.py --counts 1 10 50 100 --duration 10
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ServerMonitor.Subsystems import EventBus, Server, ServerData, Supervisor
+
+FAKE_DD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_dreamdaemon.py")
+
+def summarize(samples):
+    ordered = sorted(samples)
+
+    if not ordered:
+        return {"count": 0}
+
+    return {
+        "count": len(ordered),
+        "p50": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p99": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3)
+    }
+
+def get_rss():
+    """Resident memory of this process in KiB, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+def make_tree(root):
+    """Lays out a BYOND directory holding the fake DreamDaemon, plus game and git paths."""
+    byond_path = os.path.join(root, "byond")
+    game_path = os.path.join(root, "game")
+    git_path = os.path.join(root, "git")
+
+    for path in (byond_path, game_path, git_path):
+        os.makedirs(path)
+
+    with open(byond_path + "\\dreamdaemon.exe", "w") as f:
+        f.write("#!{0}\nimport runpy\nrunpy.run_path({1!r}, run_name = '__main__')\n".format(sys.executable, FAKE_DD))
+
+    os.chmod(byond_path + "\\dreamdaemon.exe", stat.S_IRWXU)
+
+    with open(byond_path + "\\dreammaker.exe", "w") as f:
+        f.write("#!/bin/sh\n")
+
+    with open(game_path + "\\baystation12.dmb", "w") as f:
+        f.write("")
+
+    return byond_path, game_path, git_path
+
+class Recorder:
+    """Pairs up exit stamps, stopped events and started events per server."""
+    def __init__(self, _stamp_path):
+        self.stamp_path = _stamp_path
+        self.ports = {}
+        self.stopped_at = {}
+        self.detection = []
+        self.restart = []
+        self.lock = threading.Lock()
+
+    def on_event(self, event):
+        name = event["server"]
+
+        with self.lock:
+            if event["event"] == "stopped" and not event["data"]["expected"]:
+                self.stopped_at[name] = event["time"]
+
+                try:
+                    with open(os.path.join(self.stamp_path, str(self.ports[name]))) as f:
+                        self.detection.append(event["time"] - float(f.read()))
+                except (OSError, ValueError):
+                    pass
+
+            elif event["event"] == "started" and name in self.stopped_at:
+                self.restart.append(event["time"] - self.stopped_at.pop(name))
+
+def run_count(count, options, logger):
+    root = tempfile.mkdtemp(prefix = "sm-bench-")
+
+    try:
+        byond_path, game_path, git_path = make_tree(root)
+        stamp_path = os.path.join(root, "stamps")
+        os.makedirs(stamp_path)
+
+        os.environ["FAKE_DD_MODE"] = "exit"
+        os.environ["FAKE_DD_UPTIME"] = str(options.uptime)
+        os.environ["FAKE_DD_STAMP"] = stamp_path
+
+        threads_before = threading.active_count()
+        rss_before = get_rss()
+
+        supervisor = Supervisor(logger)
+        supervisor.start()
+
+        events = EventBus(logger)
+        recorder = Recorder(stamp_path)
+        events.add_listener(recorder.on_event)
+
+        # Restart immediately and never park, so every exit is a restart to measure.
+        restart = {"min-uptime": 0, "backoff-base": 0, "jitter": 0, "max-crashes": 1000000}
+
+        servers = []
+        for i in range(count):
+            name = "bench{0}".format(i)
+            data = ServerData(name, game_path, git_path, byond_path, options.base_port + i, "-invisible", True, {}, restart)
+            recorder.ports[name] = data.port
+            servers.append(Server(data, logger, supervisor, events))
+
+        started = time.perf_counter()
+        for server in servers:
+            server.start()
+        start_all = time.perf_counter() - started
+
+        time.sleep(options.duration)
+
+        threads_during = threading.active_count()
+        rss_during = get_rss()
+
+        started = time.perf_counter()
+        for server in servers:
+            server.stop_server()
+        stop_all = time.perf_counter() - started
+
+        supervisor.stop()
+
+        return {
+            "servers": count,
+            "start_all": round(start_all, 3),
+            "stop_all": round(stop_all, 3),
+            "exit_detection_ms": summarize(recorder.detection),
+            "restart_ms": summarize(recorder.restart),
+            "threads": threads_during - threads_before,
+            "rss_kib": rss_during - rss_before if rss_before is not None else None
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors = True)
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--counts", type = int, nargs = "+", default = [1, 10, 50, 100])
+    parser.add_argument("--duration", type = float, default = 10, help = "seconds to run each server count for")
+    parser.add_argument("--uptime", type = float, default = 1, help = "seconds each fake DreamDaemon lives")
+    parser.add_argument("--base-port", type = int, default = 21000)
+    parser.add_argument("--output", help = "write the results here instead of stdout")
+    options = parser.parse_args()
+
+    logger = logging.getLogger("benchmark")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    result = {
+        "benchmark": "supervisor",
+        "uptime": options.uptime,
+        "duration": options.duration,
+        "runs": [run_count(count, options, logger) for count in options.counts]
+    }
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(result, f, indent = 2)
+    else:
+        json.dump(result, sys.stdout, indent = 2)
+        print()
+
+if __name__ == '__main__':
+    main()
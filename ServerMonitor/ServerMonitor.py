@@ -14,13 +14,19 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see http://www.gnu.org/licenses/.
 
-import logging
+import concurrent.futures
+import re
+import threading
 import time
 
 from ServerMonitor.Subsystems import *
 
 class ServerMonitor:
     def __init__(self, config_path):
+        # Startup phase timings, in seconds since this point.
+        self.startup_began = time.monotonic()
+        self.startup_timings = {}
+
         # Set up the logger:
         self.logger = self.get_logger()
 
@@ -30,6 +36,8 @@ class ServerMonitor:
         try:
             self.config = Config(config_path, self.logger)
             self.logger.debug("MAIN: Creation: config created.")
+            self.log_pipeline.configure(self.config.get_value("logging"))
+            self.mark_phase("config")
         except ValueError as e:
             self.logger.error("MAIN: Value error during Config creation. {0}".format(e))
             raise RuntimeError("Exception caught during creation. Ceasing.")
@@ -37,10 +45,16 @@ class ServerMonitor:
             self.logger.error("MAIN: Runtime error during Config creation. {0}".format(e2))
             raise RuntimeError("Exception caught during creation. Ceasing.")
 
+        # Timings and counters for the monitor's own internals.
+        self.stats = Stats(self.logger, self.config.get_value("stats"))
+        self.stats.serve_http()
+
+        # Off until someone asks for a profile.
+        self.profiler = Profiler(self.logger, self.config.get_value("stats"))
+
         # Set up the API:
         try:
             self.API = API(self, self.logger, self.config)
-            self.API.start()
         except ValueError as e:
             self.logger.error("MAIN: Value error during API creation. {0}".format(e))
             raise RuntimeError("Exception caught during creation. Ceasing.")
@@ -48,14 +62,74 @@ class ServerMonitor:
             self.logger.error("MAIN: Generic exception caught during API creation. {0}".format(e2))
             raise RuntimeError("Exception caught during creation. Ceasing.")
 
-        # Events queue
-        self.events = {}
+        # Lifecycle events, for the API subscribers and anything else that cares.
+        self.events = EventBus(self.logger, self.config.get_value("events"))
+        self.events.add_listener(self.stats.on_event)
+
+        # The supervisor which watches every DreamDaemon process.
+        self.supervisor = Supervisor(self.logger)
+        self.supervisor.start()
+
+        # The job queue for long running commands.
+        self.jobs = JobQueue(self.logger, self.config.get_value("jobs"))
+
+        # The DreamMaker pipeline.
+        self.compiler = Compiler(self.logger, self.config.get_value("compile"))
+
+        # Keeps the checkouts up to date.
+        self.updater = Updater(self.logger, self.config.get_value("update"))
+
+        # Samples the resource use of every DreamDaemon.
+        self.sampler = ResourceSampler(self, self.logger, self.config.get_value("metrics"))
+        self.sampler.start()
+
+        # Keeps tabs on whether the worlds actually respond.
+        self.prober = HealthProber(self, self.logger, self.config.get_value("health"))
+        self.prober.start()
+
+        # The pre-serialized get_servers reply.
+        self.status = StatusSnapshot(self.build_status)
+        self.events.add_listener(lambda event: self.status.invalidate())
+
+        # Other monitors whose servers are served alongside ours.
+        self.federation = Federation(self.logger, self.config.get_value("federation"))
+
+        # The longest a get_servers long-poll may wait, in seconds.
+        self.max_long_poll = self.config.get_value("API").get("max_long_poll", 60)
+
+        # Command, server and auth lookups for the API.
+        self.dispatcher = Dispatcher(self.config.get_value("API").get("roles"))
+
+        # Serializes config reloads, and the result of the last one.
+        self.reload_lock = threading.Lock()
+        self.last_reload = None
 
         # Server datum list
         self.servers = []
 
+        # CPU affinity, priorities and limits for the DreamDaemons.
+        self.placement = Placement(self.logger, self.config.get_value("placement"))
+
         # Server datum cache
         self.generate_servers()
+        self.mark_phase("validation")
+
+        self.placement.assign(self.servers)
+
+        # Records the running DreamDaemons, for the next monitor to reattach to.
+        self.journal = StateJournal(self, self.logger, self.config.get_value("state"))
+        self.events.add_listener(self.journal.on_event)
+
+        # Take over what the last monitor left running before anything can act on those servers:
+        # the API, the config watcher, and the journal writer, which would record them as stopped.
+        self.adopted = self.reattach()
+        self.mark_phase("reattach")
+
+        self.journal.start()
+
+        # Indexes the world logs for search_logs.
+        self.log_index = LogIndex(self, self.logger, self.config.get_value("logs"))
+        self.log_index.start()
 
         self.logger.debug("MAIN: Server monitor initilization completed.")
 
@@ -72,43 +146,426 @@ class ServerMonitor:
                 "args": [],
                 "auths": ["R_ADMIN", "R_DEV"],
                 "needs_queue": False
+            },
+            "get_federated_servers": {
+                "cmd": self.cmd_get_federated_servers,
+                "args": [],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "federated_control": {
+                "cmd": self.cmd_federated_control,
+                "args": ["control", "targets"],
+                "auths": [],
+                "needs_queue": False
+            },
+            "tail_output": {
+                "cmd": self.cmd_tail_output,
+                "args": ["server"],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "search_logs": {
+                "cmd": self.cmd_search_logs,
+                "args": ["server"],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "compile": {
+                "cmd": self.cmd_compile,
+                "args": ["server"],
+                "auths": [],
+                "needs_queue": True,
+                "priority": PRIORITY_LOW
+            },
+            "update": {
+                "cmd": self.cmd_update,
+                "args": ["server"],
+                "auths": [],
+                "needs_queue": True,
+                "priority": PRIORITY_LOW
+            },
+            "get_update_status": {
+                "cmd": self.cmd_get_update_status,
+                "args": [],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "get_metrics": {
+                "cmd": self.cmd_get_metrics,
+                "args": ["server"],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "subscribe": {
+                "cmd": self.cmd_subscribe,
+                "args": [],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "reload_config": {
+                "cmd": self.cmd_reload_config,
+                "args": [],
+                "auths": ["R_ADMIN"],
+                "needs_queue": True,
+                "priority": PRIORITY_HIGH
+            },
+            "get_config_status": {
+                "cmd": self.cmd_get_config_status,
+                "args": [],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "get_startup_timings": {
+                "cmd": self.cmd_get_startup_timings,
+                "args": [],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "get_stats": {
+                "cmd": self.cmd_get_stats,
+                "args": [],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "profile": {
+                "cmd": self.cmd_profile,
+                "args": ["action"],
+                "auths": ["R_ADMIN"],
+                "needs_queue": False
+            },
+            "get_placement": {
+                "cmd": self.cmd_get_placement,
+                "args": [],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "get_job": {
+                "cmd": self.cmd_get_job,
+                "args": ["job"],
+                "auths": [],
+                "needs_queue": False
+            },
+            "get_jobs": {
+                "cmd": self.cmd_get_jobs,
+                "args": [],
+                "auths": ["R_ADMIN", "R_DEV"],
+                "needs_queue": False
+            },
+            "cancel_job": {
+                "cmd": self.cmd_cancel_job,
+                "args": ["job"],
+                "auths": [],
+                "needs_queue": False
             }
         }
 
+        self.dispatcher.set_commands(self.api_commands)
+
+        # Only take connections once everything a command may touch exists.
+        self.API.start()
+
+        # Pick up config edits as they happen.
+        self.config.watch(self.reload_config)
+
     def get_logger(self):
-        _logger = logging.getLogger("monitor")
-        _logger.setLevel(logging.DEBUG)
+        # Starts out on the defaults. Reconfigured once the config is read.
+        self.log_pipeline = LogPipeline("monitor")
 
-        _handler = logging.FileHandler(filename = "monitor.log", encoding = "utf-8", mode = "w")
-        _handler.setFormatter(logging.Formatter("%(asctime)s:%(levelname)s: %(message)s"))
+        return self.log_pipeline.logger
 
-        _logger.addHandler(_handler)
+    def mark_phase(self, phase, at = None):
+        elapsed = round((at or time.monotonic()) - self.startup_began, 3)
 
-        return _logger
+        # Only the first one to reach a phase gets to record it.
+        if self.startup_timings.setdefault(phase, elapsed) is elapsed:
+            self.logger.info("MAIN: Startup phase {0} reached after {1} seconds.".format(phase, elapsed))
 
     def run(self):
-        for i, server in enumerate(self.servers):
-            if server.start:
-                self.start_server(server)
+        if self.API.bound.wait(10):
+            self.mark_phase("api_bind", self.API.bound_at)
+
+        self.bring_up([server for server in self.servers if server.start and server.name not in self.adopted])
+        self.mark_phase("all_servers_up")
 
         # Sleep the main thread. Yaaay.
         while True:
             time.sleep(360)
 
+    def reattach(self):
+        """Takes over the DreamDaemons the last monitor left running. Returns the names of the servers taken over."""
+        entries = self.journal.load()
+        adopted = set()
+
+        for server in self.servers:
+            entry = entries.get(server.name)
+
+            if not entry or not entry.get("pid"):
+                continue
+
+            process = self.journal.find_process(entry)
+
+            if not process:
+                self.logger.info("MAIN: {0}'s DreamDaemon (PID {1}) is gone, not reattaching.".format(server.name, entry["pid"]))
+                continue
+
+            server.server_thread = Server(server, self.logger, self.supervisor, self.events, self.placement)
+            server.server_thread.adopt(process, entry.get("started", time.time()), entry.get("port", server.port), entry.get("slot"))
+            adopted.add(server.name)
+
+            # It was on its way down when the last monitor went.
+            if entry.get("target") == STATE_STOPPED:
+                self.stop_server(server)
+
+        # Anything no longer in the config is left alone, but shouldn't go unnoticed.
+        for name in set(entries) - set(server.name for server in self.servers):
+            if entries[name].get("pid"):
+                self.logger.warning("MAIN: Journal lists {0} (PID {1}), which is no longer configured. Leaving it alone.".format(name, entries[name]["pid"]))
+
+        if adopted:
+            self.journal.dirty.set()
+
+        return adopted
+
     def generate_servers(self):
-        self.servers = []
-        for key in self.config.get_value("servers"):
-            dict = self.config.get_value("servers")[key]
-            try:
-                data = ServerData(key, dict["game-path"], dict["git-path"], dict["byond-path"], dict["port"], dict["visibility"], dict["start"], dict["auths"])
-                self.servers.append(data)
-            except ValueError as e:
-                self.logger.error("MAIN: Error adding a server to the pool: {0}".format(e))
-            except Exception as e1:
-                self.logger.error("MAIN: Malformed data or other error adding server to pool: {0}".format(e1))
+        definitions = self.config.get_value("servers") or {}
+
+        # Validating a server means a handful of filesystem probes each, so do them side by side.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(16, len(definitions)))) as pool:
+            results = pool.map(lambda key: self.create_server_data(key, definitions[key]), list(definitions))
+
+        self.servers = [data for data in results if data]
+
+        self.dispatcher.set_servers(self.servers)
 
         self.logger.debug("MAIN: Server list repopulated.")
 
+    def create_server_data(self, key, dict):
+        try:
+            return ServerData(key, dict["game-path"], dict["git-path"], dict["byond-path"], dict["port"], dict["visibility"], dict["start"], dict["auths"], dict.get("restart"), dict.get("output"), dict.get("git-branch"), dict.get("standby-port"), dict.get("placement"), dict.get("log-path"))
+        except ValueError as e:
+            self.logger.error("MAIN: Error adding a server to the pool: {0}".format(e))
+        except Exception as e1:
+            self.logger.error("MAIN: Malformed data or other error adding server to pool: {0}".format(e1))
+
+        return None
+
+    def reload_config(self):
+        """Reads the config again and applies only what changed. Servers whose config is untouched are left alone."""
+        with self.reload_lock:
+            started = time.monotonic()
+
+            try:
+                old, new = self.config.reload(self.validate_config)
+            except RuntimeError as e:
+                self.logger.error("MAIN: Config reload failed, keeping the old config: {0}".format(e))
+                self.last_reload = {"time": time.time(), "error": str(e)}
+                return self.last_reload
+
+            diff = {"servers": self.apply_servers_diff(old.get("servers") or {}, new.get("servers") or {}), "API": self.apply_api_diff(old.get("API") or {}, new.get("API") or {})}
+
+            if old.get("logging") != new.get("logging"):
+                self.log_pipeline.configure(new.get("logging"))
+                diff["logging"] = True
+
+            # Everything else is only read at startup.
+            diff["needs_restart"] = sorted(key for key in set(old) | set(new) if key not in ("servers", "API", "logging") and old.get(key) != new.get(key))
+            diff["needs_restart"] += diff["API"].pop("needs_restart")
+
+            duration = time.monotonic() - started
+            self.last_reload = {"time": time.time(), "duration": round(duration, 4), "diff": diff, "error": None}
+
+        self.logger.info("MAIN: Config reloaded in {0:.3f} seconds. Changes: {1}".format(duration, diff))
+        self.events.publish("config_reloaded", diff=diff)
+
+        return self.last_reload
+
+    def validate_config(self, config):
+        """Rejects a reloaded config which would break what's already running."""
+        api = config.get("API")
+
+        if not isinstance(api, dict):
+            raise RuntimeError("The API section is missing.")
+
+        for key in ("host", "port", "allowed_hosts"):
+            if key not in api:
+                raise RuntimeError("The API section has no {0}.".format(key))
+
+        if not isinstance(api["allowed_hosts"], list):
+            raise RuntimeError("API allowed_hosts must be a list.")
+
+        if not isinstance(config.get("servers") or {}, dict):
+            raise RuntimeError("The servers section must be a mapping.")
+
+        for name, server in (config.get("servers") or {}).items():
+            if not isinstance(server, dict):
+                raise RuntimeError("The section of server {0} must be a mapping.".format(name))
+
+    def apply_servers_diff(self, old, new):
+        # Keys which can be changed on a live ServerData. Anything else means a new one.
+        live_keys = {"auths", "start", "restart", "git-branch", "standby-port", "placement"}
+
+        diff = {"added": [], "removed": [], "updated": [], "replaced": [], "rejected": []}
+        servers = list(self.servers)
+        to_start = []
+
+        # Servers whose running DreamDaemon needs its placement applied again.
+        cpus = {server.name: self.placement.get_cpus(server) for server in servers}
+        to_place = set()
+
+        for name in old:
+            if name in new:
+                continue
+
+            server = self.get_server(name)
+
+            if server:
+                self.stop_server(server)
+                self.wait_stopped(server)
+                servers.remove(server)
+
+            diff["removed"].append(name)
+
+        for name, config in list(new.items()):
+            if name in old and config == old[name]:
+                continue
+
+            server = self.get_server(name)
+            changed = {key for key in set(config) | set(old.get(name) or {}) if config.get(key) != (old.get(name) or {}).get(key)}
+
+            if server and changed <= live_keys:
+                server.auths = config.get("auths") or {}
+                server.start = config.get("start")
+                server.git_branch = config.get("git-branch")
+                server.standby_port = config.get("standby-port")
+                server.restart_policy.configure(config.get("restart"))
+                server.placement = config.get("placement") or {}
+                diff["updated"].append(name)
+
+                if "placement" in changed:
+                    to_place.add(name)
+
+                # Switched on: bring it up now rather than at the next monitor start.
+                if "start" in changed and server.start and not (server.server_thread and server.server_thread.running):
+                    to_start.append(server)
+                continue
+
+            replacement = self.create_server_data(name, config)
+
+            if not replacement:
+                # Whatever runs now keeps running. Its old section stays, so the next reload tries again.
+                if name in old:
+                    new[name] = old[name]
+                else:
+                    del new[name]
+
+                diff["rejected"].append(name)
+                continue
+
+            if server:
+                # The new datum picks up where the old one left off.
+                if server.server_thread and server.server_thread.running:
+                    to_start.append(replacement)
+
+                # The replacement may want the same port, so let the old one go first.
+                self.stop_server(server)
+                self.wait_stopped(server)
+                servers[servers.index(server)] = replacement
+                diff["replaced"].append(name)
+            else:
+                if replacement.start:
+                    to_start.append(replacement)
+
+                servers.append(replacement)
+                diff["added"].append(name)
+
+        self.servers = servers
+        self.dispatcher.set_servers(servers)
+
+        # Auto placement moves servers around as others come and go.
+        self.placement.assign(servers)
+
+        for server in servers:
+            thread = server.server_thread
+            process = thread.process if thread else None
+
+            if process and (server.name in to_place or self.placement.get_cpus(server) != cpus.get(server.name)):
+                self.placement.apply(server, process.pid)
+
+        for server in to_start:
+            self.start_server(server)
+
+        return diff
+
+    def apply_api_diff(self, old, new):
+        changed = sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+
+        # Handlers read this on every connection, so swapping it applies from the next one on.
+        self.API.config = new
+
+        if "roles" in changed:
+            self.dispatcher.set_roles(new.get("roles"))
+
+        self.max_long_poll = new.get("max_long_poll", 60)
+        self.API.command_timeout = new.get("command_timeout", 30)
+
+        restart_keys = {"host", "port", "workers"}
+
+        return {"changed": changed, "needs_restart": ["API." + key for key in changed if key in restart_keys]}
+
+    def bring_up(self, servers):
+        """Starts servers with at most max-parallel of them booting at once, stagger seconds apart.
+
+        A server counts as booting until its port accepts connections, it dies, or
+        boot-timeout runs out. Returns once every server is past booting.
+        """
+        config = self.config.get_value("startup") or {}
+        slots = threading.BoundedSemaphore(config.get("max-parallel", 2))
+        stagger = config.get("stagger", 5)
+        boot_timeout = config.get("boot-timeout", 300)
+
+        def wait_up(server):
+            try:
+                deadline = time.monotonic() + boot_timeout
+
+                while time.monotonic() < deadline:
+                    thread = server.server_thread
+
+                    # Gone, or died while booting.
+                    if not thread or not thread.running or thread.state == STATE_BACKOFF:
+                        return
+
+                    if thread.state == STATE_RUNNING:
+                        self.mark_phase("first_server_up")
+                        self.logger.info("MAIN: {0} is up.".format(server.name))
+                        return
+
+                    time.sleep(0.5)
+
+                self.logger.warning("MAIN: {0} did not come up within {1} seconds.".format(server.name, boot_timeout))
+            finally:
+                slots.release()
+
+        last_launch = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(servers)), thread_name_prefix="Startup") as pool:
+            for server in servers:
+                slots.acquire()
+
+                if last_launch is not None:
+                    time.sleep(max(0, stagger - (time.monotonic() - last_launch)))
+
+                last_launch = time.monotonic()
+
+                try:
+                    self.start_server(server)
+                except RuntimeError as e:
+                    self.logger.error("MAIN: Unable to start {0}: {1}".format(server.name, e))
+                    slots.release()
+                    continue
+
+                pool.submit(wait_up, server)
+
     def start_server(self, server):
         if not server:
             return
@@ -116,66 +573,374 @@ class ServerMonitor:
         if not server.server_ready:
             return
 
-        if server.server_thread:
+        # A server which parked itself or otherwise stopped on its own can be started anew.
+        if server.server_thread and server.server_thread.running:
             return
 
-        server.server_thread = Server(server, self.logger)
-        server.server_thread.start()
+        server.restart_policy.reset()
+
+        self.events.publish("start_requested", server.name)
+
+        if not server.server_thread:
+            server.server_thread = Server(server, self.logger, self.supervisor, self.events, self.placement)
+
+        # A fresh start always runs the published build on the main port. One still
+        # closing down gets there once the old process is gone.
+        if server.server_thread.state != STATE_STOPPING:
+            server.live_slot = None
+            server.active_port = server.port
+
+        return server.server_thread.start()
 
     def stop_server(self, server):
+        """Asks the server to stop. Returns without waiting for DreamDaemon to close."""
         if not server:
             return
 
-        if not server.server_thread:
+        thread = server.server_thread
+
+        if not thread or thread.state == STATE_STOPPED or (thread.state == STATE_STOPPING and not thread.running):
             return
 
-        server.server_thread.stop_server()
-        server.server_thread = None
+        self.events.publish("stop_requested", server.name)
+
+        return thread.stop_server()
+
+    def wait_stopped(self, server):
+        """Blocks until the server's DreamDaemon has closed. Killing it takes at most stop_grace seconds."""
+        if server.server_thread:
+            server.server_thread.stopped.wait()
 
     def restart_server(self, server):
+        """Asks the server to restart. Returns without waiting for DreamDaemon to close."""
         if not server:
             return
 
         if not server.server_thread:
             return
 
-        self.stop_server(server)
-        self.start_server(server)
+        self.events.publish("restart_requested", server.name)
 
-    def cmd_get_servers(self, _data):
-        data = {"error": False, "msg": None, "data": {}}
+        server.restart_policy.reset()
+
+        return server.server_thread.restart()
+
+    def get_lifecycle(self, server):
+        thread = server.server_thread
+
+        if not thread:
+            return {"state": STATE_STOPPED, "target": STATE_STOPPED}
+
+        return {"state": thread.state, "target": thread.target}
+
+    def build_status(self):
+        """Builds the per-server status behind get_servers. Only called by the status snapshot."""
+        data = {}
 
         for server in self.servers:
-            server_info = {}
-            if server.server_thread:
-                server_info["running"] = server.server_thread.running
-            else:
-                server_info["running"] = False
+            server_info = self.get_lifecycle(server)
+            server_info["running"] = server_info["target"] == STATE_RUNNING
 
             server_info["can_run"] = server.server_ready
+            server_info["port"] = server.active_port
+            server_info["restart"] = server.restart_policy.get_state()
+            server_info["build"] = self.compiler.get_status(server.name)
 
-            data["data"][server.name] = server_info
+            # Leave out the probe timings, or the snapshot would change on every probe round.
+            health = self.prober.get_health(server.name)
+            server_info["health"] = {key: health.get(key) for key in ("ok", "failures", "error", "data")}
+
+            data[server.name] = server_info
 
         return data
 
-    def cmd_control_server(self, _data):
-        server = None
+    def cmd_get_servers(self, _data):
+        version, result = self.status.get()
+
+        if "if_newer_than" not in _data["args"]:
+            return result
 
-        for obj in self.servers:
-            if obj.name == _data["args"]["server"]:
-                server = obj
-                break
+        try:
+            known = int(_data["args"]["if_newer_than"])
+            wait = min(float(_data["args"].get("wait", 0)), self.max_long_poll)
+        except (ValueError, TypeError):
+            return {"error": True, "msg": "Invalid if_newer_than or wait."}
+
+        # Versions are only comparable within one monitor process. After a restart, send it all.
+        if version != known or _data["args"].get("epoch", self.status.epoch) != self.status.epoch:
+            return result
+
+        if wait <= 0:
+            return {"error": False, "msg": "Unchanged.", "unchanged": True, "version": version, "epoch": self.status.epoch}
+
+        # Long-poll. The API awaits this on its event loop, so no worker thread is held up waiting.
+        return self.long_poll_status(known, wait)
+
+    async def long_poll_status(self, known, wait):
+        version, result = await self.status.wait_newer(known, wait)
+
+        if version > known:
+            return result
+
+        return {"error": False, "msg": "Unchanged.", "unchanged": True, "version": version, "epoch": self.status.epoch}
+
+    def cmd_get_federated_servers(self, _data):
+        _version, result = self.status.get()
+
+        # Finished on the API's event loop, where the connections to the other monitors live.
+        return self.federation.get_servers(result.data["data"])
+
+    def cmd_federated_control(self, _data):
+        targets = _data["args"]["targets"]
+        control = _data["args"]["control"]
+
+        if not isinstance(targets, list) or not targets:
+            return {"error": True, "msg": "No targets sent."}
+
+        results = {}
+        remote = {}
+
+        for target in targets:
+            try:
+                host, server = self.federation.split_target(target)
+            except ValueError:
+                return {"error": True, "msg": "Invalid target."}
+
+            if host == self.federation.name:
+                results[target] = self.cmd_control_server(dict(_data, args={"server": server, "control": control}))
+            else:
+                remote[target] = (host, server)
+
+        # Each remote monitor checks the auths against its own servers.
+        return self.federation.control(remote, control, _data["auths"], results)
+
+    def get_server(self, name):
+        return self.dispatcher.get_server(name)
+
+    def cmd_tail_output(self, _data):
+        server = self.get_server(_data["args"]["server"])
 
         if not server:
             return {"error": True, "msg": "Invalid server name."}
 
-        can_control = False
-        for auth in _data["auths"]:
-            if auth in server.auths:
-                can_control = True
-                break
+        try:
+            lines = server.output.tail(int(_data["args"].get("lines", 100)), _data["args"].get("search"))
+        except (ValueError, TypeError, re.error) as e:
+            return {"error": True, "msg": "Invalid tail arguments: {0}".format(e)}
+
+        return {"error": False, "msg": None, "data": {"lines": lines, "total": server.output.total}}
+
+    def cmd_search_logs(self, _data):
+        server = self.get_server(_data["args"]["server"])
+
+        if not server:
+            return {"error": True, "msg": "Invalid server name."}
+
+        args = _data["args"]
+        severities = args.get("severity")
+
+        if isinstance(severities, str):
+            severities = [severities]
+
+        try:
+            results = self.log_index.search(server, args.get("since"), args.get("until"), severities, args.get("search"), min(int(args.get("limit", 200)), 1000))
+        except (ValueError, TypeError, re.error) as e:
+            return {"error": True, "msg": "Invalid search arguments: {0}".format(e)}
+        except OSError as e:
+            return {"error": True, "msg": "Unable to read the logs: {0}".format(e)}
+
+        return {"error": False, "msg": None, "data": results}
+
+    def can_control(self, server, auths):
+        return self.dispatcher.can_control(server, auths)
+
+    def can_cancel(self, job, auths):
+        """Only someone who may run the job's command, on every server it touches, may cancel it."""
+        command = self.dispatcher.get_command(job.name)
+
+        if command and not self.dispatcher.can_use(command, auths):
+            return False
+
+        for key in job.keys:
+            server = self.get_server(key)
+
+            if server and not self.can_control(server, auths):
+                return False
+
+        return True
+
+    def cmd_compile(self, _data):
+        if _data["args"]["server"] == "all":
+            servers = [server for server in self.servers if self.can_control(server, _data["auths"])]
+        else:
+            server = self.get_server(_data["args"]["server"])
 
-        if not can_control:
+            if not server:
+                return {"error": True, "msg": "Invalid server name."}
+
+            servers = [server]
+
+        servers = [server for server in servers if server.compile_ready and self.can_control(server, _data["auths"])]
+
+        if not servers:
+            return {"error": True, "msg": "No servers you may compile."}
+
+        # Lets cancel_job stop the build part way through.
+        job = self.jobs.get_current()
+        results = self.compiler.compile_many(servers, job.cancelled if job else None)
+
+        for name, result in results.items():
+            self.events.publish("compile_finished", name, state=result.get("state"), cached=result.get("cached"), error=result.get("error"))
+        failed = [name for name, result in results.items() if result.get("state") != "done"]
+
+        if failed:
+            return {"error": True, "msg": "Compile failed for: {0}.".format(", ".join(failed)), "data": results}
+
+        return {"error": False, "msg": "Compile finished.", "data": results}
+
+    def cmd_update(self, _data):
+        if _data["args"]["server"] == "all":
+            servers = [server for server in self.servers if self.can_control(server, _data["auths"])]
+        else:
+            server = self.get_server(_data["args"]["server"])
+
+            if not server:
+                return {"error": True, "msg": "Invalid server name."}
+
+            servers = [server] if self.can_control(server, _data["auths"]) else []
+
+        if not servers:
+            return {"error": True, "msg": "No servers you may update."}
+
+        try:
+            status = self.updater.update(servers)
+        except Exception as e:
+            return {"error": True, "msg": "Update failed: {0}".format(e), "data": self.updater.get_status()}
+
+        failed = [server.name for server in servers if status["servers"].get(server.name, {}).get("state") != "done"]
+
+        if failed:
+            return {"error": True, "msg": "Checkout failed for: {0}.".format(", ".join(failed)), "data": status}
+
+        return {"error": False, "msg": "Update finished.", "data": status}
+
+    def cmd_get_update_status(self, _data):
+        return {"error": False, "msg": None, "data": self.updater.get_status()}
+
+    def cmd_get_metrics(self, _data):
+        server = self.get_server(_data["args"]["server"])
+
+        if not server:
+            return {"error": True, "msg": "Invalid server name."}
+
+        try:
+            metrics = self.sampler.get_metrics(server.name, _data["args"].get("tier", "raw"), float(_data["args"].get("window", 300)))
+        except (ValueError, TypeError):
+            return {"error": True, "msg": "Invalid window."}
+
+        if metrics is None:
+            return {"error": True, "msg": "No metrics for this server and tier."}
+
+        return {"error": False, "msg": None, "data": metrics}
+
+    def cmd_subscribe(self, _data):
+        args = _data["args"]
+
+        try:
+            return self.events.subscribe(args.get("topics"), args.get("servers"), args.get("queue"), args.get("overflow", "drop"))
+        except (ValueError, TypeError) as e:
+            return {"error": True, "msg": "Invalid subscription: {0}".format(e)}
+
+    def cmd_reload_config(self, _data):
+        result = self.reload_config()
+
+        if result.get("error"):
+            return {"error": True, "msg": "Config reload failed: {0}".format(result["error"]), "data": result}
+
+        return {"error": False, "msg": "Config reloaded.", "data": result}
+
+    def cmd_get_config_status(self, _data):
+        return {"error": False, "msg": None, "data": self.last_reload}
+
+    def cmd_get_startup_timings(self, _data):
+        return {"error": False, "msg": None, "data": self.startup_timings}
+
+    def cmd_get_stats(self, _data):
+        return {"error": False, "msg": None, "data": self.stats.get_stats()}
+
+    def cmd_profile(self, _data):
+        args = _data["args"]
+        action = args["action"]
+
+        try:
+            if action == "start":
+                if not self.profiler.start(float(args.get("duration", 0)) or None):
+                    return {"error": True, "msg": "A profile is already running."}
+
+                return {"error": False, "msg": "Profiling started.", "data": None}
+
+            if action == "stop":
+                if not self.profiler.stop():
+                    return {"error": True, "msg": "No profile is running."}
+
+                return {"error": False, "msg": "Profiling stopped.", "data": self.profiler.get_report(int(args.get("top", 20)))}
+
+            if action == "report":
+                return {"error": False, "msg": None, "data": self.profiler.get_report(int(args.get("top", 20)))}
+        except (ValueError, TypeError):
+            return {"error": True, "msg": "Invalid duration or top."}
+
+        return {"error": True, "msg": "Invalid profile action."}
+
+    def cmd_get_placement(self, _data):
+        return {"error": False, "msg": None, "data": self.placement.get_status(self.servers)}
+
+    def get_job_keys(self, _data):
+        """What a queued command touches: the servers it names, every server for "all", or else the command itself."""
+        server = _data["args"].get("server")
+
+        if server == "all":
+            return [data.name for data in self.servers]
+
+        if server is None:
+            return ["cmd:" + _data["cmd"]]
+
+        return [str(server)]
+
+    def cmd_get_job(self, _data):
+        job = self.jobs.get_job(_data["args"]["job"])
+
+        if not job:
+            return {"error": True, "msg": "No such job."}
+
+        return {"error": False, "msg": None, "data": job.get_state()}
+
+    def cmd_get_jobs(self, _data):
+        return {"error": False, "msg": None, "data": [job.get_state() for job in self.jobs.get_jobs()]}
+
+    def cmd_cancel_job(self, _data):
+        job = self.jobs.get_job(_data["args"]["job"])
+
+        if not job:
+            return {"error": True, "msg": "No such job."}
+
+        if not self.can_cancel(job, _data["auths"]):
+            return {"error": True, "msg": "Not authorized to cancel this job."}
+
+        if job.finished:
+            return {"error": True, "msg": "Job has already finished."}
+
+        self.jobs.cancel(job.id)
+
+        return {"error": False, "msg": "Job cancel requested.", "data": job.get_state()}
+
+    def cmd_control_server(self, _data):
+        server = self.get_server(_data["args"]["server"])
+
+        if not server:
+            return {"error": True, "msg": "Invalid server name."}
+
+        if not self.can_control(server, _data["auths"]):
             return {"error": True, "msg": "Not authorized to control this specific server."}
 
         if _data["args"]["control"] == "start":
@@ -185,25 +950,52 @@ class ServerMonitor:
             if not server.server_ready:
                 return {"error": True, "msg": "Server is not compiled."}
 
-            self.start_server(server)
+            try:
+                self.start_server(server)
+            except RuntimeError as e:
+                return {"error": True, "msg": str(e), "data": self.get_lifecycle(server)}
 
-            return {"error": False, "msg": "Server start event received. It should be up in 3 minutes."}
+            return {"error": False, "msg": "Server start event received. It should be up in 3 minutes.", "data": self.get_lifecycle(server)}
         elif _data["args"]["control"] == "restart":
-            if server.server_thread:
+            if server.server_thread and server.server_thread.state != STATE_STOPPED:
                 self.restart_server(server)
 
-                return {"error": False, "msg": "Server restart event received. It should close and start back up within 6 minutes."}
+                return {"error": False, "msg": "Server restart event received. It should close and start back up within 6 minutes.", "data": self.get_lifecycle(server)}
             else:
                 return {"error": True, "msg": "Server is not running. Restart impossible."}
+        elif _data["args"]["control"] == "swap":
+            if not server.server_thread or server.server_thread.state not in (STATE_STARTING, STATE_RUNNING):
+                return {"error": True, "msg": "Server is not running. Hot swap impossible."}
+
+            if not server.standby_port:
+                return {"error": True, "msg": "Server has no standby port. Hot swap impossible."}
+
+            # Waits for the standby to come up, so it goes through the job queue.
+            job = self.jobs.submit("server_control", self.swap_server, _data, PRIORITY_HIGH, [server.name])
+
+            return {"error": False, "msg": "Command queued.", "data": {"job": job.id}}
         elif _data["args"]["control"] == "stop":
-            if server.server_thread:
-                if not server.server_thread.running:
-                    return {"error": False, "msg": "Server is already shutting down. Please wait."}
+            if server.server_thread and server.server_thread.state != STATE_STOPPED:
+                if server.server_thread.state == STATE_STOPPING and not server.server_thread.running:
+                    return {"error": False, "msg": "Server is already shutting down. Please wait.", "data": self.get_lifecycle(server)}
 
                 self.stop_server(server)
 
-                return {"error": False, "msg": "Server shut down initiated. It should close within 3 minutes."}
+                return {"error": False, "msg": "Server shut down initiated. It should close within 3 minutes.", "data": self.get_lifecycle(server)}
             else:
                 return {"error": True, "msg": "Server is not running. Shut down impossible."}
         else:
-            return {"error": True, "msg": "Invalid command requested."}
\ No newline at end of file
+            return {"error": True, "msg": "Invalid command requested."}
+
+    def swap_server(self, _data):
+        server = self.get_server(_data["args"]["server"])
+
+        if not server or not server.server_thread:
+            return {"error": True, "msg": "Server is not running. Hot swap impossible."}
+
+        try:
+            port = server.server_thread.hot_swap()
+        except RuntimeError as e:
+            return {"error": True, "msg": str(e)}
+
+        return {"error": False, "msg": "Server hot swapped. Now live on port {0}.".format(port)}
\ No newline at end of file
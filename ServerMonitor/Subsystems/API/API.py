@@ -14,8 +14,10 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see http://www.gnu.org/licenses/.
 
-import socketserver
+import asyncio
+import concurrent.futures
 import threading
+import time
 
 from ServerMonitor.Subsystems.API.TCPHandler import APIRequestHandler
 
@@ -25,6 +27,7 @@ class API(threading.Thread):
         threading.Thread.__init__(self)
 
         self.name = "API"
+        self.daemon = True
 
         if not _monitor:
             raise ValueError("API: Wasn't handed a monitor object.")
@@ -44,49 +47,115 @@ class API(threading.Thread):
         # The config dictionary.
         self.config = _config.get_value("API")
 
+        # The event loop serving the connections. Created in run().
+        self.loop = None
+
+        # The asyncio server object.
+        self.server = None
+
+        # Set once we're listening, with the monotonic time that happened at.
+        self.bound = threading.Event()
+        self.bound_at = None
+
+        # Commands are executed on this pool, so a slow one never stalls the event loop.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.config.get("workers", 8), thread_name_prefix="API-worker")
+
+        # How long a client waits on a command before it is told to give up. None to wait forever.
+        self.command_timeout = self.config.get("command_timeout", 30)
+
     def run(self):
         try:
             HOST, PORT = self.config["host"], self.config["port"]
 
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+
             # Set up the TCP server.
-            self.server = socketserver.TCPServer((HOST, PORT), APIRequestHandler)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_connection, HOST, PORT, limit=self.config.get("max_request_size", 1048576)))
 
-            self.server.RequestHandlerClass._API = self
+            self.bound_at = time.monotonic()
+            self.bound.set()
 
             # Aaaand run it forever.
-            self.server.serve_forever()
+            self.loop.run_forever()
         except Exception as e:
             self.logger.error("API: Error during socket operations: {0}".format(e))
-            self.join()
+
+    def stop(self):
+        """Closes the listener and stops the event loop. Safe to call from any thread."""
+        if not self.loop:
+            return
+
+        def _shutdown():
+            if self.server:
+                self.server.close()
+            self.loop.stop()
+
+        self.loop.call_soon_threadsafe(_shutdown)
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        """Entry point for every accepted connection. Runs on the event loop."""
+        handler = APIRequestHandler(self, reader, writer)
+
+        try:
+            await handler.handle()
+        except Exception as e:
+            self.logger.error("API: Error caught while serving a connection: {0}".format(e))
+        finally:
+            writer.close()
+
+    async def run_command(self, data):
+        """Runs handle_command on the worker pool and waits for it without blocking the loop."""
+        future = self.loop.run_in_executor(self.executor, self.handle_command, data)
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.command_timeout)
+        except asyncio.TimeoutError:
+            self.monitor.stats.count("api_errors_total", kind="timeout")
+            self.logger.warning("API: Command {0} did not finish within {1} seconds.".format(data["cmd"], self.command_timeout))
+            return {"error": True, "msg": "Command timed out. It may still complete in the background."}
+
+        # Commands which wait on something, like long-polls, hand back a coroutine to finish on the loop.
+        if asyncio.iscoroutine(result):
+            result = await result
+
+        return result
 
     def handle_command(self, data):
         if not data:
             raise ValueError("No data sent to handle_command.")
 
-        command = self.monitor.api_commands[data["cmd"]]
+        stats = self.monitor.stats
+        started = time.perf_counter()
+
+        command = self.monitor.dispatcher.get_command(data["cmd"])
 
         if not command:
-            raise ValueError("Command is not valid.")
+            stats.count("api_errors_total", kind="invalid_command")
+            return {"error": True, "msg": "Command is not valid."}
 
-        is_authed = False
+        if not self.monitor.dispatcher.can_use(command, data["auths"]):
+            stats.count("api_errors_total", kind="unauthorized")
+            return {"error": True, "msg": "Not authorized to use this command."}
 
-        if len(command["auths"]):
-            for auth in data["auths"]:
-                if auth in command["auths"]:
-                    is_authed = True
-                    break
-        else:
-            is_authed = True
+        if not isinstance(data["args"], dict):
+            stats.count("api_errors_total", kind="malformed_args")
+            return {"error": True, "msg": "Malformed arguments sent."}
 
-        if not is_authed:
-            return {"error": True, "msg": "Not authorized to use this command."}
+        for arg in command.args:
+            if arg not in data["args"]:
+                stats.count("api_errors_total", kind="malformed_args")
+                return {"error": True, "msg": "Not enough arguments sent."}
+
+        stats.observe("api_auth_seconds", time.perf_counter() - started)
+
+        # Queued commands are timed when they actually run, not when they're queued.
+        timed = stats.wrap("command_seconds", command.cmd, command=data["cmd"])
 
-        if command["needs_queue"]:
-            return {"error": True, "msg": "Queued commands not implemented yet."}
+        if command.needs_queue:
+            job = self.monitor.jobs.submit(data["cmd"], timed, data, command.priority, self.monitor.get_job_keys(data))
 
-        if command["args"]:
-            for arg in command["args"]:
-                if arg not in command["args"]:
-                    return {"error": True, "msg": "Not enough arguments sent."}
+            return {"error": False, "msg": "Command queued.", "data": {"job": job.id}}
 
-        return command["cmd"](data)
\ No newline at end of file
+        return timed(data)
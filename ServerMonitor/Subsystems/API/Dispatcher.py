@@ -0,0 +1,161 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import threading
+
+from ServerMonitor.Subsystems.JobQueue import PRIORITY_NORMAL
+
+class CompiledCommand:
+    def __init__(self, _name, _command, _auths):
+        self.name = _name
+        self.cmd = _command["cmd"]
+        self.args = tuple(_command["args"])
+        self.needs_queue = _command["needs_queue"]
+        self.priority = _command.get("priority", PRIORITY_NORMAL)
+
+        # Empty for commands anyone may use.
+        self.auths = _auths
+
+class Dispatcher:
+    """Command, server and permission lookups, compiled into dicts and frozensets.
+
+    Roles may inherit others through the API roles config: a role holds itself plus
+    every role it inherits, transitively. Expanding a set of auths is cached, as are
+    the yes or no answers built on top of it. Rebuilt whenever the commands, servers
+    or roles change. Lookups hold the lock, so an answer worked out from the old roles
+    or servers never lands in the cache built for the new ones.
+    """
+    # Cached decisions kept before the cache is thrown out and started over.
+    max_cache = 4096
+
+    def __init__(self, _roles = None):
+        self.commands = {}
+        self.servers = {}
+
+        # Role -> frozenset of every role it counts as.
+        self.roles = {}
+
+        # frozenset(auths) -> frozenset of effective roles.
+        self.expanded = {}
+
+        # (kind, name, frozenset(auths)) -> bool.
+        self.decisions = {}
+
+        self.lock = threading.Lock()
+
+        self.set_roles(_roles)
+
+    def set_roles(self, roles):
+        roles = roles or {}
+        closure = {}
+
+        def resolve(role, seen):
+            if role in closure:
+                return closure[role]
+
+            result = {role}
+            for inherited in roles.get(role) or []:
+                if inherited not in seen:
+                    result |= resolve(inherited, seen | {inherited})
+
+            return result
+
+        for role in roles:
+            closure[role] = frozenset(resolve(role, {role}))
+
+        with self.lock:
+            self.roles = closure
+            self.clear_cache()
+
+    def set_commands(self, api_commands):
+        commands = {name: CompiledCommand(name, command, frozenset(command["auths"])) for name, command in api_commands.items()}
+
+        with self.lock:
+            self.commands = commands
+            self.clear_cache()
+
+    def set_servers(self, servers):
+        with self.lock:
+            self.servers = {server.name: (server, frozenset(server.auths)) for server in servers}
+            self.clear_cache()
+
+    def clear_cache(self):
+        self.expanded = {}
+        self.decisions = {}
+
+    def expand(self, auths):
+        with self.lock:
+            return self.get_expanded(frozenset(auths))
+
+    # The lock must be held, so the roles and both caches always belong together.
+    def get_expanded(self, key):
+        expanded = self.expanded.get(key)
+
+        if expanded is None:
+            expanded = frozenset().union(*[self.roles.get(auth, (auth,)) for auth in key])
+
+            if len(self.expanded) >= self.max_cache:
+                self.expanded = {}
+
+            self.expanded[key] = expanded
+
+        return expanded
+
+    def get_command(self, name):
+        return self.commands.get(name)
+
+    def get_server(self, name):
+        entry = self.servers.get(name)
+
+        return entry[0] if entry else None
+
+    def decide(self, kind, name, required, auths):
+        with self.lock:
+            return self.get_decision(kind, name, required, auths)
+
+    # The lock must be held, as for get_expanded.
+    def get_decision(self, kind, name, required, auths):
+        key = (kind, name, frozenset(auths))
+        decision = self.decisions.get(key)
+
+        if decision is None:
+            decision = not self.get_expanded(key[2]).isdisjoint(required)
+
+            if len(self.decisions) >= self.max_cache:
+                self.decisions = {}
+
+            self.decisions[key] = decision
+
+        return decision
+
+    def can_use(self, command, auths):
+        with self.lock:
+            # The command may have been looked up before set_commands replaced it.
+            command = self.commands.get(command.name, command)
+
+            if not command.auths:
+                return True
+
+            return self.get_decision("cmd", command.name, command.auths, auths)
+
+    def can_control(self, server, auths):
+        with self.lock:
+            entry = self.servers.get(server.name)
+
+            if not entry:
+                return False
+
+            return self.get_decision("server", server.name, entry[1], auths)
@@ -14,70 +14,295 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see http://www.gnu.org/licenses/.
 
-import socketserver
+import asyncio
 import json
+import time
 
-class APIRequestHandler(socketserver.BaseRequestHandler):
-    # The class variable for the API object.
-    _API = None
+from ServerMonitor.Subsystems.EventBus import Subscriber
+from ServerMonitor.Subsystems.StatusSnapshot import PreSerialized
 
-    def handle(self):
-        # Don't process shit if we have no API object.
-        if not APIRequestHandler._API:
-            return
+class SubscriptionReply:
+    """The reply to a subscribe command: an acknowledgement, after which events are streamed."""
+    def __init__(self, _subscriber, _ack):
+        self.subscriber = _subscriber
+        self.ack = _ack
+
+class APIRequestHandler:
+    """Serves a single, persistent API connection.
+
+    Requests are newline-delimited JSON. A frame is either one command object or
+    an array of them (a batch), and is answered by one line holding the result or
+    an array of results in the same order. Clients may pipeline frames without
+    waiting; each frame only runs once the one before it has finished, so a
+    connection's commands run, and are answered, in the order they came in. Only
+    the commands within a batch run side by side. A command object may carry an
+    "id" key, which is echoed in its reply.
+
+    A client which sends a single JSON document with no trailing newline is
+    treated as a legacy one-shot client: it gets its reply and the connection is
+    closed shortly after, same as before framing existed.
+
+    After a successful subscribe command the connection turns into a one way stream of
+    events, one JSON object per line, until the client hangs up. Anything the client
+    sends after the subscribe command is read and thrown away without being run.
+    """
+
+    def __init__(self, _API, _reader, _writer):
+        # The API object.
+        self.API = _API
+
+        # The asyncio streams for this connection.
+        self.reader = _reader
+        self.writer = _writer
+
+        # The (host, port) of the other end.
+        self.client_address = self.writer.get_extra_info("peername")
+
+        # The biggest frame we're willing to buffer.
+        self.max_size = self.API.config.get("max_request_size", 1048576)
 
-        self.API = APIRequestHandler._API
+        # Frames being processed, in arrival order. Bounded so a client can't pipeline us out of memory.
+        self.pending = asyncio.Queue(maxsize=self.API.config.get("max_pipeline", 32))
 
+        # The frame queued last. The next one waits for it to finish before running.
+        self.last_frame = None
+
+        # Set once a subscribe succeeds. No frame runs after that.
+        self.subscribed = False
+
+        # Set once the client has hung up.
+        self.closed = asyncio.Event()
+
+        self.stats = self.API.monitor.stats
+
+    async def handle(self):
         # Request user is not whitelisted.
         if self.client_address[0] not in self.API.config["allowed_hosts"]:
-            self.send_return_data({"error": True, "msg": "Address not whitelisted."})
+            self.stats.count("api_errors_total", kind="not_whitelisted")
+            await self.send_return_data({"error": True, "msg": "Address not whitelisted."})
             self.API.logger.debug("API: Request address not whitelisted. Address: {0}.".format(self.client_address[0]))
             return
 
-        # The data!
-        self.data = b''
+        self.stats.count("api_connections_total")
+
+        writer_task = asyncio.ensure_future(self.write_responses())
+
+        try:
+            await self.read_frames()
+        finally:
+            self.closed.set()
+
+            # Let the writer flush whatever is still in flight, then stop.
+            await self.pending.put(None)
+            await writer_task
+
+    async def read_frames(self):
+        buffer = b''
+        frames = 0
+        legacy = False
 
-        # Make sure you get all the data.
         while True:
-            buffer = self.request.recv(1024)
-            self.data += buffer
-            if len(buffer) < 1024:
+            if legacy:
+                # A legacy client expects us to hang up once it has its reply. Unless more data shows up
+                # shortly, in which case it was a framed client whose newline got split off.
+                try:
+                    chunk = await asyncio.wait_for(self.reader.read(65536), self.API.config.get("legacy_grace", 0.5))
+                except asyncio.TimeoutError:
+                    return
+
+                legacy = False
+            else:
+                chunk = await self.reader.read(65536)
+
+            if not chunk:
                 break
 
-        self.data = self.data.decode("utf-8")
+            buffer += chunk
+
+            *lines, buffer = buffer.split(b"\n")
+
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+
+                await self.queue_frame(line)
+                frames += 1
+
+            if len(buffer) > self.max_size:
+                await self.queue_result({"error": True, "msg": "Request too large."})
+                self.API.logger.info("API: Request over {0} bytes dropped. Address: {1}.".format(self.max_size, self.client_address[0]))
+                return
+
+            # Legacy one-shot client: one unterminated document, waiting for its reply.
+            if not frames and buffer.strip() and self.is_complete(buffer):
+                await self.queue_frame(buffer.strip())
+                buffer = b''
+                frames += 1
+                legacy = True
 
-        # No data.
-        if not self.data:
+        # The client half-closed after its last frame without a newline.
+        if buffer.strip():
+            await self.queue_frame(buffer.strip())
+
+    def is_complete(self, buffer):
+        try:
+            json.loads(buffer)
+        except ValueError:
+            return False
+
+        return True
+
+    async def queue_frame(self, frame):
+        if self.subscribed:
             return
 
+        self.last_frame = asyncio.ensure_future(self.process_in_turn(self.last_frame, frame))
+        await self.pending.put(self.last_frame)
+
+    async def process_in_turn(self, previous, frame):
+        if previous:
+            await asyncio.wait([previous])
+
+        # Queued behind a subscribe.
+        if self.subscribed:
+            return None
+
+        return await self.process_frame(frame)
+
+    async def queue_result(self, result):
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(result)
+        await self.pending.put(future)
+
+    async def write_responses(self):
+        while True:
+            task = await self.pending.get()
+
+            if task is None:
+                return
+
+            result = await task
+
+            try:
+                if isinstance(result, SubscriptionReply):
+                    # Keep the queue moving, so the reader never blocks on it and still notices the client leaving.
+                    discard = asyncio.ensure_future(self.discard_pending())
+
+                    try:
+                        await self.send_return_data(result.ack)
+                        await self.stream_events(result.subscriber)
+                    finally:
+                        discard.cancel()
+                    return
+
+                await self.send_return_data(result)
+            except (ConnectionError, OSError) as e:
+                self.API.logger.debug("API: Connection to {0} lost while replying: {1}".format(self.client_address[0], e))
+                self.writer.close()
+
+    async def discard_pending(self):
+        while await self.pending.get() is not None:
+            pass
+
+    async def stream_events(self, subscriber):
+        closed = asyncio.ensure_future(self.closed.wait())
+
+        try:
+            while True:
+                events = asyncio.ensure_future(subscriber.get())
+                await asyncio.wait([events, closed], return_when=asyncio.FIRST_COMPLETED)
+
+                if not events.done():
+                    events.cancel()
+                    return
+
+                for event in events.result():
+                    self.writer.write(json.dumps(event, separators=(',', ':')).encode("utf-8") + b"\n")
+
+                await self.writer.drain()
+        finally:
+            closed.cancel()
+            subscriber.close()
+            self.API.logger.debug("API: Subscriber at {0} went away.".format(self.client_address[0]))
+
+    async def process_frame(self, frame):
+        started = time.perf_counter()
+
         # Catch bad data and return information.
         try:
-            self.data = json.loads(self.data)
+            data = json.loads(frame.decode("utf-8"))
         except Exception as e:
-            self.API.logger.error("API: Request error: bad JSON data. Address: {0}. Error {1}. Data: {2}".format(self.client_address[0], e, self.data))
-            self.send_return_data({"error": True, "msg": "Unable to unpackage data."})
-            return
+            self.stats.count("api_errors_total", kind="bad_json")
+            self.API.logger.error("API: Request error: bad JSON data. Address: {0}. Error {1}. Data: {2}".format(self.client_address[0], e, frame))
+            return {"error": True, "msg": "Unable to unpackage data."}
+
+        self.stats.observe("api_parse_seconds", time.perf_counter() - started)
+
+        # A batch of commands.
+        if isinstance(data, list):
+            if not data:
+                return {"error": True, "msg": "Empty batch received."}
+
+            return list(await asyncio.gather(*[self.process_request(request, True) for request in data]))
 
+        return await self.process_request(data)
+
+    async def process_request(self, data, in_batch = False):
         # More bad data catching.
-        if "cmd" not in self.data or "auths" not in self.data or "args" not in self.data:
-            self.send_return_data({"error": True, "msg": "Malformed data received."})
-            self.API.logger.info("API: Malformed data received. Address: {0}. Data: {1}".format(self.client_address[0], self.data))
-            return
+        if not isinstance(data, dict) or "cmd" not in data or "auths" not in data or "args" not in data:
+            self.stats.count("api_errors_total", kind="malformed")
+            self.API.logger.info("API: Malformed data received. Address: {0}. Data: {1}".format(self.client_address[0], data))
+            return {"error": True, "msg": "Malformed data received."}
 
-        # Actually do the thing now!
+        started = time.perf_counter()
+
+        # Actually do the thing now! The command itself runs off of the event loop.
         try:
-            self.send_return_data(self.API.handle_command(self.data))
+            result = await self.API.run_command(data)
         except Exception as e:
-            self.send_return_data({"error": True, "msg": "Error caught while processing command."})
-            self.API.logger.error("API: Error caught while processing command: {0}. Data: {1}".format(e, self.data))
+            self.stats.count("api_errors_total", kind="exception")
+            self.API.logger.error("API: Error caught while processing command: {0}. Data: {1}".format(e, data))
+            result = {"error": True, "msg": "Error caught while processing command."}
+
+        # Includes time spent waiting for a worker, which command_seconds doesn't.
+        self.stats.observe("api_request_seconds", time.perf_counter() - started)
 
-        # And we're done.
-        return
+        if isinstance(result, Subscriber):
+            if in_batch:
+                result.close()
+                result = {"error": True, "msg": "Subscriptions can't be part of a batch."}
+            else:
+                self.subscribed = True
 
-    def send_return_data(self, _data):
+                ack = {"error": False, "msg": "Subscribed."}
+                if "id" in data:
+                    ack["id"] = data["id"]
+
+                return SubscriptionReply(result, ack)
+
+        if "id" in data and isinstance(result, PreSerialized):
+            result = result.data
+
+        if "id" in data and isinstance(result, dict):
+            result = dict(result, id=data["id"])
+
+        return result
+
+    async def send_return_data(self, _data):
         if not _data:
             self.API.logger.debug("API: No _data sent to send_return_data.")
             return
 
-        data = json.dumps(_data, separators=(',', ':'))
-        self.request.sendall(data.encode("utf-8"))
\ No newline at end of file
+        if isinstance(_data, PreSerialized):
+            data = _data.encoded
+        else:
+            started = time.perf_counter()
+
+            # Pre-serialized results inside of a batch get encoded along with the rest.
+            data = json.dumps(_data, separators=(',', ':'), default=lambda obj: obj.data).encode("utf-8")
+
+            self.stats.observe("api_serialize_seconds", time.perf_counter() - started)
+
+        self.writer.write(data + b"\n")
+        await self.writer.drain()
@@ -1 +1,2 @@
-from ServerMonitor.Subsystems.API.API import API
\ No newline at end of file
+from ServerMonitor.Subsystems.API.API import API
+from ServerMonitor.Subsystems.API.Dispatcher import Dispatcher
\ No newline at end of file
@@ -0,0 +1,271 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+class Compiler:
+    """Runs DreamMaker for servers and keeps a cache of what it built.
+
+    A build is keyed by the git commit of the server's checkout plus a hash of the
+    source tree, so two servers on the same code, or one server whose code hasn't
+    changed, reuse a cached .dmb instead of compiling again. Servers asking for a
+    build already in progress wait for it rather than compiling it again. No more
+    than max-parallel compiles run at once, however many are asked for.
+
+    A build is published by copying its files in beside the live ones in the game path,
+    then renaming them over those, the .rsc first and the .dmb last. DreamDaemon keeps
+    running from the game path, next to its config and data directories.
+    """
+    # Files which end up in a build.
+    source_extensions = (".dm", ".dme", ".dmm", ".dmi", ".dmf", ".ogg", ".wav", ".png", ".txt", ".json", ".html", ".css", ".js")
+
+    def __init__(self, _logger, _config = None):
+        if not _logger:
+            raise ValueError("COMPILER: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # Where finished builds are kept, one directory per build key.
+        self.cache_path = config.get("cache-path", "build-cache")
+
+        # Builds kept in the cache. Least recently used ones are thrown out first.
+        self.cache_entries = config.get("cache-entries", 10)
+
+        # Seconds a single DreamMaker run may take.
+        self.timeout = config.get("timeout", 1800)
+
+        # Caps the number of DreamMaker processes.
+        self.max_parallel = config.get("max-parallel", 2)
+        self.slots = threading.BoundedSemaphore(self.max_parallel)
+
+        # path -> (size, mtime, digest), so unchanged files are never read twice.
+        self.file_hashes = {}
+
+        # Server name -> state of its last build.
+        self.status = {}
+
+        # Build key -> [lock, users] for the builds in progress.
+        self.building = {}
+
+        self.lock = threading.Lock()
+
+    def get_commit(self, server):
+        try:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=server.git_path, stderr=subprocess.DEVNULL).decode("utf-8").strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+
+        with self.lock:
+            cached = self.file_hashes.get(path)
+
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1048576), b''):
+                digest.update(block)
+
+        with self.lock:
+            self.file_hashes[path] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+
+        return digest.hexdigest()
+
+    def get_source_hash(self, server):
+        """Hashes every source file under the server's git path."""
+        digest = hashlib.sha1()
+
+        for root, dirs, files in os.walk(server.git_path):
+            dirs[:] = sorted(d for d in dirs if d != ".git")
+
+            for name in sorted(files):
+                if not name.lower().endswith(self.source_extensions):
+                    continue
+
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, server.git_path).encode("utf-8"))
+                digest.update(self.hash_file(path).encode("ascii"))
+
+        return digest.hexdigest()
+
+    def get_build_key(self, server):
+        digest = hashlib.sha1()
+        digest.update(str(self.get_commit(server)).encode("utf-8"))
+        digest.update(self.get_source_hash(server).encode("ascii"))
+        digest.update(server.get_dm_path().encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def set_status(self, server, **kwargs):
+        with self.lock:
+            self.status.setdefault(server.name, {}).update(kwargs)
+
+    def get_status(self, name):
+        with self.lock:
+            return dict(self.status.get(name, {"state": "never"}))
+
+    def compile(self, server, cancelled = None):
+        """Builds, or fetches from cache, the .dmb for server and publishes it into its game path.
+
+        Setting cancelled stops it at the next step, up until the build is published.
+        """
+        started = time.time()
+        self.set_status(server, state="hashing", started=started, finished=None, error=None)
+
+        try:
+            self.check_cancelled(cancelled, "hashing")
+
+            key = self.get_build_key(server)
+            build_dir = os.path.join(self.cache_path, key)
+
+            # Waits out anyone already building the same key, then finds it cached.
+            self.set_status(server, state="waiting")
+
+            with self.get_build_lock(key):
+                cached = os.path.isdir(build_dir)
+
+                if not cached:
+                    with self.slots:
+                        self.check_cancelled(cancelled, "compiling")
+
+                        self.set_status(server, state="compiling")
+                        self.build(server, build_dir)
+                else:
+                    # Mark it as recently used.
+                    os.utime(build_dir)
+
+            self.check_cancelled(cancelled, "publishing")
+
+            self.set_status(server, state="publishing")
+            self.publish(server, key, build_dir)
+        except Exception as e:
+            state = "cancelled" if cancelled and cancelled.is_set() else "failed"
+            self.set_status(server, state=state, finished=time.time(), error=str(e))
+            self.logger.error("COMPILER {0}: Build {1}: {2}".format(server.name, state, e))
+            raise
+
+        server.server_ready = True
+
+        self.set_status(server, state="done", key=key, cached=cached, finished=time.time(), duration=round(time.time() - started, 2))
+        self.logger.info("COMPILER {0}: Published build {1}{2}.".format(server.name, key[:12], " from cache" if cached else ""))
+
+        self.prune()
+
+        return self.get_status(server.name)
+
+    def check_cancelled(self, cancelled, step):
+        if cancelled and cancelled.is_set():
+            raise RuntimeError("Cancelled before {0}.".format(step))
+
+    @contextlib.contextmanager
+    def get_build_lock(self, key):
+        """Held while a build key is checked and built, so the same build only ever runs once at a time."""
+        with self.lock:
+            entry = self.building.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+
+                if not entry[1]:
+                    del self.building[key]
+
+    def compile_many(self, servers, cancelled = None):
+        """Compiles several servers at once. Returns server name -> status."""
+        results = {}
+
+        if not servers:
+            return results
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(servers), thread_name_prefix="Compiler") as pool:
+            futures = {pool.submit(self.compile, server, cancelled): server for server in servers}
+
+            for future in concurrent.futures.as_completed(futures):
+                server = futures[future]
+
+                try:
+                    results[server.name] = future.result()
+                except Exception:
+                    results[server.name] = self.get_status(server.name)
+
+        return results
+
+    def build(self, server, build_dir):
+        # Don't publish half of an old build if DreamMaker fails early.
+        for path in (server.get_build_dmb_path(), server.get_build_rsc_path()):
+            if os.path.isfile(path):
+                os.remove(path)
+
+        process = subprocess.run([server.get_dm_path(), server.get_dme_path()], cwd=server.git_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout)
+
+        if process.returncode != 0 or not os.path.isfile(server.get_build_dmb_path()):
+            tail = process.stdout.decode("utf-8", errors="replace").strip().splitlines()[-5:]
+            raise RuntimeError("DreamMaker exited with code {0}: {1}".format(process.returncode, " | ".join(tail)))
+
+        # Assemble the build next to its final place, then move it in with one rename.
+        os.makedirs(self.cache_path, exist_ok=True)
+        staging = build_dir + ".tmp{0}".format(threading.get_ident())
+        os.makedirs(staging)
+
+        shutil.copy2(server.get_build_dmb_path(), os.path.join(staging, "baystation12.dmb"))
+        if os.path.isfile(server.get_build_rsc_path()):
+            shutil.copy2(server.get_build_rsc_path(), os.path.join(staging, "baystation12.rsc"))
+
+        try:
+            os.rename(staging, build_dir)
+        except OSError:
+            # Lost a race against an identical build. Theirs is as good as ours.
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def publish(self, server, key, build_dir):
+        pairs = [(os.path.join(build_dir, "baystation12.rsc"), server.get_rsc_path()), (os.path.join(build_dir, "baystation12.dmb"), server.get_dmb_path())]
+        pairs = [(source, target) for source, target in pairs if os.path.isfile(source)]
+
+        # Copy everything in beside the live files first, so a failed copy leaves them alone.
+        for source, target in pairs:
+            shutil.copy2(source, target + ".tmp")
+
+        # Then swap them in, the .dmb last, as that's what a start looks for.
+        for source, target in pairs:
+            os.replace(target + ".tmp", target)
+
+    def prune(self):
+        try:
+            entries = [os.path.join(self.cache_path, name) for name in os.listdir(self.cache_path)]
+        except OSError:
+            return
+
+        entries = sorted((path for path in entries if os.path.isdir(path) and ".tmp" not in os.path.basename(path)), key=os.path.getmtime)
+
+        for path in entries[:max(0, len(entries) - self.cache_entries)]:
+            shutil.rmtree(path, ignore_errors=True)
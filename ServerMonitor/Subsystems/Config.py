@@ -14,8 +14,19 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see http://www.gnu.org/licenses/.
 
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
 import yaml
-import os.path
+
+# inotify flags we care about: the file was written, or replaced by a rename or new file.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
 
 class Config:
     def __init__(self, _path, _logger):
@@ -29,20 +40,133 @@ class Config:
         # Assign logger.
         self.logger = _logger
 
+        # The file we're read from.
+        self.path = _path
+
         # Initialize config as a dictionary.
-        self.config = {}
+        self.config = self.load()
 
-        if not os.path.isfile(_path):
+        # The file's mtime when we last read it.
+        self.mtime = os.path.getmtime(self.path)
+
+    def load(self):
+        if not os.path.isfile(self.path):
             raise RuntimeError("Config is unable to open configuration file.")
 
-        with open(_path, 'r') as f:
+        with open(self.path, 'r') as f:
             try:
-                self.config = yaml.load(f)
+                config = yaml.safe_load(f)
             except yaml.YAMLError as e:
                 raise RuntimeError(e)
 
+        if not isinstance(config, dict):
+            raise RuntimeError("Configuration file does not hold a mapping.")
+
+        return config
+
     def get_value(self, key):
         if key in self.config:
             return self.config[key]
 
-        return None
\ No newline at end of file
+        return None
+
+    def reload(self, validate = None):
+        """Reads the file again. Returns (old, new) config dicts. The old config stays in place on errors.
+
+        validate(config) may raise RuntimeError to reject the new config before it's swapped in.
+        """
+        config = self.load()
+
+        if validate:
+            validate(config)
+
+        old = self.config
+        self.config = config
+        self.mtime = os.path.getmtime(self.path)
+
+        return old, config
+
+    def watch(self, callback, interval = 2):
+        """Calls callback() from a background thread whenever the file changes.
+
+        Uses inotify on the file's directory where available, as editors tend to replace
+        files rather than write them in place. Elsewhere the mtime is polled every
+        interval seconds.
+        """
+        thread = threading.Thread(target=self.watch_loop, args=(callback, interval), name="ConfigWatcher", daemon=True)
+        thread.start()
+
+        return thread
+
+    def watch_loop(self, callback, interval):
+        fd = self.open_inotify()
+
+        if fd is None:
+            self.logger.info("MAIN: Watching config by polling its mtime every {0} seconds.".format(interval))
+
+        while True:
+            if fd is not None:
+                if not self.wait_inotify(fd):
+                    continue
+
+                # Let the writer finish, and swallow the burst of events a save makes.
+                time.sleep(0.2)
+                self.drain_inotify(fd)
+            else:
+                time.sleep(interval)
+
+                try:
+                    if os.path.getmtime(self.path) == self.mtime:
+                        continue
+                except OSError:
+                    continue
+
+            try:
+                callback()
+            except Exception as e:
+                self.logger.error("MAIN: Error while reloading config: {0}".format(e))
+
+    def open_inotify(self):
+        if not hasattr(os, "uname") or os.uname().sysname != "Linux":
+            return None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+
+            if fd < 0:
+                return None
+
+            directory = os.path.dirname(os.path.abspath(self.path)).encode("utf-8")
+
+            if libc.inotify_add_watch(fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+                os.close(fd)
+                return None
+        except (OSError, AttributeError):
+            return None
+
+        return fd
+
+    def wait_inotify(self, fd):
+        """Blocks until something happens to our file. Returns False for events on other files."""
+        select.select([fd], [], [])
+        return self.drain_inotify(fd)
+
+    def drain_inotify(self, fd):
+        name = os.path.basename(self.path).encode("utf-8")
+        ours = False
+
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                return ours
+
+            offset = 0
+            while offset < len(data):
+                _wd, _mask, _cookie, length = struct.unpack_from("iIII", data, offset)
+                event_name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+                offset += 16 + length
+
+                if event_name == name:
+                    ours = True
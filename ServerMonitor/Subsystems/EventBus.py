@@ -0,0 +1,180 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import asyncio
+import collections
+import threading
+import time
+
+class Subscriber:
+    """One subscription. Holds a bounded queue of events waiting to be sent.
+
+    When the queue is full, the "drop" overflow policy throws out the oldest event,
+    while "coalesce" replaces the queued event for the same topic and server if
+    there is one, and otherwise drops the oldest. Either way, the number of events
+    lost is reported to the client with a "dropped" event.
+    """
+    def __init__(self, _bus, _topics, _servers, _size, _overflow):
+        self.bus = _bus
+
+        # None matches everything.
+        self.topics = set(_topics) if _topics else None
+        self.servers = set(_servers) if _servers else None
+
+        self.size = _size
+        self.overflow = _overflow
+
+        self.queue = collections.deque()
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+        # The loop the consumer waits on, and the event it waits for. Set on the first get().
+        self.loop = None
+        self.ready = None
+
+    def matches(self, event):
+        if self.topics is not None and event["event"] not in self.topics:
+            return False
+
+        if self.servers is not None and event["server"] not in self.servers:
+            return False
+
+        return True
+
+    def put(self, event):
+        with self.lock:
+            if len(self.queue) >= self.size:
+                replaced = False
+
+                if self.overflow == "coalesce":
+                    for i, queued in enumerate(self.queue):
+                        if queued["event"] == event["event"] and queued["server"] == event["server"]:
+                            del self.queue[i]
+                            replaced = True
+                            break
+
+                if not replaced:
+                    self.queue.popleft()
+
+                self.dropped += 1
+
+            self.queue.append(event)
+
+            loop, ready = self.loop, self.ready
+
+        if loop:
+            loop.call_soon_threadsafe(ready.set)
+
+    async def get(self):
+        """Waits for and returns the next batch of events."""
+        if not self.loop:
+            with self.lock:
+                self.loop = asyncio.get_running_loop()
+                self.ready = asyncio.Event()
+
+        while True:
+            with self.lock:
+                if self.queue or self.dropped:
+                    events = list(self.queue)
+                    self.queue.clear()
+
+                    if self.dropped:
+                        events.insert(0, {"event": "dropped", "server": None, "time": time.time(), "data": {"count": self.dropped}})
+                        self.dropped = 0
+
+                    self.ready.clear()
+                    return events
+
+            await self.ready.wait()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+class EventBus:
+    """Fans lifecycle events out to API subscribers and internal listeners."""
+    def __init__(self, _logger, _config = None):
+        if not _logger:
+            raise ValueError("EVENTS: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # Per subscriber queue sizes.
+        self.default_size = config.get("queue", 100)
+        self.max_size = config.get("max-queue", 1000)
+
+        self.subscribers = []
+
+        # Plain callables ran with every event, on the publishing thread.
+        self.listeners = []
+
+        self.lock = threading.Lock()
+
+    def subscribe(self, topics = None, servers = None, size = None, overflow = "drop"):
+        if overflow not in ("drop", "coalesce"):
+            raise ValueError("Invalid overflow policy.")
+
+        size = min(int(size or self.default_size), self.max_size)
+        if size < 1:
+            raise ValueError("Invalid queue size.")
+
+        subscriber = Subscriber(self, self.get_names(topics, "topics"), self.get_names(servers, "servers"), size, overflow)
+
+        with self.lock:
+            self.subscribers.append(subscriber)
+
+        return subscriber
+
+    def get_names(self, names, kind):
+        """A topics or servers filter as a list. A lone name counts as a list of one."""
+        if names is None:
+            return None
+
+        if isinstance(names, str):
+            return [names]
+
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise ValueError("{0} must be a list of names.".format(kind))
+
+        return names
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def add_listener(self, callback):
+        with self.lock:
+            self.listeners.append(callback)
+
+    def publish(self, topic, server = None, **data):
+        event = {"event": topic, "server": server, "time": time.time(), "data": data}
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+            listeners = list(self.listeners)
+
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                self.logger.error("EVENTS: Error in listener for {0}: {1}".format(topic, e))
+
+        for subscriber in subscribers:
+            if subscriber.matches(event):
+                subscriber.put(event)
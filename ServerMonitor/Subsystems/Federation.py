@@ -0,0 +1,249 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import asyncio
+import itertools
+import json
+import time
+
+class Remote:
+    """Another monitor's API, reached over a small pool of persistent connections.
+
+    The connections, and the semaphore capping them, belong to the event loop using
+    them, which is the API's. They're made on it when first needed, and made anew
+    should another loop ever use the remote.
+    """
+    def __init__(self, _name, _config, _pool_size):
+        self.name = _name
+        self.host = _config.get("host", "127.0.0.1")
+        self.port = _config["port"]
+
+        # The auths status queries are sent with.
+        self.auths = _config.get("auths", ["R_ADMIN"])
+
+        # Idle (reader, writer) pairs, and a cap on how many may be open at once.
+        self.idle = []
+        self.pool_size = _pool_size
+        self.slots = None
+
+        # The loop the connections and slots belong to.
+        self.loop = None
+
+        # The last get_servers reply, its version and epoch, and when it was current.
+        self.status = None
+        self.version = None
+        self.epoch = None
+        self.status_at = None
+        self.latency = None
+
+        # When the last status query finished, and why it failed if it did.
+        self.checked_at = None
+        self.error = None
+
+        # The status query in flight, so concurrent requests share it.
+        self.refreshing = None
+
+        self.ids = itertools.count(1)
+
+    async def call(self, cmd, args, auths):
+        """Sends one command and returns the reply. Connections are reused between calls."""
+        loop = asyncio.get_running_loop()
+
+        if loop is not self.loop:
+            self.close()
+            self.loop = loop
+            self.slots = asyncio.Semaphore(self.pool_size)
+
+        async with self.slots:
+            if self.idle:
+                reader, writer = self.idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+
+            request = {"cmd": cmd, "args": args, "auths": auths, "id": next(self.ids)}
+
+            try:
+                writer.write(json.dumps(request, separators=(',', ':')).encode("utf-8") + b"\n")
+                await writer.drain()
+
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("Connection closed by the remote monitor.")
+
+                reply = json.loads(line)
+
+                if not isinstance(reply, dict) or reply.get("id") != request["id"]:
+                    raise ConnectionError("Reply out of step with the request.")
+            except BaseException:
+                # Timed out, cancelled or broken: the connection's state is unknown, so don't reuse it.
+                writer.close()
+                raise
+
+            self.idle.append((reader, writer))
+
+            return reply
+
+    def close(self):
+        for _reader, writer in self.idle:
+            writer.close()
+
+        self.idle = []
+
+class Federation:
+    """Puts the servers of several monitors behind one API.
+
+    Remote monitors are asked concurrently, each within timeout seconds. A remote
+    which doesn't answer in time is reported with its last known status, marked
+    stale, and isn't waited on again until it answers, so one slow or dead host
+    never holds up the rest. Status replies are
+    cached for cache-ttl seconds and refreshed with if_newer_than, so a remote only
+    sends its servers again when they changed.
+    """
+    def __init__(self, _logger, _config = None):
+        if not _logger:
+            raise ValueError("FEDERATION: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # What this monitor is called in merged replies.
+        self.name = config.get("name", "local")
+
+        # Seconds a remote gets to answer.
+        self.timeout = config.get("timeout", 2)
+
+        # Seconds a remote's status is served from cache without asking again.
+        self.cache_ttl = config.get("cache-ttl", 1)
+
+        self.remotes = {}
+
+        for name, remote in (config.get("remotes") or {}).items():
+            if name == self.name or not remote or "port" not in remote:
+                raise ValueError("FEDERATION: Invalid remote {0}.".format(name))
+
+            self.remotes[name] = Remote(name, remote, config.get("pool-size", 4))
+
+    def split_target(self, target):
+        """Splits "host/server" into (host, server). A bare server name means this monitor."""
+        if not isinstance(target, str):
+            raise ValueError("Invalid target.")
+
+        host, _, server = target.rpartition("/")
+
+        return (host or self.name), server
+
+    async def refresh(self, remote):
+        started = time.monotonic()
+        args = {"if_newer_than": remote.version} if remote.version is not None else {}
+
+        # So a remote restarted since answers in full, even if its version caught back up to ours.
+        if remote.epoch is not None:
+            args["epoch"] = remote.epoch
+
+        try:
+            reply = await asyncio.wait_for(remote.call("get_servers", args, remote.auths), self.timeout)
+
+            if reply.get("error"):
+                raise RuntimeError(reply.get("msg"))
+        except Exception as e:
+            remote.error = str(e) or type(e).__name__
+            remote.checked_at = time.monotonic()
+            self.logger.debug("FEDERATION: Status query to {0} failed: {1}".format(remote.name, remote.error))
+            return
+
+        if not reply.get("unchanged"):
+            remote.status = reply.get("data") or {}
+
+        remote.version = reply.get("version")
+        remote.epoch = reply.get("epoch")
+        remote.status_at = time.monotonic()
+        remote.latency = round(time.monotonic() - started, 4)
+        remote.checked_at = remote.status_at
+        remote.error = None
+
+    async def get_status(self, remote):
+        if not remote.refreshing and (remote.checked_at is None or time.monotonic() - remote.checked_at > self.cache_ttl):
+            remote.refreshing = asyncio.ensure_future(self.refresh(remote))
+            remote.refreshing.add_done_callback(lambda _future: setattr(remote, "refreshing", None))
+
+        # A remote which failed last time isn't waited on again. It's picked back up once it answers.
+        if remote.refreshing and (remote.checked_at is None or remote.error is None):
+            await asyncio.shield(remote.refreshing)
+
+        age = time.monotonic() - remote.status_at if remote.status_at is not None else None
+
+        return {
+            "ok": remote.error is None,
+            "error": remote.error,
+            "stale": remote.error is not None,
+            "age": round(age, 1) if age is not None else None,
+            "latency": remote.latency
+        }, remote.status or {}
+
+    async def get_servers(self, local):
+        """Merges this monitor's status with every remote's. Server keys are "host/server"."""
+        remotes = list(self.remotes.values())
+        results = await asyncio.gather(*[self.get_status(remote) for remote in remotes])
+
+        hosts = {}
+        servers = {}
+
+        def merge(host, state, status):
+            hosts[host] = state
+
+            for name, info in status.items():
+                servers["{0}/{1}".format(host, name)] = dict(info, host=host, stale=state["stale"])
+
+        merge(self.name, {"ok": True, "error": None, "stale": False, "age": 0, "latency": 0}, local)
+
+        for remote, (state, status) in zip(remotes, results):
+            merge(remote.name, state, status)
+
+        return {"error": False, "msg": None, "data": {"hosts": hosts, "servers": servers}}
+
+    async def send(self, remote, cmd, args, auths):
+        try:
+            return await asyncio.wait_for(remote.call(cmd, args, auths), self.timeout)
+        except asyncio.TimeoutError:
+            return {"error": True, "msg": "{0} did not answer within {1} seconds.".format(remote.name, self.timeout)}
+        except Exception as e:
+            return {"error": True, "msg": "Unable to reach {0}: {1}".format(remote.name, e)}
+
+    async def control(self, targets, control, auths, results):
+        """Sends server_control to every remote target at once, adding the replies to results."""
+        pending = []
+
+        for target, (host, server) in targets.items():
+            remote = self.remotes.get(host)
+
+            if not remote:
+                results[target] = {"error": True, "msg": "Unknown host."}
+                continue
+
+            pending.append((target, self.send(remote, "server_control", {"server": server, "control": control}, auths)))
+
+        replies = await asyncio.gather(*[call for _target, call in pending])
+
+        for (target, _call), reply in zip(pending, replies):
+            reply.pop("id", None)
+            results[target] = reply
+
+        return {"error": all(result.get("error") for result in results.values()), "msg": None, "data": results}
+
+    def get_hosts(self):
+        return [self.name] + list(self.remotes)
@@ -0,0 +1,201 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import asyncio
+import struct
+import threading
+import time
+import urllib.parse
+
+class HealthProber(threading.Thread):
+    """Sends BYOND world/Topic status queries to every running server, all at once.
+
+    Results are cached, so nothing asking about a server's health ever waits on a probe.
+    A server which keeps failing probes well after it started is force restarted.
+    """
+    def __init__(self, _monitor, _logger, _config = None):
+        threading.Thread.__init__(self)
+
+        self.name = "HealthProber"
+        self.daemon = True
+
+        if not _monitor:
+            raise ValueError("HEALTH: Wasn't handed a monitor object.")
+
+        # Monitor object to read the servers from.
+        self.monitor = _monitor
+
+        if not _logger:
+            raise ValueError("HEALTH: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # Seconds between probe rounds, and how long a single probe may take.
+        self.interval = config.get("interval", 10)
+        self.timeout = config.get("timeout", 2)
+
+        # Results older than this are reported as stale.
+        self.ttl = config.get("ttl", 30)
+
+        # Where to send the queries.
+        self.host = config.get("host", "127.0.0.1")
+
+        # Restart a server after this many failed probes in a row...
+        self.max_failures = config.get("max-failures", 6)
+
+        # ... as long as it's been up at least this many seconds.
+        self.grace = config.get("grace", 300)
+
+        self.restart_unhealthy = config.get("restart-unhealthy", True)
+
+        # Server name -> last result.
+        self.results = {}
+
+        self.lock = threading.Lock()
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.probe_forever())
+
+    async def probe_forever(self):
+        while True:
+            started = time.monotonic()
+
+            try:
+                await self.probe_all()
+            except Exception as e:
+                self.logger.error("HEALTH: Error during probe round: {0}".format(e))
+
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    async def probe_all(self):
+        servers = [server for server in list(self.monitor.servers) if server.server_thread and server.server_thread.process]
+
+        if not servers:
+            return
+
+        results = await asyncio.gather(*[self.probe(server.active_port) for server in servers])
+
+        for server, result in zip(servers, results):
+            self.record(server, result)
+
+    async def probe(self, port):
+        started = time.monotonic()
+
+        try:
+            status = await asyncio.wait_for(self.query(port, "?status"), self.timeout)
+        except Exception as e:
+            return {"ok": False, "error": str(e) or type(e).__name__}
+
+        return {"ok": True, "latency": round(time.monotonic() - started, 4), "data": self.parse_status(status)}
+
+    async def query(self, port, topic):
+        reader, writer = await asyncio.open_connection(self.host, port)
+
+        try:
+            writer.write(self.pack_topic(topic))
+            await writer.drain()
+
+            header = await reader.readexactly(4)
+            if header[:2] != b"\x00\x83":
+                raise ValueError("Bad Topic reply header.")
+
+            length = struct.unpack(">H", header[2:])[0]
+            return self.unpack_reply(await reader.readexactly(length))
+        finally:
+            writer.close()
+
+    @staticmethod
+    def pack_topic(topic):
+        payload = topic.encode("utf-8")
+        return b"\x00\x83" + struct.pack(">H", len(payload) + 6) + b"\x00" * 5 + payload + b"\x00"
+
+    @staticmethod
+    def unpack_reply(body):
+        kind, data = body[0], body[1:]
+
+        # A float.
+        if kind == 0x2a:
+            return struct.unpack("<f", data[:4])[0]
+
+        # A string.
+        if kind == 0x06:
+            return data.rstrip(b"\x00").decode("utf-8", errors="replace")
+
+        return None
+
+    @staticmethod
+    def parse_status(status):
+        """Turns a status reply into a dict, pulling out the few keys worth knowing about."""
+        if not isinstance(status, str):
+            return {"raw": status}
+
+        fields = {key: values[-1] for key, values in urllib.parse.parse_qs(status, keep_blank_values=True).items()}
+
+        for key in ("players", "tick_usage", "cpu", "time_dilation"):
+            if key in fields:
+                try:
+                    fields[key] = float(fields[key])
+                except ValueError:
+                    pass
+
+        return fields
+
+    def record(self, server, result):
+        result["time"] = time.time()
+
+        with self.lock:
+            previous = self.results.get(server.name, {})
+            result["failures"] = 0 if result["ok"] else previous.get("failures", 0) + 1
+            self.results[server.name] = result
+
+        if previous.get("ok") is not None and previous["ok"] != result["ok"]:
+            if result["ok"]:
+                self.monitor.events.publish("health_recovered", server.name)
+            else:
+                self.monitor.events.publish("health_degraded", server.name, error=result["error"])
+
+        if result["ok"] or not self.restart_unhealthy or result["failures"] < self.max_failures:
+            return
+
+        thread = server.server_thread
+        if not thread or not thread.started_at or time.monotonic() - thread.started_at < self.grace:
+            return
+
+        self.logger.warning("SERVER {0}: Failed {1} health probes in a row. Restarting.".format(server.name, result["failures"]))
+
+        with self.lock:
+            result["failures"] = 0
+
+        thread.force_restart()
+
+    def get_health(self, name):
+        """Returns the cached result for a server, flagged stale once it's older than the TTL."""
+        with self.lock:
+            result = self.results.get(name)
+
+            if not result:
+                return {"ok": None, "stale": True}
+
+            result = dict(result)
+
+        result["stale"] = time.time() - result["time"] > self.ttl
+
+        return result
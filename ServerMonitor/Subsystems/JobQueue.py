@@ -0,0 +1,218 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+# Lower runs first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+class Job:
+    def __init__(self, _id, _name, _callback, _data, _priority, _keys):
+        self.id = _id
+        self.name = _name
+        self.callback = _callback
+        self.data = _data
+        self.priority = _priority
+
+        # The servers, or other things, this job touches. Jobs sharing a key never run at the same time.
+        self.keys = frozenset(_keys or ())
+
+        # One of queued, running, done, failed, cancelled.
+        self.status = "queued"
+        self.result = None
+        self.error = None
+
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+        # Set when a cancel is requested. Long running callbacks may check it and bail out early.
+        self.cancelled = threading.Event()
+
+    def get_state(self):
+        return {
+            "id": self.id,
+            "cmd": self.name,
+            "keys": sorted(self.keys),
+            "priority": self.priority,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+class JobQueue:
+    """Runs long operations on a bounded pool of worker threads.
+
+    Jobs are picked in priority order, oldest first within a priority, skipping any which
+    shares a key with a job that is running, or with one ahead of it that has to wait. So
+    a job on every server isn't overtaken forever by jobs on single ones. Finished jobs
+    are kept around for polling until more than history of them pile up.
+    """
+    def __init__(self, _logger, _config = None):
+        if not _logger:
+            raise ValueError("JOBS: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # Heap of (priority, sequence, job) waiting to run.
+        self.queue = []
+        self.sequence = itertools.count()
+
+        # Every known job by ID, oldest first.
+        self.jobs = collections.OrderedDict()
+        self.history = config.get("history", 200)
+
+        # Keys with a job running on them right now.
+        self.busy = set()
+
+        self.condition = threading.Condition()
+
+        # The job each worker thread is running, for callbacks which want to check for a cancel.
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+
+        self.workers = []
+        for i in range(config.get("workers", 4)):
+            worker = threading.Thread(target=self.work, name="Jobs-{0}".format(i), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, name, callback, data, priority = PRIORITY_NORMAL, keys = None):
+        """Queues callback(data) and returns the Job tracking it. keys are the server names, or other keys, it touches."""
+        with self.condition:
+            job = Job(next(self.ids), name, callback, data, priority, keys)
+
+            self.jobs[job.id] = job
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+            self.prune()
+
+            self.condition.notify()
+
+        self.logger.debug("JOBS: Queued job {0} ({1}).".format(job.id, name))
+
+        return job
+
+    def get_current(self):
+        """The job running on the calling worker thread, or None."""
+        return getattr(self.local, "job", None)
+
+    def get_job(self, id):
+        with self.condition:
+            return self.jobs.get(id)
+
+    def get_jobs(self):
+        with self.condition:
+            return list(self.jobs.values())
+
+    def cancel(self, id):
+        """Cancels a job. Queued jobs never run; running ones are only asked to stop. Returns the job, or None."""
+        with self.condition:
+            job = self.jobs.get(id)
+
+            if not job:
+                return None
+
+            job.cancelled.set()
+
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished = time.time()
+
+        self.logger.info("JOBS: Cancel requested for job {0}.".format(id))
+
+        return job
+
+    def prune(self):
+        finished = [job.id for job in self.jobs.values() if job.finished]
+
+        for id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[id]
+
+    def next_job(self):
+        """Pops the most important job that may run right now. Must be called with the condition held."""
+        skipped = []
+        found = None
+
+        # Keys of the jobs passed over so far. Anything behind them on the same key waits its turn.
+        waiting = set()
+
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            job = entry[2]
+
+            if job.status == "cancelled":
+                continue
+
+            if not job.keys.isdisjoint(self.busy) or not job.keys.isdisjoint(waiting):
+                waiting |= job.keys
+                skipped.append(entry)
+                continue
+
+            found = job
+            break
+
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+
+        return found
+
+    def work(self):
+        while True:
+            with self.condition:
+                job = self.next_job()
+                while not job:
+                    self.condition.wait()
+                    job = self.next_job()
+
+                job.status = "running"
+                job.started = time.time()
+
+                self.busy |= job.keys
+
+            self.local.job = job
+
+            try:
+                result = job.callback(job.data)
+                status = "cancelled" if job.cancelled.is_set() else "done"
+            except Exception as e:
+                self.logger.error("JOBS: Job {0} ({1}) failed: {2}".format(job.id, job.name, e))
+                result = None
+                job.error = str(e)
+                status = "failed"
+            finally:
+                self.local.job = None
+
+            with self.condition:
+                job.result = result
+                job.status = status
+                job.finished = time.time()
+
+                self.busy -= job.keys
+
+                # A job blocked on these keys may be runnable now.
+                self.condition.notify_all()
@@ -0,0 +1,503 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import datetime
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+# Index file layout: a header naming the log file's inode, then one record per log entry.
+HEADER = struct.Struct("<4sIQ")
+RECORD = struct.Struct("<dQIB")
+MAGIC = b"SMLI"
+VERSION = 1
+
+SEVERITIES = ("info", "warning", "error", "runtime")
+
+# [HH:MM:SS] or [YYYY-MM-DD HH:MM:SS.fff] at the start of a line.
+TIMESTAMP = re.compile(rb"\[(?:(\d{4})-(\d{2})-(\d{2})[ T])?(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?\]")
+
+# A date in the log's path, e.g. 2016/10-October/17-Monday.log or 2016-10-17.log.
+PATH_DATE = re.compile(r"(\d{4})[\\/_-](\d{2})(?:-[A-Za-z]+)?[\\/_-](\d{2})")
+
+# An entry longer than this is cut in two, so a log without timestamps doesn't make one endless entry.
+MAX_ENTRY = 1048576
+
+# Bytes of a log read and parsed at once. Well above MAX_ENTRY, so every chunk gets somewhere.
+READ_CHUNK = 4 * MAX_ENTRY
+
+def get_severity(line):
+    line = line.lower()
+
+    if b"runtime error" in line:
+        return 3
+
+    if b"error" in line:
+        return 2
+
+    if b"warning" in line:
+        return 1
+
+    return 0
+
+class LogFile:
+    """One log file and its index.
+
+    An entry starts at a line with a timestamp or a runtime error, and runs until the
+    next one starts, so the proc and source lines of a runtime belong to it. The entry
+    still being written to is kept out of the index until the next one starts; indexed
+    is where it begins, and where the next pass picks up reading.
+    """
+    def __init__(self, _path, _name, _index_path):
+        self.path = _path
+
+        # The path relative to the log directory, as shown to API clients.
+        self.name = _name
+        self.index_path = _index_path
+
+        self.inode = None
+        self.indexed = 0
+        self.size = 0
+        self.count = 0
+        self.first_time = None
+        self.last_time = None
+
+        # For logs which only give the time of day: the date it falls on, and the last time of day seen.
+        self.day = None
+        self.last_tod = None
+
+        # The (time, severity, end) of the entry past indexed, which isn't in the index yet.
+        self.pending = None
+
+        # Held while the index file is reset or the counts change, so a search sees them all at once.
+        self.lock = threading.RLock()
+
+    def open(self):
+        """Picks up an existing index, if it still belongs to the same log file."""
+        st = os.stat(self.path)
+        self.inode = st.st_ino
+
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b''
+
+        if len(data) < HEADER.size or HEADER.unpack_from(data) != (MAGIC, VERSION, self.inode):
+            self.reset()
+            return
+
+        self.count = (len(data) - HEADER.size) // RECORD.size
+
+        # Drop a record cut short by a crash.
+        if HEADER.size + self.count * RECORD.size != len(data):
+            with open(self.index_path, "r+b") as f:
+                f.truncate(HEADER.size + self.count * RECORD.size)
+
+        if self.count:
+            self.first_time = RECORD.unpack_from(data, HEADER.size)[0]
+            self.last_time, offset, length, _severity = RECORD.unpack_from(data, HEADER.size + (self.count - 1) * RECORD.size)
+            self.indexed = offset + length
+
+        if self.last_time:
+            stamp = datetime.datetime.fromtimestamp(self.last_time)
+            self.day = stamp.date()
+            self.last_tod = stamp.hour * 3600 + stamp.minute * 60 + stamp.second
+
+    def reset(self):
+        with self.lock:
+            with open(self.index_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, self.inode))
+
+            self.indexed = 0
+            self.size = 0
+            self.count = 0
+            self.first_time = None
+            self.last_time = None
+            self.day = None
+            self.last_tod = None
+            self.pending = None
+
+    def get_time(self, match, last):
+        """Turns a timestamp match into a Unix time. Times never go backwards within a file."""
+        year, month, day, hour, minute, second, fraction = match.groups()
+        tod = int(hour) * 3600 + int(minute) * 60 + int(second) + (float(b"0." + fraction) if fraction else 0)
+
+        if year:
+            stamp = datetime.datetime(int(year), int(month), int(day)).timestamp() + tod
+        else:
+            if self.day is None:
+                found = PATH_DATE.search(self.name)
+                self.day = datetime.date(*map(int, found.groups())) if found else datetime.date.fromtimestamp(os.path.getmtime(self.path))
+            elif self.last_tod is not None and tod < self.last_tod - 43200:
+                # Went past midnight.
+                self.day += datetime.timedelta(days=1)
+
+            self.last_tod = tod
+            stamp = datetime.datetime.combine(self.day, datetime.time()).timestamp() + tod
+
+        return max(stamp, last or 0)
+
+    def parse(self, data, base, last):
+        """Splits complete lines of data, read from offset base, into entries.
+
+        Returns (entries, start of the unfinished last entry, its (time, severity, end)).
+        Entries are (time, offset, length, severity). The unfinished one isn't included,
+        and ends where the last complete line does. A line still being written belongs
+        to no entry until its newline shows up.
+        """
+        entries = []
+        current = None
+        position = 0
+        end = data.rfind(b"\n") + 1
+
+        while position < end:
+            newline = data.index(b"\n", position)
+            line = data[position:newline]
+            match = TIMESTAMP.match(line)
+
+            if match or line.lstrip().startswith(b"runtime error") or current is None or position - current[1] >= MAX_ENTRY:
+                if current is not None:
+                    entries.append((current[0], base + current[1], position - current[1], current[2]))
+
+                if match:
+                    last = self.get_time(match, last)
+
+                current = (last or 0, position, get_severity(line))
+
+            position = newline + 1
+
+        if current is None:
+            return entries, base + end, None
+
+        # Nothing after the last entry yet, so it may still grow.
+        return entries, base + current[1], (current[0], current[2], base + end)
+
+    def update(self):
+        """Indexes whatever was appended since the last pass."""
+        st = os.stat(self.path)
+
+        if st.st_ino != self.inode or st.st_size < self.size:
+            self.inode = st.st_ino
+            self.reset()
+
+        if st.st_size == self.size:
+            return
+
+        # In chunks, so a big backlog is never read into memory whole. Each one starts over
+        # at the entry the last one left pending.
+        with open(self.path, "rb") as f:
+            size = READ_CHUNK
+
+            while True:
+                wanted = min(size, st.st_size - self.indexed)
+
+                f.seek(self.indexed)
+                data = f.read(wanted)
+
+                # Cut short means the log shrank under us. The next pass starts it over.
+                done = len(data) < wanted or self.indexed + len(data) >= st.st_size
+
+                entries, indexed, pending = self.parse(data, self.indexed, self.last_time)
+
+                # A line longer than the chunk. Read more of it next time around.
+                size = size * 2 if indexed == self.indexed and not done else READ_CHUNK
+
+                self.add_entries(entries, indexed, pending)
+
+                if done:
+                    break
+
+        with self.lock:
+            self.size = st.st_size
+
+    def add_entries(self, entries, indexed, pending):
+        if entries:
+            with open(self.index_path, "ab") as f:
+                f.write(b"".join(RECORD.pack(*entry) for entry in entries))
+
+        with self.lock:
+            if entries:
+                if self.first_time is None:
+                    self.first_time = entries[0][0]
+
+                self.last_time = entries[-1][0]
+                self.count += len(entries)
+
+            self.indexed = indexed
+            self.pending = pending
+
+    def find(self, index, count, since):
+        """The first record at or after since, by binary search over the mapped index."""
+        low, high = 0, count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if RECORD.unpack_from(index, HEADER.size + middle * RECORD.size)[0] < since:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def search(self, since, until, severities, pattern, limit):
+        """Returns (time, severity, offset, text) of matching entries, oldest first.
+
+        The entry still being written to isn't in the index yet, so it's read
+        from the tail of the log and stamped with the last time seen.
+        """
+        with self.lock:
+            count = self.count
+            indexed = self.indexed
+            last = self.last_time or 0
+            pending = self.pending
+
+            if (not count or last < since or self.first_time > until) and not (pending and since <= pending[0] <= until):
+                return []
+
+            results = []
+
+            with open(self.path, "rb") as log_file:
+                log = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+                try:
+                    if count and last >= since and self.first_time <= until:
+                        with open(self.index_path, "rb") as index_file:
+                            index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+                            try:
+                                for i in range(self.find(index, count, since), count):
+                                    if len(results) >= limit:
+                                        return results
+
+                                    stamp, offset, length, severity = RECORD.unpack_from(index, HEADER.size + i * RECORD.size)
+
+                                    if stamp > until:
+                                        return results
+
+                                    self.match(results, log, stamp, offset, length, severity, severities, pattern)
+                            finally:
+                                index.close()
+
+                    # The log may have been replaced under us since the last pass.
+                    if len(results) < limit and pending and since <= pending[0] <= until:
+                        self.match(results, log, pending[0], indexed, pending[2] - indexed, pending[1], severities, pattern)
+                finally:
+                    log.close()
+
+            return results
+
+    def match(self, results, log, stamp, offset, length, severity, severities, pattern):
+        if severities is not None and severity not in severities:
+            return
+
+        if offset + length > len(log):
+            return
+
+        text = log[offset:offset + length].decode("utf-8", "replace").rstrip()
+
+        if pattern and not pattern.search(text):
+            return
+
+        results.append((stamp, SEVERITIES[severity], offset, text))
+
+class LogIndex(threading.Thread):
+    """Keeps an index of every server's world and runtime logs, by time and severity.
+
+    Each log file gets an append-only index file of fixed size records in index-path.
+    Every pass only reads what was appended to a log since the last one. Searches
+    binary search the memory mapped index for the start time, and read the matching
+    entries straight out of the memory mapped log.
+    """
+    def __init__(self, _monitor, _logger, _config = None):
+        threading.Thread.__init__(self)
+
+        self.name = "LogIndex"
+        self.daemon = True
+
+        if not _monitor:
+            raise ValueError("LOGS: Wasn't handed a monitor object.")
+
+        # Monitor object to read the servers from.
+        self.monitor = _monitor
+
+        if not _logger:
+            raise ValueError("LOGS: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # Seconds between indexing passes.
+        self.interval = config.get("interval", 30)
+
+        # Where the index files go.
+        self.index_path = config.get("index-path", "log-index")
+
+        # Which files in a log directory are logs.
+        self.extensions = tuple(config.get("extensions", [".log", ".txt"]))
+
+        # Server name -> {path: LogFile}.
+        self.files = {}
+
+        # Log directory -> ({directory: mtime}, [log paths]), so it's only walked again once something in it changes.
+        self.listings = {}
+
+        # Server name -> lock, so a search and a pass never index the same server at once.
+        self.locks = {}
+
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            started = time.monotonic()
+
+            for server in list(self.monitor.servers):
+                try:
+                    self.index_server(server)
+                except Exception as e:
+                    self.logger.error("LOGS: Error while indexing {0}: {1}".format(server.name, e))
+
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def get_lock(self, name):
+        with self.lock:
+            return self.locks.setdefault(name, threading.Lock())
+
+    def index_server(self, server):
+        """Brings the server's indexes up to date. Returns its LogFiles."""
+        with self.get_lock(server.name):
+            root = server.get_log_path()
+            directory = os.path.join(self.index_path, server.name)
+
+            if not os.path.isdir(root):
+                return self.files.get(server.name, {})
+
+            first = server.name not in self.files
+            files = self.files.setdefault(server.name, {})
+
+            os.makedirs(directory, exist_ok=True)
+
+            paths = self.list_logs(root)
+
+            # Deleted or rotated away. Their indexes go with them.
+            for path in set(files) - set(paths):
+                self.remove_index(files.pop(path).index_path)
+
+            for path in paths:
+                try:
+                    log = files.get(path)
+
+                    if not log:
+                        relative = os.path.relpath(path, root)
+                        log = LogFile(path, relative, os.path.join(directory, self.get_index_name(relative)))
+                        log.open()
+                        files[path] = log
+
+                    log.update()
+                except OSError as e:
+                    self.logger.debug("LOGS: Unable to index {0}: {1}".format(path, e))
+
+            # Logs which went away while the monitor wasn't running left their indexes behind.
+            if first:
+                kept = set(self.get_index_name(os.path.relpath(path, root)) for path in paths)
+
+                for name in os.listdir(directory):
+                    if name.endswith(".idx") and name not in kept:
+                        self.remove_index(os.path.join(directory, name))
+
+            return files
+
+    def get_index_name(self, relative):
+        return hashlib.sha1(relative.encode("utf-8")).hexdigest()[:16] + ".idx"
+
+    def remove_index(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            self.logger.debug("LOGS: Unable to remove the index {0}: {1}".format(path, e))
+
+    def list_logs(self, root):
+        """The log files under root. Only walked again when a directory in it was modified."""
+        listing = self.listings.get(root)
+
+        if listing:
+            try:
+                if all(os.stat(path).st_mtime_ns == mtime for path, mtime in listing[0].items()):
+                    return listing[1]
+            except OSError:
+                pass
+
+        directories = {}
+        paths = []
+        waiting = [root]
+
+        while waiting:
+            parent = waiting.pop()
+
+            # Stat before listing, so anything added in between makes the next call walk again.
+            try:
+                mtime = os.stat(parent).st_mtime_ns
+                entries = list(os.scandir(parent))
+            except OSError:
+                continue
+
+            directories[parent] = mtime
+
+            for entry in entries:
+                if entry.is_dir():
+                    waiting.append(entry.path)
+                elif entry.name.endswith(self.extensions):
+                    paths.append(entry.path)
+
+        self.listings[root] = (directories, paths)
+
+        return paths
+
+    def search(self, server, since = None, until = None, severities = None, search = None, limit = 200):
+        """Returns the server's log entries between since and until, oldest first.
+
+        severities is a list of severity names, search an optional regex. Anything
+        appended since the last pass is indexed first, so results are always current.
+        """
+        pattern = re.compile(search) if search else None
+        since = float(since) if since is not None else 0
+        until = float(until) if until is not None else float("inf")
+
+        if severities is not None:
+            unknown = [severity for severity in severities if severity not in SEVERITIES]
+
+            if unknown:
+                raise ValueError("Unknown severities: {0}".format(", ".join(map(str, unknown))))
+
+            severities = set(SEVERITIES.index(severity) for severity in severities)
+
+        files = self.index_server(server)
+        results = []
+
+        for log in list(files.values()):
+            for stamp, severity, offset, text in log.search(since, until, severities, pattern, limit + 1):
+                results.append({"time": stamp, "severity": severity, "file": log.name, "offset": offset, "text": text})
+
+        results.sort(key=lambda entry: (entry["time"], entry["file"], entry["offset"]))
+
+        return {"entries": results[:limit], "more": len(results) > limit, "files": len(files)}
@@ -0,0 +1,172 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+
+def get_level(name, default = logging.DEBUG):
+    level = logging.getLevelName(str(name).upper())
+
+    return level if isinstance(level, int) else default
+
+def get_subsystem(message):
+    """Pulls the subsystem out of a message: "SERVER master: Started." is SERVER."""
+    head = message.split(":", 1)[0]
+    return head.split(" ", 1)[0]
+
+class SubsystemFilter(logging.Filter):
+    """Drops records below the level configured for their subsystem."""
+    def __init__(self, _levels, _default):
+        logging.Filter.__init__(self)
+        self.levels = _levels
+        self.default = _default
+
+    def filter(self, record):
+        return record.levelno >= self.levels.get(get_subsystem(str(record.msg)), self.default)
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most burst similar messages through per period seconds.
+
+    Messages count as similar once their numbers are blanked out, so "restarting in 5.2
+    seconds" and "restarting in 10.4 seconds" share a budget. The first message let
+    through after some were held back says how many were.
+    """
+    numbers = re.compile(r"\d+(\.\d+)?")
+
+    def __init__(self, _burst, _period):
+        logging.Filter.__init__(self)
+        self.burst = _burst
+        self.period = _period
+
+        # Key -> [window start, messages in window, messages suppressed].
+        self.windows = {}
+
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+
+        key = (record.levelno, self.numbers.sub("#", str(record.msg)))
+        now = time.monotonic()
+        window = self.windows.get(key)
+
+        if window is None or now - window[0] >= self.period:
+            suppressed = window[2] if window else 0
+
+            if len(self.windows) > 10000:
+                self.windows.clear()
+
+            self.windows[key] = [now, 1, 0]
+
+            if suppressed:
+                record.msg = "{0} ({1} similar messages suppressed)".format(record.msg, suppressed)
+
+            return True
+
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+
+        window[2] += 1
+        return False
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        message = record.getMessage()
+
+        return json.dumps({
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "subsystem": get_subsystem(message),
+            "thread": record.threadName,
+            "msg": message
+        }, separators=(',', ':'))
+
+class LogPipeline:
+    """Sets up the monitor's logger to hand records to a background writer thread.
+
+    Callers only pay for the per-subsystem level check and putting the record on a
+    queue. Rotation, formatting, rate limiting and the disk I/O itself all happen on
+    the writer thread. configure() can be called again at any time to apply new settings.
+    """
+    def __init__(self, _name = "monitor"):
+        self.logger = logging.getLogger(_name)
+
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.logger.addHandler(self.queue_handler)
+
+        # The writer thread.
+        self.listener = None
+        self.lock = threading.Lock()
+
+        atexit.register(self.stop)
+
+        self.configure(None)
+
+    def configure(self, _config):
+        config = _config or {}
+
+        default = get_level(config.get("level", "DEBUG"))
+        levels = {name: get_level(level, default) for name, level in (config.get("levels") or {}).items()}
+
+        subsystem_filter = SubsystemFilter(levels, default)
+
+        handler = self.create_handler(config)
+        handler.addFilter(RateLimitFilter(config.get("rate-limit-burst", 10), config.get("rate-limit-period", 60)))
+
+        if config.get("format", "text") == "json":
+            handler.setFormatter(JSONFormatter())
+        else:
+            handler.setFormatter(logging.Formatter("%(asctime)s:%(levelname)s: %(message)s"))
+
+        with self.lock:
+            # Nothing below the lowest configured level even gets queued.
+            self.logger.setLevel(min([default] + list(levels.values())))
+
+            for old_filter in list(self.logger.filters):
+                self.logger.removeFilter(old_filter)
+            self.logger.addFilter(subsystem_filter)
+
+            old = self.listener
+            self.listener = logging.handlers.QueueListener(self.queue, handler)
+
+            # The old writer drains what's already queued before the new one takes over.
+            if old:
+                old.stop()
+                for old_handler in old.handlers:
+                    old_handler.close()
+
+            self.listener.start()
+
+    def create_handler(self, config):
+        path = config.get("path", "monitor.log")
+
+        if config.get("rotate-when"):
+            return logging.handlers.TimedRotatingFileHandler(path, when=config["rotate-when"], backupCount=config.get("backups", 5), encoding="utf-8")
+
+        return logging.handlers.RotatingFileHandler(path, maxBytes=config.get("max-bytes", 10485760), backupCount=config.get("backups", 5), encoding="utf-8")
+
+    def stop(self):
+        with self.lock:
+            if self.listener:
+                self.listener.stop()
+                self.listener = None
@@ -0,0 +1,129 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import collections
+import os
+import re
+import threading
+
+class OutputBuffer:
+    """Keeps the tail end of a server's console output in memory.
+
+    The buffer is capped both by line count and by total size, the oldest lines
+    falling off first. If spill-path is set, every line is also appended to that
+    file, which is rotated once it grows past spill-size.
+    """
+    def __init__(self, _name, _config = None):
+        self.name = _name
+
+        config = _config or {}
+
+        # The caps.
+        self.max_lines = config.get("max-lines", 2000)
+        self.max_bytes = config.get("max-bytes", 1048576)
+
+        # The lines themselves, and how much space they take.
+        self.lines = collections.deque()
+        self.size = 0
+
+        # Lines seen since the monitor started, including the ones which fell off.
+        self.total = 0
+
+        # Half a line left over from the last read.
+        self.partial = b''
+
+        # Optional on-disk copy.
+        self.spill_path = config.get("spill-path")
+        self.spill_size = config.get("spill-size", 10485760)
+        self.spill_backups = config.get("spill-backups", 5)
+        self.spill_file = None
+
+        self.lock = threading.Lock()
+
+    def feed(self, data):
+        """Takes a chunk of raw output. Called from the supervisor thread."""
+        data = self.partial + data
+        *chunks, self.partial = data.split(b"\n")
+
+        # Don't let a process which never prints a newline eat all our memory.
+        if len(self.partial) > self.max_bytes:
+            chunks.append(self.partial)
+            self.partial = b''
+
+        if not chunks:
+            return
+
+        lines = [chunk.rstrip(b"\r").decode("utf-8", errors="replace") for chunk in chunks]
+
+        with self.lock:
+            for line in lines:
+                self.lines.append(line)
+                self.size += len(line)
+                self.total += 1
+
+            while self.lines and (len(self.lines) > self.max_lines or self.size > self.max_bytes):
+                self.size -= len(self.lines.popleft())
+
+        if self.spill_path:
+            self.spill(lines)
+
+    def flush(self):
+        """Pushes out whatever partial line is left. Called once the process closes its output."""
+        if self.partial:
+            self.feed(b"\n")
+
+    def spill(self, lines):
+        try:
+            if not self.spill_file:
+                self.spill_file = open(self.spill_path, "a", encoding="utf-8")
+
+            self.spill_file.write("\n".join(lines) + "\n")
+            self.spill_file.flush()
+
+            if self.spill_file.tell() >= self.spill_size:
+                self.rotate()
+        except OSError:
+            # Losing the disk copy is no reason to lose the in-memory one.
+            self.spill_path = None
+
+    def rotate(self):
+        self.spill_file.close()
+        self.spill_file = None
+
+        for i in range(self.spill_backups - 1, 0, -1):
+            source = "{0}.{1}".format(self.spill_path, i)
+            if os.path.exists(source):
+                os.replace(source, "{0}.{1}".format(self.spill_path, i + 1))
+
+        if self.spill_backups > 0:
+            os.replace(self.spill_path, self.spill_path + ".1")
+        else:
+            os.remove(self.spill_path)
+
+    def tail(self, count, search = None):
+        """Returns up to count of the newest lines, optionally only those matching the search regex."""
+        pattern = re.compile(search) if search else None
+
+        with self.lock:
+            lines = list(self.lines)
+
+        if pattern:
+            lines = [line for line in lines if pattern.search(line)]
+
+        if count <= 0:
+            return []
+
+        return lines[-count:]
@@ -0,0 +1,238 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import concurrent.futures
+import os
+import shutil
+import subprocess
+import threading
+
+# ionice scheduling classes, by name.
+IONICE_CLASSES = {"none": 0, "realtime": 1, "best-effort": 2, "idle": 3}
+
+class Placement:
+    """Decides which CPUs each DreamDaemon runs on, and applies that plus its priorities and limits.
+
+    A server's placement section can pin it to a list of CPUs, or ask for "auto".
+    Auto servers are spread over the physical cores nobody pinned, one core each
+    (with its hyperthread siblings) for as long as there are cores to go around.
+    Everything is applied right after DreamDaemon is launched, on a thread of its own
+    so the ionice call never holds up the supervisor, and failures are logged without
+    stopping the launch. CPUs, nice and ionice dropped from a running server's section
+    go back to what a fresh launch gets. Linux only; elsewhere nothing is applied.
+    """
+    def __init__(self, _logger, _config = None):
+        if not _logger:
+            raise ValueError("PLACEMENT: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # CPUs auto placement leaves alone, for the monitor and everything else on the box.
+        self.reserved = set(config.get("reserve-cpus") or [])
+
+        # A cgroup v2 directory the monitor may create children in. Each server gets one of its own.
+        self.cgroup_root = config.get("cgroup-root")
+
+        self.supported = hasattr(os, "sched_setaffinity")
+
+        # Server name -> auto assigned CPUs, and what was last applied to it.
+        self.assignments = {}
+        self.applied = {}
+
+        self.lock = threading.Lock()
+
+        # Applies placements in the order they were asked for.
+        self.worker = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="Placement")
+
+        if self.cgroup_root:
+            self.enable_controllers()
+
+    def enable_controllers(self):
+        try:
+            with open(os.path.join(self.cgroup_root, "cgroup.subtree_control"), "w") as f:
+                f.write("+cpu +memory")
+        except OSError as e:
+            self.logger.warning("PLACEMENT: Unable to enable the cpu and memory controllers under {0}: {1}".format(self.cgroup_root, e))
+
+    def get_cores(self):
+        """Returns the physical cores we may run on, each as the list of its CPUs."""
+        cpus = sorted(os.sched_getaffinity(0)) if self.supported else list(range(os.cpu_count() or 1))
+        cores = {}
+
+        for cpu in cpus:
+            try:
+                with open("/sys/devices/system/cpu/cpu{0}/topology/core_id".format(cpu)) as f:
+                    core = int(f.read())
+
+                with open("/sys/devices/system/cpu/cpu{0}/topology/physical_package_id".format(cpu)) as f:
+                    package = int(f.read())
+            except (OSError, ValueError):
+                # No topology to go on, so every CPU is a core of its own.
+                core, package = cpu, 0
+
+            cores.setdefault((package, core), []).append(cpu)
+
+        return [cores[key] for key in sorted(cores)]
+
+    def assign(self, servers):
+        """Works out the CPUs of every auto placed server. Ran again whenever the servers change."""
+        pinned = set()
+        auto = []
+
+        for server in servers:
+            cpus = server.placement.get("cpus")
+
+            if cpus == "auto":
+                auto.append(server.name)
+            elif isinstance(cpus, list):
+                pinned.update(cpus)
+
+        cores = [core for core in self.get_cores() if not set(core) & self.reserved]
+        free = [core for core in cores if not set(core) & pinned] or cores
+
+        assignments = {}
+
+        # Sorted, so a server keeps its core across restarts of the monitor.
+        for i, name in enumerate(sorted(auto)):
+            if free:
+                assignments[name] = free[i % len(free)]
+
+        if len(auto) > len(free):
+            self.logger.warning("PLACEMENT: {0} auto placed servers, but only {1} free cores. Some will share.".format(len(auto), len(free)))
+
+        with self.lock:
+            self.assignments = assignments
+
+    def get_cpus(self, server):
+        cpus = server.placement.get("cpus")
+
+        if cpus == "auto":
+            with self.lock:
+                return self.assignments.get(server.name)
+
+        return cpus
+
+    def apply(self, server, pid):
+        """Applies the server's placement to its process on the placement thread. Returns right away."""
+        future = self.worker.submit(self.apply_now, server, pid)
+        future.add_done_callback(lambda future: future.exception() and self.logger.error("PLACEMENT: Error applying the placement of {0} (PID {1}): {2}".format(server.name, pid, future.exception())))
+
+    def apply_now(self, server, pid):
+        placement = server.placement
+
+        with self.lock:
+            previous = self.applied.get(server.name)
+
+        # Only what was applied to this same process needs undoing.
+        if previous and previous["pid"] != pid:
+            previous = None
+
+        if not placement and not previous:
+            return
+
+        if not self.supported:
+            self.logger.debug("PLACEMENT: Not supported on this platform, {0} left as is.".format(server.name))
+            return
+
+        cpus = self.get_cpus(server)
+        result = {"pid": pid, "errors": []}
+
+        # (name, wanted, set it, put it back to what a fresh launch gets)
+        steps = [
+            ("cpus", cpus, lambda: os.sched_setaffinity(pid, cpus), lambda: os.sched_setaffinity(pid, os.sched_getaffinity(0))),
+            ("nice", placement.get("nice"), lambda: os.setpriority(os.PRIO_PROCESS, pid, placement["nice"]), lambda: os.setpriority(os.PRIO_PROCESS, pid, 0)),
+            ("ionice", placement.get("ionice-class"), lambda: self.set_ionice(pid, placement["ionice-class"], placement.get("ionice-level")), lambda: self.set_ionice(pid, "none", None)),
+            ("cgroup", placement.get("memory-max") or placement.get("cpu-limit"), lambda: self.set_cgroup(server.name, placement, pid), None)
+        ]
+
+        for name, wanted, step, reset in steps:
+            if wanted is None:
+                if not previous or name not in previous or not reset:
+                    continue
+
+                step = reset
+
+            try:
+                value = step()
+
+                if wanted is not None:
+                    result[name] = value or wanted
+            except (OSError, ValueError, RuntimeError, subprocess.SubprocessError) as e:
+                self.logger.warning("PLACEMENT: Unable to set {0} of {1} (PID {2}): {3}".format(name, server.name, pid, e))
+                result["errors"].append("{0}: {1}".format(name, e))
+
+        with self.lock:
+            self.applied[server.name] = result
+
+    def set_ionice(self, pid, ionice_class, level):
+        if ionice_class not in IONICE_CLASSES:
+            raise ValueError("Invalid ionice class {0}.".format(ionice_class))
+
+        # No wrapper for ioprio_set in the standard library, and the syscall number differs per architecture.
+        if not shutil.which("ionice"):
+            raise RuntimeError("ionice is not installed.")
+
+        args = ["ionice", "-c", str(IONICE_CLASSES[ionice_class]), "-p", str(pid)]
+        if level is not None and ionice_class not in ("none", "idle"):
+            args[3:3] = ["-n", str(int(level))]
+
+        subprocess.run(args, check=True, capture_output=True, timeout=5)
+
+        return {"class": ionice_class, "level": level}
+
+    def set_cgroup(self, name, placement, pid):
+        if not self.cgroup_root:
+            raise RuntimeError("No cgroup-root configured.")
+
+        path = os.path.join(self.cgroup_root, name)
+        os.makedirs(path, exist_ok=True)
+
+        limits = {}
+
+        if placement.get("memory-max"):
+            limits["memory.max"] = str(placement["memory-max"])
+
+        if placement.get("cpu-limit"):
+            # In cores. cpu.max wants a quota per period, both in microseconds.
+            limits["cpu.max"] = "{0} 100000".format(int(float(placement["cpu-limit"]) * 100000))
+
+        for key, value in limits.items():
+            with open(os.path.join(path, key), "w") as f:
+                f.write(value)
+
+        with open(os.path.join(path, "cgroup.procs"), "w") as f:
+            f.write(str(pid))
+
+        return dict(limits, path=path)
+
+    def get_status(self, servers):
+        """The placement of every server, for the API."""
+        with self.lock:
+            applied = dict(self.applied)
+
+        return {
+            "supported": self.supported,
+            "cores": self.get_cores(),
+            "reserved": sorted(self.reserved),
+            "servers": {server.name: {
+                "placement": server.placement,
+                "cpus": self.get_cpus(server),
+                "applied": applied.get(server.name)
+            } for server in servers}
+        }
@@ -0,0 +1,159 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import collections
+import sys
+import threading
+import time
+
+class Profiler:
+    """A sampling profiler which can be switched on and off while the monitor runs.
+
+    While running, a thread looks at the stack of every other thread each interval
+    seconds and counts where they are. Samples go by innermost frame (self time) and
+    by every function on the stack (total time). Nothing is instrumented, so the cost
+    is the sampling thread alone, and none at all while switched off.
+    """
+    def __init__(self, _logger, _config = None):
+        if not _logger:
+            raise ValueError("PROFILER: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # Seconds between samples.
+        self.interval = config.get("profile-interval", 0.005)
+
+        # Longest a profile may run for before it switches itself off, in seconds.
+        self.max_duration = config.get("profile-max-duration", 300)
+
+        self.thread = None
+        self.running = threading.Event()
+
+        self.reset()
+
+        self.lock = threading.Lock()
+
+    def reset(self):
+        self.samples = 0
+        self.own = collections.Counter()
+        self.total = collections.Counter()
+        self.threads = collections.Counter()
+        self.started_at = None
+        self.stopped_at = None
+
+    def start(self, duration = None):
+        """Starts sampling from scratch. Returns False if a profile is already running."""
+        with self.lock:
+            if self.running.is_set():
+                return False
+
+            self.reset()
+            self.started_at = time.time()
+
+            # A fresh event per profile, so a sampler that hasn't noticed the last stop yet stays stopped.
+            self.running = threading.Event()
+            self.running.set()
+
+            self.thread = threading.Thread(target=self.sample_forever, args=(min(duration or self.max_duration, self.max_duration), self.running), name="Profiler", daemon=True)
+            self.thread.start()
+
+        self.logger.warning("PROFILER: Sampling started.")
+        return True
+
+    def stop(self):
+        """Stops sampling. The samples stay around for get_report."""
+        with self.lock:
+            if not self.running.is_set():
+                return False
+
+            self.running.clear()
+            self.stopped_at = time.time()
+
+        self.logger.warning("PROFILER: Sampling stopped.")
+        return True
+
+    def sample_forever(self, duration, running):
+        me = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + duration
+
+        while running.is_set() and time.monotonic() < deadline:
+            frames = sys._current_frames()
+
+            with self.lock:
+                if not running.is_set():
+                    break
+
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+
+                    if ident not in names:
+                        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+                    self.record(names.get(ident, str(ident)), frame)
+
+                self.samples += 1
+
+            del frames
+            time.sleep(self.interval)
+
+        with self.lock:
+            # Ran out of time, rather than being stopped.
+            if running is self.running and running.is_set():
+                running.clear()
+                self.stopped_at = time.time()
+
+    def record(self, thread, frame):
+        self.threads[thread] += 1
+        self.own[self.get_location(frame)] += 1
+
+        # Recursion only counts once towards a function's total.
+        seen = set()
+        while frame is not None:
+            location = self.get_location(frame)
+
+            if location not in seen:
+                seen.add(location)
+                self.total[location] += 1
+
+            frame = frame.f_back
+
+    @staticmethod
+    def get_location(frame):
+        code = frame.f_code
+        return "{0}:{1}:{2}".format(code.co_filename, code.co_firstlineno, code.co_name)
+
+    def get_report(self, top = 20):
+        with self.lock:
+            return self.build_report(top)
+
+    def build_report(self, top):
+        running = self.running.is_set()
+        end = time.time() if running else self.stopped_at
+
+        return {
+            "running": running,
+            "samples": self.samples,
+            "interval": self.interval,
+            "duration": round(end - self.started_at, 1) if self.started_at and end else 0,
+            "threads": dict(self.threads),
+            "self": self.own.most_common(top),
+            "total": self.total.most_common(top)
+        }
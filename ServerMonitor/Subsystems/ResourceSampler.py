@@ -0,0 +1,254 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import array
+import os
+import threading
+import time
+
+# What every sample holds, in order.
+FIELDS = ("time", "cpu", "rss", "read_rate", "write_rate")
+
+def read_stat(pid):
+    """Returns the fields of /proc/<pid>/stat after the command name, or None if it can't be read.
+
+    Field 0 is the state, so field n is field n + 3 of proc(5).
+    """
+    try:
+        with open("/proc/{0}/stat".format(pid), "rb") as f:
+            # The command name may hold spaces, so split after its closing bracket.
+            return f.read().rsplit(b")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+class Ring:
+    """A fixed size ring of samples, stored flat in a single array of doubles."""
+    def __init__(self, _capacity):
+        self.capacity = _capacity
+        self.width = len(FIELDS)
+        self.values = array.array("d", bytes(8 * self.capacity * self.width))
+        self.head = 0
+        self.count = 0
+
+    def append(self, sample):
+        offset = self.head * self.width
+        self.values[offset:offset + self.width] = array.array("d", sample)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def since(self, start):
+        """Returns the samples taken at or after start, oldest first."""
+        samples = []
+
+        for i in range(self.count):
+            index = (self.head - 1 - i) % self.capacity
+            offset = index * self.width
+
+            if self.values[offset] < start:
+                break
+
+            samples.append(tuple(self.values[offset:offset + self.width]))
+
+        samples.reverse()
+        return samples
+
+class Tier:
+    """A ring fed with averages over period seconds."""
+    def __init__(self, _period, _capacity):
+        self.period = _period
+        self.ring = Ring(_capacity)
+        self.bucket = None
+        self.sums = [0.0] * len(FIELDS)
+        self.count = 0
+
+    def add(self, sample):
+        bucket = sample[0] - sample[0] % self.period
+
+        if self.bucket is not None and bucket != self.bucket and self.count:
+            averages = [total / self.count for total in self.sums]
+            averages[0] = self.bucket
+            self.ring.append(averages)
+            self.sums = [0.0] * len(FIELDS)
+            self.count = 0
+
+        self.bucket = bucket
+        self.count += 1
+        for i, value in enumerate(sample):
+            self.sums[i] += value
+
+class Series:
+    """Every tier of samples kept for one server."""
+    def __init__(self, _raw_capacity):
+        self.tiers = {
+            "raw": Tier(0, _raw_capacity),
+            "1m": Tier(60, 1440),
+            "10m": Tier(600, 1008),
+            "1h": Tier(3600, 720)
+        }
+
+    def add(self, sample):
+        self.tiers["raw"].ring.append(sample)
+
+        for name, tier in self.tiers.items():
+            if name != "raw":
+                tier.add(sample)
+
+class ResourceSampler(threading.Thread):
+    """Samples CPU, memory and disk use of every managed DreamDaemon from /proc.
+
+    Only works where /proc exists. Elsewhere the thread logs that once and quits.
+    """
+    def __init__(self, _monitor, _logger, _config = None):
+        threading.Thread.__init__(self)
+
+        self.name = "ResourceSampler"
+        self.daemon = True
+
+        if not _monitor:
+            raise ValueError("SAMPLER: Wasn't handed a monitor object.")
+
+        # Monitor object to read the servers from.
+        self.monitor = _monitor
+
+        if not _logger:
+            raise ValueError("SAMPLER: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # Seconds between samples.
+        self.interval = config.get("interval", 5)
+
+        # Raw samples kept per server. An hour's worth by default.
+        self.raw_capacity = config.get("raw-samples", int(3600 / self.interval))
+
+        # Server name -> Series.
+        self.series = {}
+
+        # PID -> (wall time, cpu ticks, read bytes, write bytes) from the previous pass.
+        self.previous = {}
+
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+        self.lock = threading.Lock()
+
+    def run(self):
+        if not os.path.isdir("/proc/self"):
+            self.logger.info("SAMPLER: No /proc on this platform. Resource sampling disabled.")
+            return
+
+        while True:
+            started = time.monotonic()
+
+            try:
+                self.sample_all()
+            except Exception as e:
+                self.logger.error("SAMPLER: Error while sampling: {0}".format(e))
+
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def sample_all(self):
+        now = time.time()
+        seen = set()
+
+        for server in list(self.monitor.servers):
+            thread = server.server_thread
+            process = thread.process if thread else None
+
+            if not process:
+                continue
+
+            sample = self.sample(process.pid, now)
+            seen.add(process.pid)
+
+            if not sample:
+                continue
+
+            with self.lock:
+                if server.name not in self.series:
+                    self.series[server.name] = Series(self.raw_capacity)
+
+                self.series[server.name].add(sample)
+
+        for pid in list(self.previous):
+            if pid not in seen:
+                del self.previous[pid]
+
+    def sample(self, pid, now):
+        fields = read_stat(pid)
+
+        if not fields:
+            return None
+
+        try:
+            ticks = int(fields[11]) + int(fields[12])
+            rss = int(fields[21]) * self.page_size
+        except (IndexError, ValueError):
+            return None
+
+        read_bytes, write_bytes = self.read_io(pid)
+
+        previous = self.previous.get(pid)
+        self.previous[pid] = (now, ticks, read_bytes, write_bytes)
+
+        if not previous:
+            return None
+
+        elapsed = now - previous[0]
+        if elapsed <= 0:
+            return None
+
+        cpu = (ticks - previous[1]) / self.ticks / elapsed * 100
+
+        return (now, cpu, rss, max(0, read_bytes - previous[2]) / elapsed, max(0, write_bytes - previous[3]) / elapsed)
+
+    def read_io(self, pid):
+        read_bytes = write_bytes = 0
+
+        try:
+            with open("/proc/{0}/io".format(pid), "rb") as f:
+                for line in f:
+                    if line.startswith(b"read_bytes:"):
+                        read_bytes = int(line.split()[1])
+                    elif line.startswith(b"write_bytes:"):
+                        write_bytes = int(line.split()[1])
+        except (OSError, ValueError):
+            # Not ours to read, or the process is gone.
+            pass
+
+        return read_bytes, write_bytes
+
+    def get_metrics(self, name, tier = "raw", window = 300):
+        """Returns the samples of the last window seconds from tier, plus min/avg/max of each field."""
+        with self.lock:
+            series = self.series.get(name)
+
+            if not series or tier not in series.tiers:
+                return None
+
+            samples = series.tiers[tier].ring.since(time.time() - window)
+
+        aggregate = {}
+        for i, field in enumerate(FIELDS[1:], 1):
+            values = [sample[i] for sample in samples]
+
+            if values:
+                aggregate[field] = {"min": min(values), "avg": sum(values) / len(values), "max": max(values)}
+
+        return {"fields": FIELDS, "samples": samples, "aggregate": aggregate}
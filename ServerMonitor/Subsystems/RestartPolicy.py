@@ -0,0 +1,113 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import collections
+import random
+import threading
+import time
+
+class RestartPolicy:
+    """Decides how long to wait before bringing a closed DreamDaemon back up.
+
+    A clean exit (return code 0 after at least min-uptime seconds) restarts straight away.
+    Anything else counts as a crash and backs off exponentially, with jitter. Once
+    max-crashes crashes land inside crash-window seconds the server is parked and stays
+    down until someone starts it again by hand.
+    """
+    def __init__(self, _name, _config = None):
+        self.name = _name
+
+        # The last few exits, newest last.
+        self.history = collections.deque(maxlen = 20)
+
+        self.configure(_config)
+
+        # Crashes since the last clean run.
+        self.consecutive_crashes = 0
+
+        # Set when the circuit breaker tripped.
+        self.parked = False
+
+        # Wall clock time of the next scheduled restart, if any.
+        self.next_restart = None
+
+        self.lock = threading.Lock()
+
+    def configure(self, _config):
+        """Applies tunables from config. Can be called again on a live policy; the history is kept."""
+        config = _config or {}
+
+        # Exits sooner than this after starting count as crashes, whatever the return code.
+        self.min_uptime = config.get("min-uptime", 60)
+
+        # Backoff delays, in seconds.
+        self.backoff_base = config.get("backoff-base", 5)
+        self.backoff_max = config.get("backoff-max", 300)
+
+        # Fraction of the delay to randomly add or take away.
+        self.jitter = config.get("jitter", 0.2)
+
+        # The circuit breaker.
+        self.max_crashes = config.get("max-crashes", 5)
+        self.crash_window = config.get("crash-window", 600)
+
+        if config.get("history", 20) != self.history.maxlen:
+            self.history = collections.deque(self.history, maxlen = config.get("history", 20))
+
+    def record_exit(self, returncode, uptime):
+        """Records an exit and returns the delay before the next start, or None if the server is now parked."""
+        now = time.time()
+        crashed = returncode != 0 or uptime < self.min_uptime
+
+        with self.lock:
+            if crashed:
+                self.consecutive_crashes += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (self.consecutive_crashes - 1))
+                delay *= 1 + random.uniform(-self.jitter, self.jitter)
+            else:
+                self.consecutive_crashes = 0
+                delay = 0
+
+            recent = sum(1 for entry in self.history if entry["crash"] and now - entry["time"] <= self.crash_window)
+
+            if crashed and recent + 1 >= self.max_crashes:
+                self.parked = True
+                delay = None
+
+            self.history.append({"time": now, "returncode": returncode, "uptime": round(uptime, 1), "crash": crashed, "delay": None if delay is None else round(delay, 1)})
+            self.next_restart = None if delay is None else now + delay
+
+            return delay
+
+    def clear_schedule(self):
+        with self.lock:
+            self.next_restart = None
+
+    def reset(self):
+        """Closes the circuit breaker again. Called on a manual start."""
+        with self.lock:
+            self.parked = False
+            self.consecutive_crashes = 0
+            self.next_restart = None
+
+    def get_state(self):
+        with self.lock:
+            return {
+                "parked": self.parked,
+                "consecutive_crashes": self.consecutive_crashes,
+                "next_restart": self.next_restart,
+                "history": list(self.history)
+            }
@@ -14,14 +14,46 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see http://www.gnu.org/licenses/.
 
+import os
+import shutil
+import socket
 import threading
 import subprocess
 import time
 
-class Server(threading.Thread):
-    def __init__(self, _data, _logger):
-        threading.Thread.__init__(self)
+# Lifecycle states.
+STATE_STOPPED = "stopped"
+STATE_STARTING = "starting"
+STATE_RUNNING = "running"
+STATE_STOPPING = "stopping"
+STATE_BACKOFF = "backoff"
+STATE_FAILED = "failed"
 
+class Server:
+    """Runs a single DreamDaemon and keeps it up.
+
+    The lifecycle is a state machine:
+
+        stopped -> starting -> running -> stopping -> stopped
+                       \          \
+                        +----------+-> backoff -> starting    (closed on its own)
+                                    \-> failed                (crash looping, parked)
+
+    Transitions happen under the lock, on the caller's thread or the supervisor's, and
+    none of them wait on DreamDaemon. Stopping sends SIGTERM, and SIGKILL if DreamDaemon
+    is still around stop_grace seconds later. target is the state the server is headed
+    for: running while it should be kept up, stopped otherwise.
+    """
+    # Seconds a standby instance gets to start accepting connections during a hot swap.
+    swap_timeout = 300
+
+    # Seconds DreamDaemon gets to close after SIGTERM, before it is killed.
+    stop_grace = 30
+
+    # Seconds between checks of whether a starting DreamDaemon has opened its port yet.
+    boot_check_interval = 1
+
+    def __init__(self, _data, _logger, _supervisor, _events = None, _placement = None):
         if not _data:
             raise ValueError("SERVER NULL: Wasn't handed a server data object.")
 
@@ -37,59 +69,409 @@ class Server(threading.Thread):
 
         self.logger = _logger
 
+        # The supervisor watching our process.
+        if not _supervisor:
+            raise ValueError("SERVER {0}: Wasn't handed a supervisor.".format(self.name))
+
+        self.supervisor = _supervisor
+
+        # The event bus lifecycle changes are published on.
+        self.events = _events
+
+        # Applies CPU affinity, priorities and limits to every process we launch.
+        self.placement = _placement
+
         # The process object.
         self.process = None
 
-        # The running indicator
-        self.running = False
+        # Where the lifecycle is at, and where it's headed.
+        self.state = STATE_STOPPED
+        self.target = STATE_STOPPED
+
+        # The standby process of a hot swap in progress.
+        self.standby = None
+
+        # The pending restart, if DreamDaemon closed and we're waiting to bring it back.
+        self.restart_timer = None
+
+        # When the current process was started, for telling crashes from clean exits.
+        self.started_at = None
 
-    def run(self):
-        """A blocking process which will start and run a server until it's terminated."""
-        if self.process is None:
-            self.running = True
+        # Guards the state and the processes, which both the API and the supervisor touch.
+        self.lock = threading.RLock()
 
-            while (self.running):
-                self.logger.info("SERVER {0}: Started.".format(self.name))
+        # Set whenever no DreamDaemon process is alive.
+        self.stopped = threading.Event()
+        self.stopped.set()
 
-                # This blocks.
+    @property
+    def running(self):
+        """True while the server is meant to be kept up, whatever state it's in right now."""
+        return self.target == STATE_RUNNING
+
+    def start(self):
+        """Starts the server and keeps it up until stop_server is called. Returns the state it's headed for."""
+        with self.lock:
+            if self.running:
+                raise RuntimeError("SERVER {0}: Attempted to run a second time while already running.".format(self.name))
+
+            self.target = STATE_RUNNING
+            self.cancel_restart()
+
+            # Still closing down. on_exit brings it back up once it's gone.
+            if self.state != STATE_STOPPING:
                 self.start_server()
-                self.logger.warning("SERVER {0}: DreamDaemon closed. Waiting.".format(self.name))
-                time.sleep(30)
 
-        else:
-            raise RuntimeError("SERVER {0}: Attempted to run a second time while already running.".format(self.name))
+            return self.target
+
+    def publish(self, topic, **data):
+        if self.events:
+            self.events.publish(topic, self.name, **data)
+
+    def spawn(self, dmb_path, port):
+        """Launches DreamDaemon and hands the process to the supervisor."""
+        args = [self.data.get_dd_path(), dmb_path, '-port {0}'.format(port), '-trusted', self.data.visibility, '-close']
+
+        # In a session of its own, and left ignoring SIGPIPE, so DreamDaemon outlives the monitor
+        # and can be reattached to. Both are POSIX only, and ignored elsewhere.
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True, restore_signals=False)
+
+        self.supervisor.watch(process, lambda returncode: self.on_exit(process, returncode))
+        self.supervisor.watch_output(process.stdout, self.on_output)
+
+        if self.placement:
+            self.placement.apply(self.data, process.pid)
+
+        return process
 
     def start_server(self):
-        """Starts a new DreamDaemon process and launches a server with it."""
-        args = [self.data.get_dd_path(), self.data.get_dmb_path(), '-port {0}'.format(self.data.port), '-trusted', self.data.visibility, '-close']
+        """Starts a new DreamDaemon process and hands it to the supervisor."""
+        with self.lock:
+            self.restart_timer = None
+
+            if not self.running or self.process:
+                return
+
+            try:
+                self.process = self.spawn(self.data.get_live_dmb_path(), self.data.active_port)
+            except Exception as e:
+                self.target = STATE_STOPPED
+                self.state = STATE_FAILED
+                raise RuntimeError("SERVER {0}: Runtimed while attempting to start: {1}".format(self.name, e))
+
+            self.state = STATE_STARTING
+            self.started_at = time.monotonic()
+            self.data.restart_policy.clear_schedule()
+            self.stopped.clear()
+
+            process = self.process
+
+        self.logger.info("SERVER {0}: Started.".format(self.name))
+        self.publish("started", port=self.data.active_port)
+
+        self.supervisor.call_later(self.boot_check_interval, lambda: self.check_boot(process))
+
+    def adopt(self, process, started, port, slot):
+        """Takes over a DreamDaemon left running by an earlier monitor.
+
+        started is the wall clock time it was launched at. Its output can't be read.
+        """
+        with self.lock:
+            if self.running or self.process:
+                raise RuntimeError("SERVER {0}: Attempted to adopt a process while already running.".format(self.name))
+
+            self.process = process
+            self.target = STATE_RUNNING
+            self.state = STATE_STARTING
+            self.started_at = time.monotonic() - max(0, time.time() - started)
+            self.stopped.clear()
+
+            self.data.active_port = port
+            self.data.live_slot = slot
+
+        self.supervisor.watch(process, lambda returncode: self.on_exit(process, returncode))
+
+        # The placement may have changed while nobody was watching.
+        if self.placement:
+            self.placement.apply(self.data, process.pid)
+
+        self.logger.info("SERVER {0}: Reattached to DreamDaemon (PID {1}) on port {2}.".format(self.name, process.pid, port))
+        self.publish("adopted", pid=process.pid, port=port)
+
+        # Most likely already up, so have a look straight away.
+        self.supervisor.call_soon(lambda: self.check_boot(process))
+
+    def check_boot(self, process):
+        """Moves a starting server to running once its port answers. Ran on the supervisor thread."""
+        with self.lock:
+            if process is not self.process or self.state != STATE_STARTING:
+                return
+
+            port = self.data.active_port
+
+        # Keep it short, this holds up the supervisor.
+        if not self.is_listening(port, 0.1):
+            self.supervisor.call_later(self.boot_check_interval, lambda: self.check_boot(process))
+            return
+
+        with self.lock:
+            if process is not self.process or self.state != STATE_STARTING:
+                return
+
+            self.state = STATE_RUNNING
+
+        self.logger.info("SERVER {0}: Up after {1:.1f} seconds.".format(self.name, time.monotonic() - self.started_at))
+        self.publish("running", port=port)
+
+    def on_output(self, data):
+        """Called by the supervisor with every chunk DreamDaemon prints."""
+        if data:
+            self.data.output.feed(data)
+        else:
+            self.data.output.flush()
+
+    def on_exit(self, process, returncode):
+        """Called by the supervisor once a DreamDaemon has closed."""
+        with self.lock:
+            if process is self.standby:
+                self.standby = None
+                self.logger.warning("SERVER {0}: Standby DreamDaemon stopped with code {1}.".format(self.name, returncode))
+                self.publish("standby_stopped", returncode=returncode)
+                return
+
+            # A process retired by a hot swap.
+            if process is not self.process:
+                self.logger.info("SERVER {0}: Retired DreamDaemon stopped with code {1}.".format(self.name, returncode))
+                return
+
+            self.process = None
+            self.stopped.set()
+
+            expected = self.state == STATE_STOPPING
+            delay = None
+
+            if expected:
+                self.state = STATE_STOPPED
+            elif self.running:
+                delay = self.schedule_restart(returncode)
+
+            parked = self.state == STATE_FAILED
 
+        self.logger.info("SERVER {0}: Dreamdaemon stopped with code {1}.".format(self.name, returncode))
+        self.publish("stopped", returncode=returncode, expected=expected)
+
+        if expected:
+            # Stopped for a restart, or started again while it was on its way down.
+            if self.running:
+                self.start_fresh()
+
+            return
+
+        if returncode != 0:
+            self.publish("crashed", returncode=returncode)
+
+        if parked:
+            self.logger.error("SERVER {0}: DreamDaemon is crash looping. Parked until started by hand.".format(self.name))
+            self.publish("parked")
+        elif delay is not None:
+            self.logger.warning("SERVER {0}: DreamDaemon closed. Restarting in {1:.1f} seconds.".format(self.name, delay))
+            self.publish("restart_scheduled", delay=round(delay, 1))
+
+    def schedule_restart(self, returncode):
+        """Moves to backoff with a restart timer, or to failed if the restart policy gave up. Called with the lock held."""
+        delay = self.data.restart_policy.record_exit(returncode, time.monotonic() - self.started_at)
+
+        if delay is None:
+            self.target = STATE_STOPPED
+            self.state = STATE_FAILED
+        else:
+            self.state = STATE_BACKOFF
+            self.restart_timer = self.supervisor.call_later(delay, self.start_server)
+
+        return delay
+
+    def cancel_restart(self):
+        with self.lock:
+            if self.restart_timer:
+                self.restart_timer.cancel()
+                self.restart_timer = None
+                self.data.restart_policy.clear_schedule()
+
+    def start_fresh(self):
+        """Starts DreamDaemon from the published build on the main port."""
+        with self.lock:
+            self.data.live_slot = None
+            self.data.active_port = self.data.port
+
+        try:
+            self.start_server()
+        except RuntimeError as e:
+            self.logger.error(str(e))
+
+    def terminate(self, process):
+        """Sends process SIGTERM, and SIGKILL if it's still around stop_grace seconds later."""
         try:
-            self.process = subprocess.Popen(args, stdout=subprocess.PIPE)
-        except Exception as e:
-            raise RuntimeError("SERVER {0}: Runtimed while attempting to start: {1}".format(self.name, e))
+            process.terminate()
+        except OSError:
+            # Already gone.
+            return
 
-        self.process.wait()
+        self.supervisor.call_later(self.stop_grace, lambda: self.escalate(process))
 
-        self.logger.info("SERVER {0}: Dreamdaemon stopped.".format(self.name))
+    def escalate(self, process):
+        if process.poll() is not None:
+            return
+
+        self.logger.error("SERVER {0}: DreamDaemon (PID {1}) ignored SIGTERM for {2} seconds. Killing it.".format(self.name, process.pid, self.stop_grace))
+
+        try:
+            process.kill()
+        except OSError:
+            return
+
+        self.publish("killed", pid=process.pid)
 
     def force_restart(self):
         """Forcefully restarts the server, by killing DreamDaemon and allowing it to restart."""
-        if self.running and self.process:
-            self.logger.warning("SERVER {0}: Force restart initiated.".format(self.name))
+        with self.lock:
+            if self.running and self.process and self.state in (STATE_STARTING, STATE_RUNNING):
+                self.logger.warning("SERVER {0}: Force restart initiated.".format(self.name))
 
-            self.process.terminate()
+                self.terminate(self.process)
+                self.publish("force_restart")
 
     def stop_server(self):
-        """Shuts down the server completely. You should wait a little after calling this, before proceeding with new commands."""
-        if self.running:
-            self.running = False
+        """Asks DreamDaemon to close, and returns the state the server is headed for without waiting for it.
 
-            # Stop the server.
-            self.process.terminate()
+        Wait on stopped to know when it's actually gone.
+        """
+        with self.lock:
+            if self.state == STATE_STOPPED or (self.state == STATE_STOPPING and not self.running):
+                raise RuntimeError("SERVER {0}: Attempted to shut down, but was found not running.".format(self.name))
 
-            self.logger.warning("SERVER {0}: Force shut down initiated.".format(self.name))
+            self.target = STATE_STOPPED
+            self.cancel_restart()
 
-            # RIP the thread at the end.
-            self.join()
-        else:
-            raise RuntimeError("SERVER {0}: Attempted to shut down, but was found not running.".format(self.name))
\ No newline at end of file
+            if self.standby:
+                self.terminate(self.standby)
+
+            if not self.process:
+                self.state = STATE_STOPPED
+            elif self.state != STATE_STOPPING:
+                self.state = STATE_STOPPING
+                self.terminate(self.process)
+
+        self.logger.warning("SERVER {0}: Force shut down initiated.".format(self.name))
+        self.publish("stopping")
+
+        return self.target
+
+    def restart(self):
+        """Stops DreamDaemon and starts it again from the published build on the main port.
+
+        Returns the state the server is headed for without waiting for any of it.
+        """
+        with self.lock:
+            self.target = STATE_RUNNING
+            self.cancel_restart()
+
+            # Already on its way down. on_exit brings it back up.
+            if self.state == STATE_STOPPING:
+                return self.target
+
+            if self.standby:
+                self.terminate(self.standby)
+
+            if self.process:
+                self.state = STATE_STOPPING
+                self.terminate(self.process)
+            else:
+                self.start_fresh()
+                return self.target
+
+        self.logger.warning("SERVER {0}: Restart initiated.".format(self.name))
+        self.publish("stopping")
+
+        return self.target
+
+    def hot_swap(self):
+        """Brings the published build up on the standby port, then retires the live process.
+
+        The build is copied into the idle slot first, a .dmb and .rsc pair under another name
+        in the game path, so the live DreamDaemon keeps its own files and the standby runs
+        beside the same config and data. Blocks until the swap is done or has failed; run it
+        off of the API thread.
+        """
+        if not self.data.standby_port:
+            raise RuntimeError("SERVER {0}: No standby port configured, hot swap impossible.".format(self.name))
+
+        with self.lock:
+            if not self.running or not self.process or self.state not in (STATE_STARTING, STATE_RUNNING):
+                raise RuntimeError("SERVER {0}: Hot swap requested, but the server is not up.".format(self.name))
+
+            if self.standby:
+                raise RuntimeError("SERVER {0}: A hot swap is already in progress.".format(self.name))
+
+        slot = "b" if self.data.live_slot == "a" else "a"
+        port = self.data.get_standby_port()
+
+        self.stage(slot)
+
+        with self.lock:
+            self.standby = self.spawn(self.data.get_slot_dmb_path(slot), port)
+            standby = self.standby
+
+        self.logger.info("SERVER {0}: Standby started on port {1} from slot {2}.".format(self.name, port, slot))
+        self.publish("standby_started", port=port, slot=slot)
+
+        started = time.monotonic()
+        while not self.is_listening(port):
+            if self.standby is not standby or time.monotonic() - started > self.swap_timeout:
+                with self.lock:
+                    if self.standby is standby:
+                        self.standby = None
+                        self.terminate(standby)
+
+                self.publish("swap_failed", port=port)
+                raise RuntimeError("SERVER {0}: Standby never came up. Live server left alone.".format(self.name))
+
+            time.sleep(1)
+
+        # Flip over. The old process exits as a retired one and won't trigger a restart.
+        with self.lock:
+            if self.standby is not standby or not self.running:
+                raise RuntimeError("SERVER {0}: Hot swap aborted.".format(self.name))
+
+            old = self.process
+            self.process = standby
+            self.standby = None
+            self.started_at = time.monotonic()
+            self.state = STATE_RUNNING
+
+            self.data.active_port = port
+            self.data.live_slot = slot
+
+            if old:
+                self.terminate(old)
+
+        self.logger.warning("SERVER {0}: Hot swapped to port {1} after {2:.1f} seconds.".format(self.name, port, time.monotonic() - started))
+        self.publish("swapped", port=port, slot=slot)
+
+        return port
+
+    def stage(self, slot):
+        """Copies the published build into a slot, next to it in the game path."""
+        for source, target in ((self.data.get_dmb_path(), self.data.get_slot_dmb_path(slot)), (self.data.get_rsc_path(), self.data.get_slot_rsc_path(slot))):
+            if not os.path.isfile(source):
+                continue
+
+            shutil.copy2(source, target + ".tmp")
+            os.replace(target + ".tmp", target)
+
+    def is_listening(self, port, timeout = 1):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=timeout).close()
+        except OSError:
+            return False
+
+        return True
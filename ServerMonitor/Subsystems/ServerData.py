@@ -16,8 +16,11 @@
 
 import os.path
 
+from ServerMonitor.Subsystems.OutputBuffer import OutputBuffer
+from ServerMonitor.Subsystems.RestartPolicy import RestartPolicy
+
 class ServerData():
-    def __init__(self, _name, _game_path, _git_path, _byond_path, _port, _visibility, _start, _auths):
+    def __init__(self, _name, _game_path, _git_path, _byond_path, _port, _visibility, _start, _auths, _restart = None, _output = None, _git_branch = None, _standby_port = None, _placement = None, _log_path = None):
 
         # The unique name for the server. For ID purposes.
         if not _name:
@@ -30,13 +33,16 @@ class ServerData():
         self.game_path = _game_path
 
         # See if we're ready to boot up immediately.
-        self.server_ready = os.path.isfile(self.game_path + "\\baystation12.dmb")
+        self.server_ready = os.path.isfile(self.get_dmb_path())
 
         # The path for the project root.
         if not _git_path:
             raise ValueError("SERVER {0}: No git path provided.".format(self.name))
         self.git_path = _git_path
 
+        # The branch the updater checks out. None for the updater's default.
+        self.git_branch = _git_branch
+
         # Check if we have the code already downloaded.
         self.compile_ready = os.path.isfile(self.git_path + "\\baystation12.dme")
 
@@ -50,6 +56,15 @@ class ServerData():
             raise ValueError("SERVER {0}: No port provided.".format(self.name))
         self.port = _port
 
+        # The alternate port a hot swap brings the new round up on.
+        self.standby_port = _standby_port
+
+        # The port the live instance is on right now. Flips between the two on every hot swap.
+        self.active_port = _port
+
+        # The slot directory the live instance runs from, or None for the game path itself.
+        self.live_slot = None
+
         # Server visibility.
         if _visibility not in ["-public", "-invisible", "-private"]:
             raise ValueError("SERVER {0}: Invalid visibility variable provided.".format(self.name))
@@ -73,14 +88,61 @@ class ServerData():
         if _auths:
             self.auths = _auths
 
+        # Decides when a closed server gets started again.
+        self.restart_policy = RestartPolicy(self.name, _restart)
+
+        # The recent console output of DreamDaemon. Outlives any single process.
+        self.output = OutputBuffer(self.name, _output)
+
+        # CPUs, priorities and limits DreamDaemon is launched with.
+        self.placement = _placement or {}
+
+        # Where the world writes its logs. None for the data\\logs directory of the game path.
+        self.log_path = _log_path
+
     def get_dd_path(self):
         return self.byond_path + "\\dreamdaemon.exe"
 
     def get_dm_path(self):
         return self.byond_path + "\\dreammaker.exe"
 
+    def get_log_path(self):
+        if self.log_path:
+            return self.log_path
+
+        return self.game_path + "\\data\\logs"
+
     def get_dme_path(self):
         return self.git_path + "\\baystation12.dme"
 
     def get_dmb_path(self):
-        return self.game_path + "\\baystation12.dmb"
\ No newline at end of file
+        return self.game_path + "\\baystation12.dmb"
+
+    def get_rsc_path(self):
+        return self.game_path + "\\baystation12.rsc"
+
+    def get_live_dmb_path(self):
+        if self.live_slot:
+            return self.get_slot_dmb_path(self.live_slot)
+
+        return self.get_dmb_path()
+
+    # Slots sit in the game path itself, so a standby shares the live server's config and data.
+    # DreamDaemon loads the .rsc named after the .dmb it's given.
+    def get_slot_dmb_path(self, slot):
+        return self.game_path + "\\baystation12-slot-" + slot + ".dmb"
+
+    def get_slot_rsc_path(self, slot):
+        return self.game_path + "\\baystation12-slot-" + slot + ".rsc"
+
+    def get_standby_port(self):
+        if self.active_port == self.port:
+            return self.standby_port
+
+        return self.port
+
+    def get_build_dmb_path(self):
+        return self.git_path + "\\baystation12.dmb"
+
+    def get_build_rsc_path(self):
+        return self.git_path + "\\baystation12.rsc"
@@ -0,0 +1,190 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import json
+import os
+import signal
+import threading
+import time
+
+from ServerMonitor.Subsystems.ResourceSampler import read_stat
+
+def get_identity(pid):
+    """Returns (start time, cmdline) of a live process from /proc, or None if it's gone or unreadable.
+
+    The start time is in clock ticks since boot, so together with the PID it names one
+    process for good, even after the PID is reused.
+    """
+    fields = read_stat(pid)
+
+    # Gone, or exited and just not reaped yet.
+    if not fields or fields[0] in (b"Z", b"X"):
+        return None
+
+    try:
+        with open("/proc/{0}/cmdline".format(pid), "rb") as f:
+            cmdline = [arg.decode("utf-8", "replace") for arg in f.read().split(b"\0") if arg]
+
+        return int(fields[19]), cmdline
+    except (OSError, IndexError, ValueError):
+        return None
+
+class AdoptedProcess:
+    """Stands in for the Popen object of a DreamDaemon started by an earlier monitor.
+
+    It isn't our child, so its output can't be read and its exit code is never known.
+    Exits are reported with code 0, which leaves it to the uptime to tell a crash.
+    """
+    def __init__(self, _pid, _identity):
+        self.pid = _pid
+        self.identity = _identity
+        self.returncode = None
+        self.stdout = None
+
+    def poll(self):
+        if self.returncode is None and get_identity(self.pid) != self.identity:
+            self.returncode = 0
+
+        return self.returncode
+
+    def send_signal(self, sig):
+        # Checked first, so a reused PID never gets the signal.
+        if self.poll() is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+class StateJournal(threading.Thread):
+    """Keeps a small file recording every managed DreamDaemon, so a new monitor can take them over.
+
+    The file is rewritten whole on every lifecycle event, by writing a temporary file
+    and renaming it over the old one, so it is never seen half written. Bursts of
+    events are written once.
+    """
+    def __init__(self, _monitor, _logger, _config = None):
+        threading.Thread.__init__(self)
+
+        self.name = "StateJournal"
+        self.daemon = True
+
+        if not _monitor:
+            raise ValueError("JOURNAL: Wasn't handed a monitor object.")
+
+        # Monitor object to read the servers from.
+        self.monitor = _monitor
+
+        if not _logger:
+            raise ValueError("JOURNAL: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        self.path = config.get("path", "monitor-state.json")
+
+        # Reattaching needs /proc to tell a process apart from whatever reused its PID.
+        self.can_reattach = config.get("reattach", True) and os.path.isdir("/proc/self")
+
+        # Set when the servers changed and the file is behind.
+        self.dirty = threading.Event()
+
+    def load(self):
+        """Returns the server entries the last monitor left, by name."""
+        try:
+            with open(self.path, "r") as f:
+                journal = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self.logger.error("JOURNAL: Unable to read {0}, not reattaching anything: {1}".format(self.path, e))
+            return {}
+
+        if not isinstance(journal, dict) or journal.get("version") != 1:
+            self.logger.error("JOURNAL: {0} is not a journal we understand, not reattaching anything.".format(self.path))
+            return {}
+
+        return journal.get("servers") or {}
+
+    def find_process(self, entry):
+        """Returns an AdoptedProcess for the entry's DreamDaemon, if that exact process is still alive."""
+        if not self.can_reattach or not entry.get("pid"):
+            return None
+
+        identity = get_identity(entry["pid"])
+
+        if identity is None or [identity[0], identity[1]] != [entry.get("start_time"), entry.get("cmdline")]:
+            return None
+
+        return AdoptedProcess(entry["pid"], identity)
+
+    def on_event(self, event):
+        if event["server"]:
+            self.dirty.set()
+
+    def run(self):
+        while True:
+            self.dirty.wait()
+            self.dirty.clear()
+
+            try:
+                self.write()
+            except Exception as e:
+                self.logger.error("JOURNAL: Unable to write {0}: {1}".format(self.path, e))
+
+            # Let a burst of events finish before writing again.
+            time.sleep(0.1)
+
+    def build(self):
+        servers = {}
+
+        for server in list(self.monitor.servers):
+            thread = server.server_thread
+
+            if not thread:
+                continue
+
+            entry = {"state": thread.state, "target": thread.target}
+            process = thread.process
+
+            if process and process.poll() is None:
+                identity = process.identity if isinstance(process, AdoptedProcess) else get_identity(process.pid)
+
+                entry["pid"] = process.pid
+                entry["port"] = server.active_port
+                entry["slot"] = server.live_slot
+                entry["started"] = round(time.time() - (time.monotonic() - thread.started_at), 3)
+
+                if identity:
+                    entry["start_time"], entry["cmdline"] = identity
+
+            servers[server.name] = entry
+
+        return {"version": 1, "written": round(time.time(), 3), "monitor_pid": os.getpid(), "servers": servers}
+
+    def write(self):
+        data = json.dumps(self.build(), separators=(',', ':'))
+
+        with open(self.path + ".tmp", "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(self.path + ".tmp", self.path)
@@ -0,0 +1,318 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import bisect
+import contextlib
+import http.server
+import threading
+import time
+
+# Histogram bucket upper bounds, in seconds. Anything slower lands in the overflow bucket.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class Shard:
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+class Histogram:
+    """A fixed bucket histogram which records without locking.
+
+    Every thread records into a shard of its own, so the only writer of a shard is the
+    thread it belongs to. Reading adds all the shards up, and may be a sample behind.
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+
+        # Only taken the first time a thread records.
+        self.lock = threading.Lock()
+
+    def get_shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = Shard()
+
+            with self.lock:
+                self.shards.append(shard)
+
+            return shard
+
+    def observe(self, value):
+        shard = self.get_shard()
+        shard.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        shard.total += value
+
+        if value > shard.max:
+            shard.max = value
+
+    def get_counts(self):
+        counts = [0] * (len(BUCKETS) + 1)
+        total = 0.0
+        highest = 0.0
+
+        for shard in list(self.shards):
+            for i, count in enumerate(shard.counts):
+                counts[i] += count
+
+            total += shard.total
+            highest = max(highest, shard.max)
+
+        return counts, total, highest
+
+    def get_state(self):
+        counts, total, highest = self.get_counts()
+        count = sum(counts)
+
+        def percentile(fraction):
+            if not count:
+                return None
+
+            seen = 0
+            for i, bucket in enumerate(counts):
+                seen += bucket
+                if seen >= count * fraction:
+                    # The bucket's upper bound, or the slowest sample for the overflow bucket.
+                    return round(min(BUCKETS[i], highest) if i < len(BUCKETS) else highest, 6)
+
+        return {
+            "count": count,
+            "sum": round(total, 6),
+            "avg": round(total / count, 6) if count else None,
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": round(highest, 6)
+        }
+
+class Counter:
+    """A counter sharded per thread the same way as Histogram."""
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+
+    def add(self, amount = 1):
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.local.shard = [0]
+
+            with self.lock:
+                self.shards.append(shard)
+
+        shard[0] += amount
+
+    def get_value(self):
+        return sum(shard[0] for shard in list(self.shards))
+
+class Stats:
+    """Latency histograms and counters for the monitor's own internals.
+
+    Metrics are keyed by name plus a few labels, e.g. command_seconds for the
+    command get_servers. Lookups of existing metrics don't lock, and neither does
+    recording, so the hot paths of the API can afford to be instrumented.
+    Everything is readable through get_stats(), or as Prometheus text over HTTP
+    if a port is configured.
+    """
+    def __init__(self, _logger, _config = None):
+        if not _logger:
+            raise ValueError("STATS: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # Where to serve the Prometheus text from. No port, no listener.
+        self.http_host = config.get("http-host", "127.0.0.1")
+        self.http_port = config.get("http-port")
+
+        # (name, labels) -> Histogram or Counter.
+        self.histograms = {}
+        self.counters = {}
+
+        # Server name -> when its DreamDaemon went down unexpectedly or was asked to restart, or was asked to stop.
+        self.down_at = {}
+        self.stopping_at = {}
+
+        self.http_server = None
+        self.started = time.time()
+
+        self.lock = threading.Lock()
+
+    def get_metric(self, metrics, cls, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = metrics.get(key)
+
+        if metric is None:
+            with self.lock:
+                metric = metrics.setdefault(key, cls())
+
+        return metric
+
+    def observe(self, name, seconds, **labels):
+        self.get_metric(self.histograms, Histogram, name, labels).observe(seconds)
+
+    def count(self, name, amount = 1, **labels):
+        self.get_metric(self.counters, Counter, name, labels).add(amount)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def wrap(self, name, callback, **labels):
+        """Returns callback, timed into the histogram name. Exceptions are counted into name's errors."""
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+
+            try:
+                return callback(*args, **kwargs)
+            except Exception:
+                self.count(name.replace("_seconds", "_errors_total"), **labels)
+                raise
+            finally:
+                self.observe(name, time.perf_counter() - started, **labels)
+
+        return timed
+
+    def on_event(self, event):
+        """EventBus listener timing the server lifecycle."""
+        topic = event["event"]
+        server = event["server"]
+
+        if not server:
+            return
+
+        self.count("server_events_total", server = server, event = topic)
+
+        if topic == "restart_requested":
+            self.down_at.setdefault(server, event["time"])
+        elif topic == "stopping":
+            self.stopping_at[server] = event["time"]
+        elif topic == "stopped":
+            if event["data"].get("expected"):
+                stopping = self.stopping_at.pop(server, None)
+                if stopping is not None:
+                    self.observe("server_stop_seconds", event["time"] - stopping, server = server)
+            else:
+                self.down_at.setdefault(server, event["time"])
+        elif topic == "parked":
+            self.down_at.pop(server, None)
+        elif topic == "started":
+            down = self.down_at.pop(server, None)
+            if down is not None:
+                self.observe("server_restart_seconds", event["time"] - down, server = server)
+
+    def get_stats(self):
+        def label(labels):
+            return ",".join("{0}={1}".format(key, value) for key, value in labels)
+
+        histograms = {}
+        for (name, labels), histogram in list(self.histograms.items()):
+            histograms.setdefault(name, {})[label(labels)] = histogram.get_state()
+
+        counters = {}
+        for (name, labels), counter in list(self.counters.items()):
+            counters.setdefault(name, {})[label(labels)] = counter.get_value()
+
+        return {"uptime": round(time.time() - self.started, 1), "histograms": histograms, "counters": counters}
+
+    def render_prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        def label(labels, extra = ()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+
+            return "{" + ",".join('{0}="{1}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in pairs) + "}"
+
+        lines = []
+
+        for name in sorted(set(key[0] for key in list(self.histograms))):
+            lines.append("# TYPE servermonitor_{0} histogram".format(name))
+
+            for (metric, labels), histogram in sorted(list(self.histograms.items())):
+                if metric != name:
+                    continue
+
+                counts, total, _highest = histogram.get_counts()
+                seen = 0
+
+                for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                    seen += count
+                    lines.append("servermonitor_{0}_bucket{1} {2}".format(name, label(labels, [("le", bound)]), seen))
+
+                lines.append("servermonitor_{0}_sum{1} {2}".format(name, label(labels), total))
+                lines.append("servermonitor_{0}_count{1} {2}".format(name, label(labels), seen))
+
+        for name in sorted(set(key[0] for key in list(self.counters))):
+            lines.append("# TYPE servermonitor_{0} counter".format(name))
+
+            for (metric, labels), counter in sorted(list(self.counters.items())):
+                if metric == name:
+                    lines.append("servermonitor_{0}{1} {2}".format(name, label(labels), counter.get_value()))
+
+        return "\n".join(lines) + "\n"
+
+    def serve_http(self):
+        """Starts the Prometheus listener, if a port is configured."""
+        if not self.http_port:
+            return
+
+        stats = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = stats.render_prometheus().encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.http_server = http.server.ThreadingHTTPServer((self.http_host, self.http_port), Handler)
+        except OSError as e:
+            self.logger.error("STATS: Unable to listen on {0}:{1}: {2}".format(self.http_host, self.http_port, e))
+            return
+
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, name="StatsHTTP", daemon=True).start()
+
+        self.logger.info("STATS: Serving metrics on {0}:{1}.".format(self.http_host, self.http_port))
+
+    def stop(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server = None
@@ -0,0 +1,110 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+class PreSerialized:
+    """A command result which already holds its own JSON encoding."""
+    def __init__(self, _data):
+        self.data = _data
+        self.encoded = json.dumps(_data, separators=(',', ':')).encode("utf-8")
+
+class StatusSnapshot:
+    """A versioned, pre-serialized copy of the server status.
+
+    The snapshot is only rebuilt when it has been invalidated, or when it is older than
+    max_age seconds, which catches changes nobody invalidated for. The version only
+    goes up when a rebuild actually comes out different. It starts over with every
+    monitor process, so replies also carry an epoch naming the process they came from.
+    """
+    def __init__(self, _builder, _max_age = 1.0):
+        # Callable returning the current status dict.
+        self.builder = _builder
+
+        self.max_age = _max_age
+
+        self.version = 0
+        self.epoch = uuid.uuid4().hex
+        self.result = None
+        self.built_at = 0
+        self.dirty = True
+
+        # (loop, future) pairs of long-polls waiting for the next version.
+        self.waiters = []
+
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.dirty = True
+            waiters = list(self.waiters)
+
+        # Wake the long-polls so they rebuild and check.
+        self.wake(waiters)
+
+    def get(self):
+        """Returns (version, PreSerialized result), rebuilding first if needed."""
+        with self.lock:
+            if not self.dirty and time.monotonic() - self.built_at < self.max_age:
+                return self.version, self.result
+
+            data = self.builder()
+            self.built_at = time.monotonic()
+            self.dirty = False
+
+            if self.result is not None and data == self.result.data["data"]:
+                return self.version, self.result
+
+            self.version += 1
+            self.result = PreSerialized({"error": False, "msg": None, "data": data, "version": self.version, "epoch": self.epoch})
+            waiters = list(self.waiters)
+
+        self.wake(waiters)
+
+        return self.version, self.result
+
+    def wake(self, waiters):
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda future = future: future.done() or future.set_result(None))
+
+    async def wait_newer(self, version, timeout):
+        """Waits, on the calling event loop, until there is a version newer than version or timeout runs out."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        while True:
+            current, result = await loop.run_in_executor(None, self.get)
+            remaining = deadline - loop.time()
+
+            if current > version or remaining <= 0:
+                return current, result
+
+            future = loop.create_future()
+
+            with self.lock:
+                self.waiters.append((loop, future))
+
+            try:
+                await asyncio.wait_for(future, min(remaining, self.max_age))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self.lock:
+                    self.waiters.remove((loop, future))
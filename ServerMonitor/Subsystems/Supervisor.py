@@ -0,0 +1,299 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import collections
+import heapq
+import itertools
+import os
+import select
+import selectors
+import socket
+import threading
+import time
+
+class Timer:
+    """A handle for a callback scheduled with Supervisor.call_later."""
+    def __init__(self, _deadline, _callback):
+        self.deadline = _deadline
+        self.callback = _callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Supervisor(threading.Thread):
+    """A single thread which watches every managed process and runs the timers attached to them.
+
+    Process exits are picked up through pidfds where the platform has them, so an exit is
+    noticed the moment it happens. Elsewhere the watched processes are polled every
+    poll_interval seconds instead. Process output pipes are drained from the same loop,
+    or from a small reader thread on Windows, where select() only takes sockets. A file
+    descriptor select() chokes on is dropped from the loop rather than taking it down.
+    """
+    def __init__(self, _logger, _poll_interval = 0.5):
+        threading.Thread.__init__(self)
+
+        self.name = "Supervisor"
+        self.daemon = True
+
+        if not _logger:
+            raise ValueError("SUPERVISOR: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        # How often processes without a pidfd are polled.
+        self.poll_interval = _poll_interval
+
+        # Everything that can wake the loop up.
+        self.selector = selectors.DefaultSelector()
+
+        # Writing to this socket pair wakes the loop up from select().
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, self.drain_wake)
+
+        # Callables handed over from other threads, ran on the supervisor thread.
+        self.calls = collections.deque()
+
+        # Heap of (deadline, sequence, Timer).
+        self.timers = []
+        self.sequence = itertools.count()
+
+        # Process -> (callback, pidfd or None).
+        self.watched = {}
+
+        # Output fd -> (pipe, callback), for the pipes drained by the loop itself.
+        self.outputs = {}
+
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                ready = self.selector.select(self.get_timeout())
+            except (OSError, ValueError) as e:
+                self.logger.error("SUPERVISOR: select() failed: {0}".format(e))
+                self.drop_bad_fds()
+                ready = []
+
+            for key, _mask in ready:
+                try:
+                    key.data()
+                except Exception as e:
+                    self.logger.error("SUPERVISOR: Error handling fd {0}: {1}".format(key.fd, e))
+
+            self.run_calls()
+            self.run_timers()
+            self.poll_processes()
+
+    def drop_bad_fds(self):
+        """Unregisters whatever select() won't take. Processes go back to being polled, pipes to a reader thread."""
+        for key in list(self.selector.get_map().values()):
+            try:
+                select.select([key.fd], [], [], 0)
+                continue
+            except (OSError, ValueError) as e:
+                self.logger.error("SUPERVISOR: Dropping fd {0} from the loop: {1}".format(key.fd, e))
+
+            self.selector.unregister(key.fileobj)
+
+            for process, (callback, pidfd) in list(self.watched.items()):
+                if pidfd == key.fd:
+                    self.watched[process] = (callback, None)
+
+                    try:
+                        os.close(pidfd)
+                    except OSError:
+                        pass
+
+            if key.fd in self.outputs:
+                pipe, callback = self.outputs.pop(key.fd)
+                self.start_reader(pipe, callback)
+
+    def stop(self):
+        self.running = False
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            # The pipe is already full, so the loop is going to wake up anyway.
+            pass
+
+    def drain_wake(self):
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def call_soon(self, callback):
+        """Runs callback on the supervisor thread. Safe to call from any thread."""
+        self.calls.append(callback)
+        self.wake()
+
+    def call_later(self, delay, callback):
+        """Runs callback on the supervisor thread after delay seconds. Returns a cancellable Timer."""
+        timer = Timer(time.monotonic() + delay, callback)
+        self.call_soon(lambda: heapq.heappush(self.timers, (timer.deadline, next(self.sequence), timer)))
+        return timer
+
+    def watch(self, process, callback):
+        """Starts watching process. callback(returncode) is ran on the supervisor thread once it exits."""
+        self.call_soon(lambda: self.add_process(process, callback))
+
+    def add_process(self, process, callback):
+        pidfd = None
+
+        if hasattr(os, "pidfd_open"):
+            try:
+                pidfd = os.pidfd_open(process.pid)
+                self.selector.register(pidfd, selectors.EVENT_READ, lambda: self.reap(process))
+            except OSError as e:
+                self.logger.debug("SUPERVISOR: No pidfd for PID {0}, polling it instead: {1}".format(process.pid, e))
+                pidfd = None
+
+        self.watched[process] = (callback, pidfd)
+
+    def watch_output(self, pipe, callback):
+        """Drains pipe without blocking. callback(data) gets every chunk, and b'' once the pipe closes."""
+        self.call_soon(lambda: self.add_output(pipe, callback))
+
+    def add_output(self, pipe, callback):
+        fd = pipe.fileno()
+
+        # select() on Windows only takes sockets, even where os.set_blocking() works on pipes.
+        if os.name == "nt":
+            self.start_reader(pipe, callback)
+            return
+
+        try:
+            self.selector.register(fd, selectors.EVENT_READ, lambda: self.read_output(pipe, callback))
+            os.set_blocking(fd, False)
+        except (AttributeError, OSError, ValueError):
+            # No select() on pipes here either. Fall back to a blocking reader of our own.
+            if fd in self.selector.get_map():
+                self.selector.unregister(fd)
+
+            self.start_reader(pipe, callback)
+            return
+
+        self.outputs[fd] = (pipe, callback)
+
+    def start_reader(self, pipe, callback):
+        try:
+            os.set_blocking(pipe.fileno(), True)
+        except (AttributeError, OSError, ValueError):
+            pass
+
+        threading.Thread(target=self.read_output_blocking, args=(pipe, callback), name="Supervisor-reader", daemon=True).start()
+
+    def read_output(self, pipe, callback):
+        try:
+            data = os.read(pipe.fileno(), 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self.outputs.pop(pipe.fileno(), None)
+            self.selector.unregister(pipe.fileno())
+            pipe.close()
+
+        self.run_output_callback(callback, data)
+
+    def read_output_blocking(self, pipe, callback):
+        while True:
+            try:
+                data = os.read(pipe.fileno(), 65536)
+            except OSError:
+                data = b''
+
+            # Hand it over to the supervisor thread, so callbacks only ever run there.
+            self.call_soon(lambda data = data: self.run_output_callback(callback, data))
+
+            if not data:
+                pipe.close()
+                return
+
+    def run_output_callback(self, callback, data):
+        try:
+            callback(data)
+        except Exception as e:
+            self.logger.error("SUPERVISOR: Error in output handler: {0}".format(e))
+
+    def reap(self, process):
+        if process not in self.watched:
+            return
+
+        returncode = process.poll()
+
+        if returncode is None:
+            return
+
+        callback, pidfd = self.watched.pop(process)
+
+        if pidfd is not None:
+            self.selector.unregister(pidfd)
+            os.close(pidfd)
+
+        try:
+            callback(returncode)
+        except Exception as e:
+            self.logger.error("SUPERVISOR: Error in exit handler for PID {0}: {1}".format(process.pid, e))
+
+    def poll_processes(self):
+        for process, (_callback, pidfd) in list(self.watched.items()):
+            if pidfd is None:
+                self.reap(process)
+
+    def run_calls(self):
+        while self.calls:
+            callback = self.calls.popleft()
+
+            try:
+                callback()
+            except Exception as e:
+                self.logger.error("SUPERVISOR: Error in scheduled call: {0}".format(e))
+
+    def run_timers(self):
+        now = time.monotonic()
+
+        while self.timers and self.timers[0][0] <= now:
+            _deadline, _sequence, timer = heapq.heappop(self.timers)
+
+            if timer.cancelled:
+                continue
+
+            try:
+                timer.callback()
+            except Exception as e:
+                self.logger.error("SUPERVISOR: Error in timer: {0}".format(e))
+
+    def get_timeout(self):
+        timeout = None
+
+        if self.timers:
+            timeout = max(0, self.timers[0][0] - time.monotonic())
+
+        if any(pidfd is None for _callback, pidfd in self.watched.values()):
+            timeout = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+
+        return timeout
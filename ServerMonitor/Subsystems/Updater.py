@@ -0,0 +1,175 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import concurrent.futures
+import os
+import subprocess
+import threading
+import time
+
+class Updater:
+    """Keeps every server's checkout up to date from one shared git object store.
+
+    The store is a bare repository fetched once per update. Each server's git path is
+    a worktree of it, so checkouts cost no network traffic and no extra copies of the
+    history. Existing standalone clones are pointed at the store through alternates
+    instead, and fetch from it locally.
+    """
+    def __init__(self, _logger, _config = None):
+        if not _logger:
+            raise ValueError("UPDATER: Wasn't handed a logger.")
+
+        # The logger.
+        self.logger = _logger
+
+        config = _config or {}
+
+        # The shared bare repository.
+        self.store_path = os.path.abspath(config.get("object-store", "objects.git"))
+
+        # Where the code comes from. Can be a URL or a local path.
+        self.remote = config.get("remote")
+
+        # Branch used by servers which don't set their own git-branch.
+        self.branch = config.get("branch", "master")
+
+        # Checkouts allowed to run at once.
+        self.max_parallel = config.get("max-parallel", 4)
+
+        # Seconds a single git command may take.
+        self.timeout = config.get("timeout", 600)
+
+        # Timing and result of the last fetch, and of each server's last checkout.
+        self.fetch_status = {"state": "never"}
+        self.status = {}
+
+        # Only one update cycle at a time.
+        self.cycle_lock = threading.Lock()
+
+        # Adding worktrees edits the store's own bookkeeping, so those go one by one.
+        self.worktree_lock = threading.Lock()
+        self.lock = threading.Lock()
+
+    def git(self, args, cwd = None):
+        process = subprocess.run(["git"] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout)
+
+        if process.returncode != 0:
+            raise RuntimeError("git {0} failed: {1}".format(" ".join(args), process.stdout.decode("utf-8", errors="replace").strip()))
+
+        return process.stdout.decode("utf-8", errors="replace").strip()
+
+    def store_git(self, args):
+        return self.git(["--git-dir", self.store_path] + args)
+
+    def ensure_store(self):
+        if not self.remote:
+            raise RuntimeError("No update remote configured.")
+
+        if not os.path.isdir(self.store_path):
+            self.logger.info("UPDATER: Creating object store at {0}.".format(self.store_path))
+            self.git(["init", "--bare", self.store_path])
+
+        remotes = self.store_git(["remote"]).split()
+
+        if "origin" in remotes:
+            self.store_git(["remote", "set-url", "origin", self.remote])
+        else:
+            self.store_git(["remote", "add", "origin", self.remote])
+
+    def fetch(self):
+        started = time.time()
+
+        with self.lock:
+            self.fetch_status = {"state": "fetching", "started": started}
+
+        try:
+            self.ensure_store()
+            self.store_git(["fetch", "--prune", "origin", "+refs/heads/*:refs/remotes/origin/*"])
+        except Exception as e:
+            with self.lock:
+                self.fetch_status = {"state": "failed", "started": started, "finished": time.time(), "error": str(e)}
+            raise
+
+        with self.lock:
+            self.fetch_status = {"state": "done", "started": started, "finished": time.time(), "duration": round(time.time() - started, 2)}
+
+        self.logger.info("UPDATER: Fetched {0} in {1:.2f} seconds.".format(self.remote, time.time() - started))
+
+    def checkout(self, server):
+        started = time.time()
+        branch = server.git_branch or self.branch
+        target = "refs/remotes/origin/{0}".format(branch)
+        dot_git = os.path.join(server.git_path, ".git")
+
+        with self.lock:
+            self.status[server.name] = {"state": "checking out", "branch": branch, "started": started}
+
+        try:
+            if not os.path.exists(dot_git):
+                # A fresh worktree. git refuses anything but an empty directory here, which is what we want.
+                with self.worktree_lock:
+                    self.store_git(["worktree", "prune"])
+                    self.store_git(["worktree", "add", "--detach", "--force", os.path.abspath(server.git_path), target])
+            else:
+                if os.path.isdir(dot_git):
+                    # A standalone clone. Borrow the store's objects and fetch from it locally.
+                    self.add_alternate(dot_git)
+                    self.git(["fetch", "--no-tags", self.store_path, "+{0}:{0}".format(target)], cwd=server.git_path)
+
+                self.git(["checkout", "--detach", "--force", target], cwd=server.git_path)
+
+            commit = self.git(["rev-parse", "HEAD"], cwd=server.git_path)
+        except Exception as e:
+            with self.lock:
+                self.status[server.name].update(state="failed", finished=time.time(), error=str(e))
+            self.logger.error("UPDATER {0}: Checkout failed: {1}".format(server.name, e))
+            raise
+
+        server.compile_ready = os.path.isfile(server.get_dme_path())
+
+        with self.lock:
+            self.status[server.name].update(state="done", commit=commit, finished=time.time(), duration=round(time.time() - started, 2))
+
+        self.logger.info("UPDATER {0}: Checked out {1} at {2}.".format(server.name, branch, commit[:12]))
+
+    def add_alternate(self, dot_git):
+        alternates = os.path.join(dot_git, "objects", "info", "alternates")
+        objects = os.path.join(self.store_path, "objects")
+
+        lines = []
+        if os.path.isfile(alternates):
+            with open(alternates, "r") as f:
+                lines = f.read().split()
+
+        if objects not in lines:
+            os.makedirs(os.path.dirname(alternates), exist_ok=True)
+            with open(alternates, "a") as f:
+                f.write(objects + "\n")
+
+    def update(self, servers):
+        """One fetch, then a checkout for every server in parallel. Returns the status of each."""
+        with self.cycle_lock:
+            self.fetch()
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="Updater") as pool:
+                futures = [pool.submit(self.checkout, server) for server in servers]
+                concurrent.futures.wait(futures)
+
+        return self.get_status()
+
+    def get_status(self):
+        with self.lock:
+            return {"fetch": dict(self.fetch_status), "servers": {name: dict(state) for name, state in self.status.items()}}
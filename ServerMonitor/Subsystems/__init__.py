@@ -1,4 +1,21 @@
+from ServerMonitor.Subsystems.Compiler import Compiler
 from ServerMonitor.Subsystems.Config import Config
-from ServerMonitor.Subsystems.Server import Server
+from ServerMonitor.Subsystems.EventBus import EventBus, Subscriber
+from ServerMonitor.Subsystems.Federation import Federation
+from ServerMonitor.Subsystems.HealthProber import HealthProber
+from ServerMonitor.Subsystems.JobQueue import JobQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from ServerMonitor.Subsystems.LogIndex import LogIndex
+from ServerMonitor.Subsystems.LogPipeline import LogPipeline
+from ServerMonitor.Subsystems.OutputBuffer import OutputBuffer
+from ServerMonitor.Subsystems.Placement import Placement
+from ServerMonitor.Subsystems.Profiler import Profiler
+from ServerMonitor.Subsystems.ResourceSampler import ResourceSampler
+from ServerMonitor.Subsystems.RestartPolicy import RestartPolicy
+from ServerMonitor.Subsystems.Server import Server, STATE_STOPPED, STATE_STARTING, STATE_RUNNING, STATE_STOPPING, STATE_BACKOFF, STATE_FAILED
 from ServerMonitor.Subsystems.ServerData import ServerData
-from ServerMonitor.Subsystems.API import API
\ No newline at end of file
+from ServerMonitor.Subsystems.StateJournal import StateJournal, AdoptedProcess
+from ServerMonitor.Subsystems.Stats import Stats
+from ServerMonitor.Subsystems.StatusSnapshot import StatusSnapshot, PreSerialized
+from ServerMonitor.Subsystems.Supervisor import Supervisor
+from ServerMonitor.Subsystems.Updater import Updater
+from ServerMonitor.Subsystems.API import API, Dispatcher
\ No newline at end of file
@@ -0,0 +1,170 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+import json
+import os
+import socket
+import time
+
+import pytest
+
+from test_federation import start_monitor
+
+STUB_DD = """#!/bin/sh
+exec sleep 30
+"""
+
+def request(cmd, args = None, **extra):
+    return dict({"cmd": cmd, "args": args or {}, "auths": ["R_ADMIN"]}, **extra)
+
+class Connection:
+    """A raw connection, for sending frames in whatever pieces the test likes."""
+    def __init__(self, port):
+        self.socket = socket.create_connection(("127.0.0.1", port), timeout=5)
+        self.file = self.socket.makefile("rb")
+
+    def send(self, data):
+        self.socket.sendall(data)
+
+        # Give the monitor time to read it as a segment of its own.
+        time.sleep(0.1)
+
+    def read(self):
+        return json.loads(self.file.readline())
+
+    def is_closed(self):
+        return self.file.readline() == b""
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+@pytest.fixture
+def monitor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    monitor, port = start_monitor(tmp_path, "api", ["s1"])
+
+    # A DreamDaemon that idles until it's told to stop.
+    dd_path = monitor.get_server("s1").get_dd_path()
+    with open(dd_path, "w") as f:
+        f.write(STUB_DD)
+    os.chmod(dd_path, 0o755)
+
+    connections = []
+
+    def connect():
+        connection = Connection(port)
+        connections.append(connection)
+        return connection
+
+    yield monitor, connect
+
+    for connection in connections:
+        connection.close()
+
+    monitor.API.stop()
+    monitor.supervisor.stop()
+
+def test_frame_split_across_segments(monitor):
+    _monitor, connect = monitor
+    connection = connect()
+    frame = json.dumps(request("get_servers", id=1)).encode("utf-8") + b"\n"
+
+    connection.send(frame[:10])
+    connection.send(frame[10:-1])
+    # Complete JSON without its newline looks like a legacy client, until the newline shows up.
+    connection.send(frame[-1:])
+
+    assert connection.read()["id"] == 1
+
+    # Still a framed connection, so it's kept open.
+    connection.send(json.dumps(request("get_servers", id=2)).encode("utf-8") + b"\n")
+    assert connection.read()["id"] == 2
+
+def test_payload_of_exactly_1024_bytes(monitor):
+    _monitor, connect = monitor
+    connection = connect()
+
+    frame = json.dumps(request("get_servers", id=1, pad="")).encode("utf-8")
+    frame = json.dumps(request("get_servers", id=1, pad="x" * (1024 - len(frame)))).encode("utf-8")
+    assert len(frame) == 1024
+
+    connection.send(frame + b"\n")
+    reply = connection.read()
+
+    assert not reply["error"]
+    assert reply["id"] == 1
+    assert "s1" in reply["data"]
+
+def test_pipelined_frames_run_in_order(monitor):
+    _monitor, connect = monitor
+    connection = connect()
+
+    # Sent together. Were the stop to run first, it would find nothing running.
+    frames = [request("server_control", {"control": "start", "server": "s1"}, id="start"), request("server_control", {"control": "stop", "server": "s1"}, id="stop")]
+    connection.send(b"".join(json.dumps(frame).encode("utf-8") + b"\n" for frame in frames))
+
+    start = connection.read()
+    stop = connection.read()
+
+    assert start["id"] == "start"
+    assert not start["error"], start["msg"]
+    assert stop["id"] == "stop"
+    assert not stop["error"], stop["msg"]
+
+def test_subscribe_in_a_batch_is_refused(monitor):
+    _monitor, connect = monitor
+    connection = connect()
+
+    connection.send(json.dumps([request("get_servers", id=1), request("subscribe", id=2)]).encode("utf-8") + b"\n")
+    replies = connection.read()
+
+    assert [reply["id"] for reply in replies] == [1, 2]
+    assert not replies[0]["error"]
+    assert replies[1] == {"error": True, "msg": "Subscriptions can't be part of a batch.", "id": 2}
+
+    # The connection didn't turn into a stream.
+    connection.send(json.dumps(request("get_servers", id=3)).encode("utf-8") + b"\n")
+    assert connection.read()["id"] == 3
+
+def test_frames_after_a_subscribe_are_dropped(monitor):
+    _monitor, connect = monitor
+    connection = connect()
+
+    frames = [request("subscribe", id=1), request("server_control", {"control": "start", "server": "s1"}, id=2)]
+    connection.send(b"".join(json.dumps(frame).encode("utf-8") + b"\n" for frame in frames))
+
+    assert connection.read() == {"error": False, "msg": "Subscribed.", "id": 1}
+
+    # The start never ran, so no reply and no started event arrives.
+    connection.socket.settimeout(1)
+    with pytest.raises(socket.timeout):
+        connection.read()
+
+def test_legacy_client_without_newline(monitor):
+    _monitor, connect = monitor
+    connection = connect()
+
+    connection.send(json.dumps(request("get_servers")).encode("utf-8"))
+    reply = connection.read()
+
+    assert not reply["error"]
+    assert "s1" in reply["data"]
+
+    # Hung up on once the grace period runs out.
+    assert connection.is_closed()
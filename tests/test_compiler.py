@@ -0,0 +1,187 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import os
+import sys
+import threading
+
+import pytest
+
+from ServerMonitor.Subsystems.Compiler import Compiler
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="The stub DreamMaker is a script run through its shebang.")
+
+# Writes a .dmb and .rsc like DreamMaker would, and counts its runs.
+STUB_DM = """#!{python}
+import os, sys, time
+root = os.path.dirname(sys.argv[1])
+with open(os.path.join(root, "runs"), "a") as f:
+    f.write("run\\n")
+time.sleep(float(os.environ.get("STUB_DM_SLEEP", "0")))
+if os.environ.get("STUB_DM_FAIL"):
+    print("error: broken.dm:1: it broke")
+    sys.exit(1)
+with open(os.path.join(root, "baystation12.dme")) as f:
+    source = f.read()
+with open(os.path.join(root, "baystation12.dmb"), "w") as f:
+    f.write("dmb " + source)
+with open(os.path.join(root, "baystation12.rsc"), "w") as f:
+    f.write("rsc " + source)
+"""
+
+class StubServer:
+    """The parts of ServerData the compiler uses, with native paths."""
+    def __init__(self, root, name, git_path, dm_path):
+        self.name = name
+        self.git_path = git_path
+        self.game_path = os.path.join(root, "game-" + name)
+        self.dm_path = dm_path
+        self.server_ready = False
+
+        os.makedirs(self.game_path)
+
+    def get_dm_path(self):
+        return self.dm_path
+
+    def get_dme_path(self):
+        return os.path.join(self.git_path, "baystation12.dme")
+
+    def get_build_dmb_path(self):
+        return os.path.join(self.git_path, "baystation12.dmb")
+
+    def get_build_rsc_path(self):
+        return os.path.join(self.git_path, "baystation12.rsc")
+
+    def get_dmb_path(self):
+        return os.path.join(self.game_path, "baystation12.dmb")
+
+    def get_rsc_path(self):
+        return os.path.join(self.game_path, "baystation12.rsc")
+
+    def get_published(self, name):
+        with open(os.path.join(self.game_path, name)) as f:
+            return f.read()
+
+@pytest.fixture
+def tree(tmp_path):
+    git_path = tmp_path / "git"
+    git_path.mkdir()
+    (git_path / "baystation12.dme").write_text("v1")
+
+    dm_path = tmp_path / "dreammaker"
+    dm_path.write_text(STUB_DM.format(python=sys.executable))
+    dm_path.chmod(0o755)
+
+    return tmp_path, str(git_path), str(dm_path)
+
+def get_runs(git_path):
+    try:
+        with open(os.path.join(git_path, "runs")) as f:
+            return len(f.readlines())
+    except OSError:
+        return 0
+
+def test_miss_builds_and_publishes(tree, logger):
+    root, git_path, dm_path = tree
+    compiler = Compiler(logger, {"cache-path": str(root / "cache")})
+    server = StubServer(root, "a", git_path, dm_path)
+
+    status = compiler.compile(server)
+
+    assert status["state"] == "done"
+    assert status["cached"] is False
+    assert get_runs(git_path) == 1
+    assert server.server_ready
+    assert server.get_published("baystation12.dmb") == "dmb v1"
+    assert server.get_published("baystation12.rsc") == "rsc v1"
+
+def test_hit_skips_dreammaker(tree, logger):
+    root, git_path, dm_path = tree
+    compiler = Compiler(logger, {"cache-path": str(root / "cache")})
+    first = StubServer(root, "a", git_path, dm_path)
+    second = StubServer(root, "b", git_path, dm_path)
+
+    compiler.compile(first)
+    status = compiler.compile(second)
+
+    assert status["cached"] is True
+    assert get_runs(git_path) == 1
+    assert second.get_published("baystation12.dmb") == "dmb v1"
+
+def test_source_change_misses(tree, logger):
+    root, git_path, dm_path = tree
+    compiler = Compiler(logger, {"cache-path": str(root / "cache")})
+    server = StubServer(root, "a", git_path, dm_path)
+
+    compiler.compile(server)
+    (root / "git" / "baystation12.dme").write_text("v2")
+    status = compiler.compile(server)
+
+    assert status["cached"] is False
+    assert get_runs(git_path) == 2
+    assert server.get_published("baystation12.dmb") == "dmb v2"
+    assert server.get_published("baystation12.rsc") == "rsc v2"
+
+def test_concurrent_identical_builds_compile_once(tree, logger, monkeypatch):
+    root, git_path, dm_path = tree
+    monkeypatch.setenv("STUB_DM_SLEEP", "0.5")
+    compiler = Compiler(logger, {"cache-path": str(root / "cache"), "max-parallel": 2})
+    servers = [StubServer(root, name, git_path, dm_path) for name in ("a", "b")]
+
+    results = compiler.compile_many(servers)
+
+    assert get_runs(git_path) == 1
+    assert sorted(result["cached"] for result in results.values()) == [False, True]
+
+def test_failure_keeps_the_old_build(tree, logger, monkeypatch):
+    root, git_path, dm_path = tree
+    compiler = Compiler(logger, {"cache-path": str(root / "cache")})
+    server = StubServer(root, "a", git_path, dm_path)
+
+    compiler.compile(server)
+    (root / "git" / "baystation12.dme").write_text("v2")
+    monkeypatch.setenv("STUB_DM_FAIL", "1")
+
+    with pytest.raises(RuntimeError, match="it broke"):
+        compiler.compile(server)
+
+    assert compiler.get_status("a")["state"] == "failed"
+    assert server.get_published("baystation12.dmb") == "dmb v1"
+
+def test_cancel_stops_before_publishing(tree, logger):
+    root, git_path, dm_path = tree
+    compiler = Compiler(logger, {"cache-path": str(root / "cache")})
+    server = StubServer(root, "a", git_path, dm_path)
+    cancelled = threading.Event()
+    cancelled.set()
+
+    results = compiler.compile_many([server], cancelled)
+
+    assert results["a"]["state"] == "cancelled"
+    assert get_runs(git_path) == 0
+    assert not os.path.exists(server.get_dmb_path())
+
+def test_publish_leaves_the_game_path_alone(tree, logger):
+    root, git_path, dm_path = tree
+    compiler = Compiler(logger, {"cache-path": str(root / "cache")})
+    server = StubServer(root, "a", git_path, dm_path)
+    os.makedirs(os.path.join(server.game_path, "data"))
+
+    compiler.compile(server)
+    (root / "git" / "baystation12.dme").write_text("v2")
+    compiler.compile(server)
+
+    assert sorted(os.listdir(server.game_path)) == ["baystation12.dmb", "baystation12.rsc", "data"]
@@ -0,0 +1,93 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+from ServerMonitor.Subsystems.API.Dispatcher import Dispatcher
+
+class StubServer:
+    def __init__(self, name, auths):
+        self.name = name
+        self.auths = auths
+
+COMMANDS = {
+    "get_servers": {"cmd": None, "args": [], "auths": ["R_DEV"], "needs_queue": False},
+    "get_stats": {"cmd": None, "args": [], "auths": [], "needs_queue": False}
+}
+
+def test_inherited_roles_grant_access():
+    dispatcher = Dispatcher({"R_ADMIN": ["R_DEV"], "R_HEAD": ["R_ADMIN"]})
+    dispatcher.set_commands(COMMANDS)
+    command = dispatcher.get_command("get_servers")
+
+    assert dispatcher.expand(["R_ADMIN"]) == {"R_ADMIN", "R_DEV"}
+    assert dispatcher.expand(["R_HEAD"]) == {"R_HEAD", "R_ADMIN", "R_DEV"}
+    assert dispatcher.can_use(command, ["R_ADMIN"])
+    assert dispatcher.can_use(command, ["R_HEAD"])
+
+def test_inheritance_is_not_reversed():
+    dispatcher = Dispatcher({"R_ADMIN": ["R_DEV"]})
+    dispatcher.set_servers([StubServer("s1", ["R_ADMIN"])])
+    server = dispatcher.get_server("s1")
+
+    assert dispatcher.expand(["R_DEV"]) == {"R_DEV"}
+    assert not dispatcher.can_control(server, ["R_DEV"])
+    assert dispatcher.can_control(server, ["R_ADMIN"])
+
+def test_cycles_terminate():
+    dispatcher = Dispatcher({"R_A": ["R_B"], "R_B": ["R_C"], "R_C": ["R_A"]})
+
+    assert dispatcher.expand(["R_A"]) == {"R_A", "R_B", "R_C"}
+    assert dispatcher.expand(["R_C"]) == {"R_A", "R_B", "R_C"}
+
+def test_unknown_roles_stand_for_themselves():
+    dispatcher = Dispatcher()
+    dispatcher.set_commands(COMMANDS)
+
+    assert dispatcher.expand(["R_MOD"]) == {"R_MOD"}
+    assert not dispatcher.can_use(dispatcher.get_command("get_servers"), ["R_MOD"])
+    assert dispatcher.can_use(dispatcher.get_command("get_stats"), [])
+
+def test_set_roles_clears_the_cache():
+    dispatcher = Dispatcher({"R_ADMIN": ["R_DEV"]})
+    dispatcher.set_commands(COMMANDS)
+    command = dispatcher.get_command("get_servers")
+    assert dispatcher.can_use(command, ["R_ADMIN"])
+
+    dispatcher.set_roles({})
+
+    assert dispatcher.expand(["R_ADMIN"]) == {"R_ADMIN"}
+    assert not dispatcher.can_use(command, ["R_ADMIN"])
+
+def test_set_servers_clears_the_cache():
+    dispatcher = Dispatcher()
+    dispatcher.set_servers([StubServer("s1", ["R_ADMIN"])])
+    server = dispatcher.get_server("s1")
+    assert not dispatcher.can_control(server, ["R_DEV"])
+
+    dispatcher.set_servers([StubServer("s1", ["R_DEV"])])
+
+    assert dispatcher.can_control(server, ["R_DEV"])
+    assert not dispatcher.can_control(dispatcher.get_server("s1"), ["R_ADMIN"])
+
+def test_set_commands_applies_to_commands_already_looked_up():
+    dispatcher = Dispatcher()
+    dispatcher.set_commands(COMMANDS)
+    command = dispatcher.get_command("get_servers")
+    assert not dispatcher.can_use(command, ["R_MOD"])
+
+    dispatcher.set_commands(dict(COMMANDS, get_servers=dict(COMMANDS["get_servers"], auths=["R_MOD"])))
+
+    assert dispatcher.can_use(command, ["R_MOD"])
@@ -0,0 +1,182 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import json
+import socket
+import time
+
+import pytest
+import yaml
+
+from ServerMonitor.ServerMonitor import ServerMonitor
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_tree(root):
+    """A game, git and BYOND path the server validation accepts. The paths use the monitor's backslashes."""
+    root.mkdir(parents=True)
+    (root / "git").mkdir()
+
+    for name in ("byond\\dreamdaemon.exe", "byond\\dreammaker.exe", "game\\baystation12.dmb"):
+        (root / name).write_text("")
+
+    return {"game-path": str(root / "game"), "git-path": str(root / "git"), "byond-path": str(root / "byond")}
+
+def start_monitor(root, name, servers, remotes = None, port = None):
+    """A monitor on its own port, with servers that are configured but never started."""
+    port = port or get_free_port()
+    tree = make_tree(root / "tree")
+
+    config = {
+        "API": {"host": "127.0.0.1", "port": port, "allowed_hosts": ["127.0.0.1"], "roles": {"R_HEAD": ["R_ADMIN"]}},
+        "servers": {server: dict(tree, port=get_free_port(), visibility="-invisible", start=False, auths=["R_ADMIN"]) for server in servers},
+        "federation": {"name": name, "timeout": 1, "cache-ttl": 0, "remotes": remotes or {}},
+        "state": {"path": str(root / "state.json"), "reattach": False},
+        "logs": {"index-path": str(root / "log-index")},
+        "health": {"interval": 3600},
+        "metrics": {"interval": 3600}
+    }
+
+    path = root / "config.yml"
+    path.write_text(yaml.safe_dump(config))
+
+    monitor = ServerMonitor(str(path))
+    assert monitor.API.bound.wait(5)
+
+    return monitor, port
+
+class Client:
+    def __init__(self, port):
+        self.socket = socket.create_connection(("127.0.0.1", port), timeout=5)
+        self.file = self.socket.makefile("rb")
+
+    def call(self, cmd, args = None, auths = ("R_ADMIN",)):
+        self.socket.sendall(json.dumps({"cmd": cmd, "args": args or {}, "auths": list(auths)}).encode("utf-8") + b"\n")
+        return json.loads(self.file.readline())
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+@pytest.fixture
+def cluster(tmp_path, monkeypatch):
+    """Monitor "east" federating monitor "west", both in this process."""
+    monkeypatch.chdir(tmp_path)
+    monitors = []
+
+    west, west_port = start_monitor(tmp_path / "west", "west", ["w1", "w2"])
+    monitors.append(west)
+
+    east, east_port = start_monitor(tmp_path / "east", "east", ["e1"], {"west": {"port": west_port, "auths": ["R_ADMIN"]}})
+    monitors.append(east)
+
+    client = Client(east_port)
+
+    yield client, east, west
+
+    client.close()
+
+    for monitor in monitors:
+        monitor.API.stop()
+        monitor.supervisor.stop()
+
+def test_servers_are_merged(cluster):
+    client, _east, _west = cluster
+
+    reply = client.call("get_federated_servers")
+
+    assert not reply["error"]
+    assert sorted(reply["data"]["servers"]) == ["east/e1", "west/w1", "west/w2"]
+    assert reply["data"]["hosts"]["west"]["ok"]
+    assert reply["data"]["servers"]["west/w1"]["host"] == "west"
+    assert reply["data"]["servers"]["west/w1"]["state"] == "stopped"
+
+def test_remote_changes_show_up(cluster):
+    client, _east, west = cluster
+    client.call("get_federated_servers")
+
+    west.get_server("w1").server_ready = False
+    west.status.invalidate()
+
+    reply = client.call("get_federated_servers")
+
+    assert reply["data"]["servers"]["west/w1"]["can_run"] is False
+
+def test_control_reaches_the_remote(cluster):
+    client, _east, _west = cluster
+
+    reply = client.call("federated_control", {"control": "stop", "targets": ["west/w1", "east/e1", "nowhere/x"]})
+
+    # Neither is running, which only the monitor owning the server can know.
+    assert reply["data"]["west/w1"] == {"error": True, "msg": "Server is not running. Shut down impossible."}
+    assert reply["data"]["east/e1"] == {"error": True, "msg": "Server is not running. Shut down impossible."}
+    assert reply["data"]["nowhere/x"] == {"error": True, "msg": "Unknown host."}
+    assert reply["error"]
+
+def test_remote_checks_its_own_auths(cluster):
+    client, _east, _west = cluster
+
+    reply = client.call("federated_control", {"control": "stop", "targets": ["west/w1"]}, ("R_MOD",))
+
+    assert reply["data"]["west/w1"]["msg"] == "Not authorized to control this specific server."
+
+def test_dead_remote_is_stale(cluster):
+    client, _east, west = cluster
+    client.call("get_federated_servers")
+
+    west.API.stop()
+    west.API.join(5)
+
+    reply = client.call("get_federated_servers")
+
+    assert not reply["error"]
+    assert reply["data"]["hosts"]["west"]["stale"]
+    assert not reply["data"]["hosts"]["west"]["ok"]
+
+    # Its last known servers are still there, marked stale.
+    assert reply["data"]["servers"]["west/w1"]["stale"]
+    assert not reply["data"]["servers"]["east/e1"]["stale"]
+
+def test_restarted_remote_is_fetched_again(cluster, tmp_path):
+    client, _east, west = cluster
+    assert client.call("get_federated_servers")["data"]["servers"]["west/w1"]
+
+    west.API.stop()
+    west.API.join(5)
+
+    # A new process on the same port, whose version starts over and matches the one east knows.
+    again, _port = start_monitor(tmp_path / "west-again", "west", ["w1", "w3"], port=west.API.config["port"])
+
+    try:
+        assert again.status.get()[0] == west.status.get()[0]
+
+        # The pooled connection to the old process fails once. A later query reconnects.
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            reply = client.call("get_federated_servers")
+
+            if reply["data"]["hosts"]["west"]["ok"]:
+                break
+
+            time.sleep(0.1)
+
+        assert sorted(reply["data"]["servers"]) == ["east/e1", "west/w1", "west/w3"]
+    finally:
+        again.API.stop()
+        again.supervisor.stop()
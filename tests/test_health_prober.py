@@ -0,0 +1,210 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import asyncio
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from ServerMonitor.Subsystems.HealthProber import HealthProber
+
+class FakeTopicServer:
+    """Answers BYOND Topic queries on a local port with a fixed reply, or not at all."""
+    def __init__(self, reply = None):
+        self.reply = reply
+        self.topics = []
+
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    @staticmethod
+    def string(text):
+        body = b"\x06" + text.encode("utf-8") + b"\x00"
+        return b"\x00\x83" + struct.pack(">H", len(body)) + body
+
+    @staticmethod
+    def number(value):
+        body = b"\x2a" + struct.pack("<f", value)
+        return b"\x00\x83" + struct.pack(">H", len(body)) + body
+
+    def serve(self):
+        while True:
+            try:
+                connection, _address = self.listener.accept()
+            except OSError:
+                return
+
+            threading.Thread(target=self.answer, args=(connection, self.reply), daemon=True).start()
+
+    def answer(self, connection, reply):
+        with connection:
+            request = connection.recv(1024)
+            self.topics.append(request[9:-1].decode("utf-8"))
+
+            # Never answering leaves the prober to time out.
+            if reply is None:
+                time.sleep(1)
+                return
+
+            connection.sendall(reply)
+
+    def close(self):
+        self.listener.close()
+
+class StubEvents:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, server = None, **data):
+        self.published.append((topic, server))
+
+class StubThread:
+    def __init__(self):
+        self.process = object()
+        self.started_at = time.monotonic() - 3600
+        self.restarts = 0
+
+    def force_restart(self):
+        self.restarts += 1
+
+class StubServer:
+    def __init__(self, name, port):
+        self.name = name
+        self.active_port = port
+        self.server_thread = StubThread()
+
+class StubMonitor:
+    def __init__(self, servers):
+        self.servers = servers
+        self.events = StubEvents()
+
+@pytest.fixture
+def fake():
+    servers = []
+
+    def make(reply = None):
+        server = FakeTopicServer(reply)
+        servers.append(server)
+        return server
+
+    yield make
+
+    for server in servers:
+        server.close()
+
+def get_prober(logger, servers, **config):
+    return HealthProber(StubMonitor(servers), logger, dict({"timeout": 0.3}, **config))
+
+def test_status_reply_is_parsed(logger, fake):
+    topic = fake(FakeTopicServer.string("version=Aurora&players=12&cpu=3.5&mode=extended"))
+    prober = get_prober(logger, [])
+
+    result = asyncio.run(prober.probe(topic.port))
+
+    assert result["ok"]
+    assert result["data"] == {"version": "Aurora", "players": 12.0, "cpu": 3.5, "mode": "extended"}
+    assert topic.topics == ["?status"]
+
+def test_float_reply(logger, fake):
+    topic = fake(FakeTopicServer.number(2.5))
+    prober = get_prober(logger, [])
+
+    result = asyncio.run(prober.probe(topic.port))
+
+    assert result["ok"]
+    assert result["data"] == {"raw": 2.5}
+
+def test_silent_world_times_out(logger, fake):
+    topic = fake()
+    prober = get_prober(logger, [])
+
+    started = time.monotonic()
+    result = asyncio.run(prober.probe(topic.port))
+
+    assert not result["ok"]
+    assert result["error"] == "TimeoutError"
+    assert time.monotonic() - started < 1
+
+def test_closed_port_fails(logger, fake):
+    topic = fake()
+    topic.close()
+    prober = get_prober(logger, [])
+
+    assert not asyncio.run(prober.probe(topic.port))["ok"]
+
+def test_bad_header_fails(logger, fake):
+    topic = fake(b"HTTP/1.0 400 Bad Request\r\n\r\n")
+    prober = get_prober(logger, [])
+
+    result = asyncio.run(prober.probe(topic.port))
+
+    assert not result["ok"]
+    assert "header" in result["error"]
+
+def test_probe_all_caches_results(logger, fake):
+    up = fake(FakeTopicServer.string("players=3"))
+    down = fake()
+    servers = [StubServer("up", up.port), StubServer("down", down.port)]
+    prober = get_prober(logger, servers)
+
+    asyncio.run(prober.probe_all())
+
+    assert prober.get_health("up")["ok"]
+    assert prober.get_health("up")["data"]["players"] == 3.0
+    assert not prober.get_health("down")["ok"]
+    assert prober.get_health("down")["failures"] == 1
+    assert prober.get_health("unknown") == {"ok": None, "stale": True}
+
+def test_transitions_publish_events(logger, fake):
+    topic = fake(FakeTopicServer.string("players=3"))
+    server = StubServer("a", topic.port)
+    prober = get_prober(logger, [server])
+
+    asyncio.run(prober.probe_all())
+    topic.reply = None
+    asyncio.run(prober.probe_all())
+    topic.reply = FakeTopicServer.string("players=3")
+    asyncio.run(prober.probe_all())
+
+    assert prober.monitor.events.published == [("health_degraded", "a"), ("health_recovered", "a")]
+
+def test_unhealthy_server_is_restarted(logger, fake):
+    topic = fake()
+    server = StubServer("a", topic.port)
+    prober = get_prober(logger, [server], **{"max-failures": 2, "grace": 60})
+
+    for i in range(2):
+        asyncio.run(prober.probe_all())
+
+    assert server.server_thread.restarts == 1
+    assert prober.get_health("a")["failures"] == 0
+
+def test_grace_period_protects_booting_servers(logger, fake):
+    topic = fake()
+    server = StubServer("a", topic.port)
+    server.server_thread.started_at = time.monotonic()
+    prober = get_prober(logger, [server], **{"max-failures": 1, "grace": 60})
+
+    asyncio.run(prober.probe_all())
+
+    assert server.server_thread.restarts == 0
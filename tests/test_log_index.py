@@ -0,0 +1,122 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+import importlib
+import os
+
+import pytest
+
+from ServerMonitor.Subsystems.LogIndex import LogIndex
+
+# The package re-exports the class under the module's name.
+log_index = importlib.import_module("ServerMonitor.Subsystems.LogIndex")
+
+class StubServer:
+    def __init__(self, name, log_path):
+        self.name = name
+        self.log_path = log_path
+
+    def get_log_path(self):
+        return self.log_path
+
+class StubMonitor:
+    servers = []
+
+@pytest.fixture
+def logs(tmp_path):
+    root = tmp_path / "logs"
+    root.mkdir()
+
+    return root, StubServer("s1", str(root)), {"index-path": str(tmp_path / "index")}
+
+def write_log(path, count, start = 0):
+    with open(path, "a") as f:
+        for i in range(start, start + count):
+            f.write("[2016-10-17 12:{0:02d}:{1:02d}] entry {2}\n".format(i // 60 % 60, i % 60, i))
+
+            if i % 7 == 0:
+                f.write("runtime error: bad thing {0}\n  proc name: thing\n".format(i))
+
+def search_all(index, server):
+    return [(entry["time"], entry["severity"], entry["offset"], entry["text"]) for entry in index.search(server, limit=100000)["entries"]]
+
+def test_chunked_reads_match_one_read(logs, logger, monkeypatch):
+    root, server, config = logs
+    write_log(root / "game.log", 500)
+
+    whole = search_all(LogIndex(StubMonitor(), logger, dict(config, **{"index-path": config["index-path"] + "-whole"})), server)
+
+    monkeypatch.setattr(log_index, "MAX_ENTRY", 64)
+    monkeypatch.setattr(log_index, "READ_CHUNK", 256)
+    chunked = search_all(LogIndex(StubMonitor(), logger, config), server)
+
+    assert len(whole) == 500 + 72
+    assert chunked == whole
+
+def test_line_longer_than_a_chunk(logs, logger, monkeypatch):
+    root, server, config = logs
+    monkeypatch.setattr(log_index, "MAX_ENTRY", 64)
+    monkeypatch.setattr(log_index, "READ_CHUNK", 256)
+
+    with open(root / "game.log", "w") as f:
+        f.write("[12:00:00] " + "x" * 2000 + "\n[12:00:01] short\n[12:00:02] last\n")
+
+    entries = search_all(LogIndex(StubMonitor(), logger, config), server)
+
+    assert [text[:16] for _time, _severity, _offset, text in entries] == ["[12:00:00] xxxxx", "[12:00:01] short", "[12:00:02] last"]
+    assert len(entries[0][3]) == 2011
+
+def test_appends_are_picked_up(logs, logger, monkeypatch):
+    root, server, config = logs
+    monkeypatch.setattr(log_index, "READ_CHUNK", 256)
+    index = LogIndex(StubMonitor(), logger, config)
+
+    write_log(root / "game.log", 10)
+    assert len(search_all(index, server)) == 12
+
+    write_log(root / "game.log", 10, 10)
+    assert len(search_all(index, server)) == 23
+
+def test_indexes_of_deleted_logs_are_removed(logs, logger):
+    root, server, config = logs
+    write_log(root / "old.log", 5)
+    write_log(root / "new.log", 5)
+    index = LogIndex(StubMonitor(), logger, config)
+    directory = os.path.join(config["index-path"], "s1")
+
+    index.index_server(server)
+    assert len(os.listdir(directory)) == 2
+
+    os.remove(root / "old.log")
+    # Listings are cached by directory mtime, which may not have ticked over yet.
+    index.listings.clear()
+    index.index_server(server)
+
+    assert os.listdir(directory) == [index.get_index_name("new.log")]
+
+def test_orphaned_indexes_are_removed_on_startup(logs, logger):
+    root, server, config = logs
+    write_log(root / "old.log", 5)
+    write_log(root / "new.log", 5)
+    LogIndex(StubMonitor(), logger, config).index_server(server)
+
+    # Rotated away while no monitor was running.
+    os.remove(root / "old.log")
+    index = LogIndex(StubMonitor(), logger, config)
+    index.index_server(server)
+
+    assert os.listdir(os.path.join(config["index-path"], "s1")) == [index.get_index_name("new.log")]
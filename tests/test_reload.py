@@ -0,0 +1,88 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+import pytest
+import yaml
+
+from ServerMonitor.Subsystems.Config import Config
+from test_federation import start_monitor
+
+@pytest.fixture
+def monitor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    # Reloads only when the test asks for one.
+    monkeypatch.setattr(Config, "watch", lambda self, callback, interval = 2: None)
+
+    monitor, _port = start_monitor(tmp_path, "reload", ["s1", "s2"])
+
+    yield monitor
+
+    monitor.API.stop()
+    monitor.supervisor.stop()
+
+def edit_config(monitor, edit):
+    with open(monitor.config.path) as f:
+        config = yaml.safe_load(f)
+
+    edit(config)
+
+    with open(monitor.config.path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    return config
+
+def test_invalid_server_section_is_rejected_and_retried(monitor):
+    old = monitor.get_server("s1")
+    good = edit_config(monitor, lambda config: config["servers"]["s1"].update({"game-path": "", "port": 4000}))["servers"]["s1"]
+
+    result = monitor.reload_config()
+
+    assert result["diff"]["servers"]["rejected"] == ["s1"]
+    assert monitor.get_server("s1") is old
+    assert monitor.config.get_value("servers")["s1"]["port"] == old.port
+
+    # Fixed in the file. The next reload still sees a change and applies it.
+    good["game-path"] = old.game_path
+    edit_config(monitor, lambda config: config["servers"].update(s1=good))
+
+    result = monitor.reload_config()
+
+    assert result["diff"]["servers"]["replaced"] == ["s1"]
+    assert monitor.get_server("s1").port == 4000
+
+def test_invalid_new_server_is_retried(monitor):
+    section = dict(monitor.config.get_value("servers")["s1"], port=4001)
+    edit_config(monitor, lambda config: config["servers"].update(s3=dict(section, **{"git-path": ""})))
+
+    result = monitor.reload_config()
+
+    assert result["diff"]["servers"]["rejected"] == ["s3"]
+    assert "s3" not in monitor.config.get_value("servers")
+    assert not monitor.get_server("s3")
+
+    edit_config(monitor, lambda config: config["servers"].update(s3=section))
+
+    assert monitor.reload_config()["diff"]["servers"]["added"] == ["s3"]
+
+def test_server_section_must_be_a_mapping(monitor):
+    edit_config(monitor, lambda config: config["servers"].update(s2=["not", "a", "mapping"]))
+
+    result = monitor.reload_config()
+
+    assert result["error"] == "The section of server s2 must be a mapping."
+    assert monitor.config.get_value("servers")["s2"]["port"] == monitor.get_server("s2").port
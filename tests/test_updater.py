@@ -0,0 +1,145 @@
+#    Aurora Server Monitor - a python monitor program created to manage an SS13 server.
+#    Copyright (C) 2016 Skull132
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from ServerMonitor.Subsystems.Updater import Updater
+
+pytestmark = pytest.mark.skipif(not shutil.which("git"), reason="Needs git.")
+
+class StubServer:
+    """The parts of ServerData the updater uses."""
+    def __init__(self, name, git_path, git_branch = None):
+        self.name = name
+        self.git_path = git_path
+        self.git_branch = git_branch
+        self.compile_ready = False
+
+    def get_dme_path(self):
+        return os.path.join(self.git_path, "baystation12.dme")
+
+def git(*args, cwd = None):
+    return subprocess.check_output(["git"] + list(args), cwd=cwd, stderr=subprocess.STDOUT).decode("utf-8").strip()
+
+def commit(work, name, content):
+    with open(os.path.join(work, name), "w") as f:
+        f.write(content)
+
+    git("add", name, cwd=work)
+    git("commit", "-q", "-m", "Change " + name, cwd=work)
+
+    return git("rev-parse", "HEAD", cwd=work)
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    """A bare repository to update from, plus a work tree to push new commits into it with."""
+    for key in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(key, "Test")
+    for key in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(key, "test@example.com")
+
+    bare = str(tmp_path / "upstream.git")
+    work = str(tmp_path / "upstream")
+
+    git("init", "-q", "--bare", bare)
+    git("init", "-q", "-b", "master", work)
+    commit(work, "baystation12.dme", "v1")
+    git("remote", "add", "origin", bare, cwd=work)
+    git("push", "-q", "origin", "master", cwd=work)
+
+    return bare, work
+
+def push(work, name, content, branch = "master"):
+    head = commit(work, name, content)
+    git("push", "-q", "origin", "HEAD:" + branch, cwd=work)
+
+    return head
+
+@pytest.fixture
+def updater(tmp_path, logger, upstream):
+    return Updater(logger, {"object-store": str(tmp_path / "objects.git"), "remote": upstream[0]})
+
+def test_fresh_worktree(tmp_path, updater, upstream):
+    server = StubServer("a", str(tmp_path / "a"))
+
+    status = updater.update([server])
+
+    assert status["fetch"]["state"] == "done"
+    assert status["servers"]["a"]["state"] == "done"
+    assert status["servers"]["a"]["commit"] == git("rev-parse", "HEAD", cwd=upstream[1])
+    assert server.compile_ready
+    assert os.path.isfile(os.path.join(server.git_path, ".git"))
+
+    # Its objects live in the store, not the worktree.
+    assert git("rev-parse", "--git-common-dir", cwd=server.git_path) == updater.store_path
+
+def test_worktrees_follow_new_commits(tmp_path, updater, upstream):
+    servers = [StubServer(name, str(tmp_path / name)) for name in ("a", "b")]
+    updater.update(servers)
+
+    head = push(upstream[1], "baystation12.dme", "v2")
+    status = updater.update(servers)
+
+    for server in servers:
+        assert status["servers"][server.name]["commit"] == head
+
+        with open(server.get_dme_path()) as f:
+            assert f.read() == "v2"
+
+def test_server_branch(tmp_path, updater, upstream):
+    git("checkout", "-q", "-b", "dev", cwd=upstream[1])
+    head = push(upstream[1], "dev.txt", "dev", "dev")
+
+    server = StubServer("a", str(tmp_path / "a"), "dev")
+    status = updater.update([server])
+
+    assert status["servers"]["a"]["branch"] == "dev"
+    assert status["servers"]["a"]["commit"] == head
+
+def test_standalone_clone_borrows_the_store(tmp_path, updater, upstream):
+    clone = str(tmp_path / "clone")
+    git("clone", "-q", upstream[0], clone)
+    head = push(upstream[1], "baystation12.dme", "v2")
+
+    server = StubServer("a", clone)
+    status = updater.update([server])
+
+    assert status["servers"]["a"]["commit"] == head
+
+    with open(os.path.join(clone, ".git", "objects", "info", "alternates")) as f:
+        assert os.path.join(updater.store_path, "objects") in f.read().split()
+
+def test_missing_branch_fails_only_that_server(tmp_path, updater):
+    good = StubServer("good", str(tmp_path / "good"))
+    bad = StubServer("bad", str(tmp_path / "bad"), "nonexistent")
+
+    status = updater.update([good, bad])
+
+    assert status["servers"]["good"]["state"] == "done"
+    assert status["servers"]["bad"]["state"] == "failed"
+    assert not bad.compile_ready
+
+def test_no_remote(tmp_path, logger):
+    updater = Updater(logger, {"object-store": str(tmp_path / "objects.git")})
+
+    with pytest.raises(RuntimeError, match="No update remote"):
+        updater.update([])
+
+    assert updater.get_status()["fetch"]["state"] == "failed"